@@ -0,0 +1,182 @@
+"""ASGI entry point: `gunicorn -c gunicorn.conf.py` with SERVER_MODE=async.
+
+Generation requests are served on the event loop: the OpenAI and ElevenLabs
+calls are awaited with async clients, so one process holds hundreds of
+in-flight generations without a thread each. Everything else (job mode,
+streamed and pipelined generation, reads, audio) is passed to the Flask app,
+which runs in a thread pool as it would under a threaded WSGI server.
+"""
+import io
+import json
+import time
+import asyncio
+import logging
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.wsgi import WsgiToAsgi
+from flask import request
+
+from app import app as flask_app
+from routes import prepare_generation, generation_response, generation_error
+from models import Meditation
+from services.async_pipeline import create_meditation_async
+from services.clients import close_async_clients
+from services.metrics import REQUEST_SECONDS
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+GENERATE_PATH = '/api/generate-meditation'
+
+# Request flags that need the threaded pipeline (job queue, streamed TTS, streamed script)
+THREADED_FLAGS = ('async', 'stream', 'pipelined')
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope whose body has been read"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def _response_parts(rv):
+    """(status, headers, body) of a Flask view return value"""
+    response = flask_app.make_response(rv)
+    headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+    return response.status_code, headers, response.get_data()
+
+class GenerationServer:
+    """ASGI app that generates meditations on the event loop and hands other requests to Flask"""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == GENERATE_PATH:
+            body = await self._read_body(receive)
+            data = self._native_request(scope, body)
+            if data is not None:
+                return await self.generate(scope, body, send)
+            return await self.wsgi(scope, self._replay(body, receive), send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Thread pool for database work and the routes Flask still serves
+                asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(
+                    max_workers=self.app.config['ASYNC_BLOCKING_THREADS'],
+                    thread_name_prefix='asgi-blocking'
+                ))
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def generate(self, scope, body, send):
+        started = time.perf_counter()
+        environ = build_environ(scope, body)
+
+        def prepare():
+            with self.app.request_context(environ):
+                response, plan = prepare_generation(request.json)
+                return (_response_parts(response) if response is not None else None), plan
+
+        # Validation, the cache lookup and admission touch the database; keep them off the loop
+        parts, plan = await asyncio.to_thread(prepare)
+        if parts is None:
+            if plan.wait:
+                logger.info(f"Waiting {plan.wait:.1f}s for upstream capacity")
+                await asyncio.sleep(plan.wait)
+
+            meditation_id = error = None
+            try:
+                meditation_id = await create_meditation_async(
+                    self.app, plan.emotions, plan.goals, plan.outcomes,
+                    cache_key=plan.cache_key, coalesce=plan.coalesce, mode=plan.mode
+                )
+            except Exception as e:
+                error = e
+
+            def respond():
+                with self.app.request_context(environ):
+                    if error is not None:
+                        return _response_parts(generation_error(error))
+                    return _response_parts(generation_response(Meditation.query.get(meditation_id)))
+
+            parts = await asyncio.to_thread(respond)
+
+        status, headers, content = parts
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='generate_meditation', status=status)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    def _native_request(scope, body):
+        """The JSON body if this request can be generated on the event loop, else None"""
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        if any(query.get(flag, [''])[0] for flag in THREADED_FLAGS):
+            return None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            # Let Flask answer malformed bodies exactly as it always has
+            return None
+        if not isinstance(data, dict) or any(data.get(flag) for flag in THREADED_FLAGS):
+            return None
+        return data
+
+    @staticmethod
+    def _replay(body, receive):
+        """receive() that hands the already-read body to Flask first"""
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+        return replay
+
+app = GenerationServer(flask_app)
@@ -0,0 +1,105 @@
+"""Import-time profile of the app's startup, to catch cold-start regressions.
+
+Each scenario runs in a fresh interpreter under `python -X importtime`, with
+the API keys removed from the environment (startup must not need them):
+
+    python -m benchmarks.import_time --budget-ms 600
+
+The report lists the slowest imports by cumulative time. The exit status is
+non-zero when a scenario goes over --budget-ms or imports a module that
+should only be loaded on first use (the upstream SDKs and HTTP clients), so
+this can gate CI.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code each scenario runs in a fresh interpreter
+SCENARIOS = {
+    'import': "import app",
+    'create_app': "from app import create_app; create_app()",
+    'asgi': "import asgi",
+}
+
+# Loaded on first use (a generation, S3 storage, the Redis rate limiter), never at startup
+DEFERRED_MODULES = ('openai', 'requests', 'httpx', 'boto3', 'redis')
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+def profile(code):
+    """(total microseconds, {module: cumulative microseconds}, deferred modules loaded) for one run"""
+    env = {k: v for k, v in os.environ.items() if k not in ('OPENAI_API_KEY', 'ELEVENLABS_API_KEY')}
+    probe = f"{code}\nimport sys\nprint(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', probe],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario failed:\n{result.stderr[-2000:]}")
+
+    total = 0
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        cumulative[name] = cumulative_us
+        # Top-level imports (no nesting) add up to the whole import time
+        if not indent:
+            total += cumulative_us
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    return total, cumulative, loaded
+
+def run_scenario(code, repeat):
+    """Best of `repeat` runs, since the first can be slowed by a cold disk cache"""
+    runs = [profile(code) for _ in range(repeat)]
+    return min(runs, key=lambda run: run[0])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile import time of the app's startup")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="scenarios to run (repeatable)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario; the fastest is reported")
+    parser.add_argument('--top', type=int, default=15, help="slowest imports to list")
+    parser.add_argument('--budget-ms', type=float, default=None, help="fail when a scenario's imports take longer")
+    parser.add_argument('--output', default=None, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failures = []
+    for name in args.scenario or list(SCENARIOS):
+        total, cumulative, loaded = run_scenario(SCENARIOS[name], args.repeat)
+        slowest = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        results[name] = {
+            'total_ms': round(total / 1000, 1),
+            'slowest': [{'module': module, 'cumulative_ms': round(us / 1000, 1)} for module, us in slowest],
+            'deferred_loaded': loaded,
+        }
+
+        print(f"{name}: {total / 1000:.1f} ms")
+        for module, us in slowest:
+            print(f"  {us / 1000:>9.1f} ms  {module}")
+        if loaded:
+            failures.append(f"{name}: imported {', '.join(loaded)} at startup")
+        if args.budget_ms is not None and total / 1000 > args.budget_ms:
+            failures.append(f"{name}: {total / 1000:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if failures:
+        print("Startup regressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("No startup regressions")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
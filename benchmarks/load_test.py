@@ -0,0 +1,268 @@
+"""Load test for /api/generate-meditation against mock upstreams.
+
+By default this starts the mock OpenAI/ElevenLabs server and the Flask app
+in-process (on a throwaway SQLite database and audio directory), then runs
+each concurrency level in turn:
+
+    python -m benchmarks.load_test --profile realistic --concurrency 1,4,16 --requests 50
+
+Use --url to drive an already running deployment instead (e.g. gunicorn with
+OPENAI_BASE_URL/ELEVENLABS_BASE_URL pointing at benchmarks.mock_upstreams),
+and --server-pid to sample that process's memory. --output saves the results
+as JSON; --baseline compares against an earlier run and exits non-zero when
+throughput or latency regressed by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.mock_upstreams import MockUpstreamServer, load_profile, PROFILES
+from services.selections import EMOTIONS, GOALS, OUTCOMES
+
+MODES = ('sync', 'async', 'stream', 'pipelined')
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def rss_bytes(pid=None):
+    """Current resident set size of a process (Linux /proc), or None"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class MemorySampler:
+    """Polls a process's RSS in the background and keeps the peak"""
+
+    def __init__(self, pid=None, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.start_rss = rss_bytes(pid)
+        self.peak_rss = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            current = rss_bytes(self.pid)
+            if current is not None and (self.peak_rss is None or current > self.peak_rss):
+                self.peak_rss = current
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_rss = rss_bytes(self.pid)
+
+def random_selections(rng):
+    return {
+        'emotions': rng.sample(EMOTIONS, rng.randint(1, 2)),
+        'goals': rng.sample(GOALS, rng.randint(1, 2)),
+        'outcomes': rng.sample(OUTCOMES, 1),
+    }
+
+def run_one(session, base_url, mode, fresh, rng, poll_interval):
+    """Generate one meditation; returns (ok, seconds, status)"""
+    payload = random_selections(rng)
+    payload['fresh'] = fresh
+    if mode == 'async':
+        payload['async'] = True
+    elif mode == 'stream':
+        payload['stream'] = True
+    elif mode == 'pipelined':
+        payload['pipelined'] = True
+
+    start = time.perf_counter()
+    try:
+        response = session.post(f"{base_url}/api/generate-meditation", json=payload, timeout=300)
+        if mode == 'async' and response.status_code == 202:
+            job_url = urljoin(base_url + '/', response.headers['Location'])
+            while True:
+                time.sleep(poll_interval)
+                job = session.get(job_url, timeout=30).json()
+                if job['status'] in ('succeeded', 'failed'):
+                    return job['status'] == 'succeeded', time.perf_counter() - start, job['status']
+        return response.status_code in (200, 201), time.perf_counter() - start, response.status_code
+    except requests.RequestException as e:
+        return False, time.perf_counter() - start, type(e).__name__
+
+def run_level(base_url, concurrency, total, mode, fresh_ratio, server_pid, seed, poll_interval):
+    """Run `total` requests with `concurrency` clients and summarize them"""
+    rng = random.Random(seed)
+    plans = [rng.random() < fresh_ratio for _ in range(total)]
+    seeds = [rng.getrandbits(32) for _ in range(total)]
+    local = threading.local()
+
+    def worker(index):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return run_one(local.session, base_url, mode, plans[index], random.Random(seeds[index]), poll_interval)
+
+    with MemorySampler(server_pid) as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(worker, range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [seconds for ok, seconds, _ in results if ok]
+    statuses = {}
+    for _, _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'succeeded': len(latencies),
+        'failed': total - len(latencies),
+        'statuses': statuses,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(max(latencies) if latencies else None),
+        'rss_start_mb': round(memory.start_rss / 2 ** 20, 1) if memory.start_rss else None,
+        'rss_peak_mb': round(memory.peak_rss / 2 ** 20, 1) if memory.peak_rss else None,
+        'rss_end_mb': round(memory.end_rss / 2 ** 20, 1) if memory.end_rss else None,
+    }
+
+def start_local_app(mock_url, workdir):
+    """Start the Flask app in-process against the mocks; returns its base URL"""
+    os.environ.update({
+        'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY') or 'benchmark',
+        'ELEVENLABS_API_KEY': os.environ.get('ELEVENLABS_API_KEY') or 'benchmark',
+        'OPENAI_BASE_URL': f"{mock_url}/v1",
+        'ELEVENLABS_BASE_URL': mock_url,
+        'AUDIO_STORAGE': 'local',
+        'AUDIO_LOCAL_DIR': os.path.join(workdir, 'audio'),
+        'TRANSCODE_ENABLED': 'false',
+        'AUDIO_QUOTA_BYTES': '0',
+        # Measure the pipeline, not the admission limits in front of it
+        'RATE_LIMIT_ENABLED': 'false',
+        'SCRIPT_STAGE_CONCURRENCY': '10000',
+        'AUDIO_STAGE_CONCURRENCY': '10000',
+    })
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'benchmark.db')}")
+
+    # Imported here so the settings above are in place when Config is read
+    from werkzeug.serving import make_server
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+    # Per-request access logs would drown out the results
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def compare(results, baseline, tolerance):
+    """Regressions against a previous run, matched by concurrency level"""
+    previous = {level['concurrency']: level for level in baseline.get('levels', [])}
+    regressions = []
+    for level in results['levels']:
+        before = previous.get(level['concurrency'])
+        if not before:
+            continue
+        if before['rps'] and level['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"c={level['concurrency']}: rps {before['rps']} -> {level['rps']}")
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if before.get(key) and level.get(key) and level[key] > before[key] * (1 + tolerance):
+                regressions.append(f"c={level['concurrency']}: {key} {before[key]} -> {level[key]}")
+    return regressions
+
+def print_table(levels):
+    columns = ('concurrency', 'requests', 'failed', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'rss_peak_mb')
+    print('  '.join(f"{c:>11}" for c in columns))
+    for level in levels:
+        print('  '.join(f"{str(level[c]):>11}" for c in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark meditation generation against mock upstreams")
+    parser.add_argument('--url', default=None, help="drive a running app instead of starting one in-process")
+    parser.add_argument('--server-pid', type=int, default=None, help="process to sample memory from with --url")
+    parser.add_argument('--profile', default='instant', choices=sorted(PROFILES), help="mock upstream profile")
+    parser.add_argument('--set', action='append', default=[], metavar='UPSTREAM.SETTING=VALUE',
+                        help="override a profile setting, e.g. --set openai.latency_ms=200")
+    parser.add_argument('--concurrency', default='1,4,16', help="comma-separated client counts")
+    parser.add_argument('--requests', type=int, default=40, help="requests per concurrency level")
+    parser.add_argument('--mode', default='sync', choices=MODES)
+    parser.add_argument('--fresh-ratio', type=float, default=1.0,
+                        help="share of requests that bypass the meditation cache")
+    parser.add_argument('--poll-interval', type=float, default=0.2, help="job polling interval in async mode")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="write results as JSON")
+    parser.add_argument('--baseline', default=None, help="earlier --output file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed regression, as a fraction")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+
+    mock = None
+    base_url = args.url.rstrip('/') if args.url else None
+    server_pid = args.server_pid
+    if base_url is None:
+        mock = MockUpstreamServer(('127.0.0.1', 0), load_profile(args.profile, args.set)).start()
+        base_url = start_local_app(mock.base_url, tempfile.mkdtemp(prefix='meditation-bench-'))
+        server_pid = os.getpid()
+
+    results = {
+        'profile': args.profile,
+        'overrides': args.set,
+        'mode': args.mode,
+        'fresh_ratio': args.fresh_ratio,
+        'url': args.url,
+        'levels': []
+    }
+    for index, concurrency in enumerate(levels):
+        level = run_level(base_url, concurrency, args.requests, args.mode, args.fresh_ratio,
+                          server_pid, args.seed + index, args.poll_interval)
+        results['levels'].append(level)
+        print(f"c={concurrency}: {level['rps']} req/s, p50 {level['p50_ms']} ms, p99 {level['p99_ms']} ms, "
+              f"{level['failed']} failed", file=sys.stderr)
+    if mock is not None:
+        results['upstream_calls'] = mock.stats.snapshot()
+
+    print_table(results['levels'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
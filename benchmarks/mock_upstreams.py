@@ -0,0 +1,299 @@
+"""Local stand-ins for the OpenAI chat completions and ElevenLabs text-to-speech APIs.
+
+Run on its own and point the app at it:
+
+    python -m benchmarks.mock_upstreams --port 8090 --profile realistic
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 ELEVENLABS_BASE_URL=http://127.0.0.1:8090 python app.py
+
+or let benchmarks/load_test.py start it in-process.
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# One silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, mono, 1152 samples
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0xC4])
+MP3_FRAME_SIZE = 417
+MP3_FRAME_SECONDS = 1152 / 44100
+MP3_FRAME = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+
+# Per-upstream behaviour. Latencies are milliseconds before the first byte;
+# streamed bodies are then paced at tokens_per_second / bytes_per_second.
+PROFILES = {
+    'instant': {
+        'openai': {'latency_ms': 0, 'jitter_ms': 0, 'error_rate': 0.0, 'script_words': 350, 'tokens_per_second': 0},
+        'elevenlabs': {'latency_ms': 0, 'jitter_ms': 0, 'error_rate': 0.0, 'seconds_per_char': 0.065, 'bytes_per_second': 0},
+    },
+    'realistic': {
+        'openai': {'latency_ms': 700, 'jitter_ms': 300, 'error_rate': 0.0, 'script_words': 350, 'tokens_per_second': 80},
+        'elevenlabs': {'latency_ms': 1200, 'jitter_ms': 400, 'error_rate': 0.0, 'seconds_per_char': 0.065, 'bytes_per_second': 256 * 1024},
+    },
+    'flaky': {
+        'openai': {'latency_ms': 300, 'jitter_ms': 200, 'error_rate': 0.1, 'script_words': 350, 'tokens_per_second': 0},
+        'elevenlabs': {'latency_ms': 500, 'jitter_ms': 200, 'error_rate': 0.15, 'seconds_per_char': 0.065, 'bytes_per_second': 0},
+    },
+    'large': {
+        # Scripts well past the 5000-character TTS limit, so synthesis is segmented
+        'openai': {'latency_ms': 300, 'jitter_ms': 100, 'error_rate': 0.0, 'script_words': 1600, 'tokens_per_second': 0},
+        'elevenlabs': {'latency_ms': 600, 'jitter_ms': 200, 'error_rate': 0.0, 'seconds_per_char': 0.065, 'bytes_per_second': 0},
+    },
+}
+
+# Status codes returned for injected errors; 429s carry a Retry-After
+ERROR_STATUSES = (429, 500, 503)
+
+WORDS = (
+    "breathe slowly and notice the gentle rhythm of your body as you settle into "
+    "this moment letting each thought drift past like clouds across a quiet sky "
+    "feel your shoulders soften your jaw release and your hands rest easily"
+).split()
+
+def load_profile(name, overrides=()):
+    """Copy a named profile and apply 'upstream.setting=value' overrides"""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile {name!r}; choose from {', '.join(PROFILES)}")
+    profile = {upstream: dict(settings) for upstream, settings in PROFILES[name].items()}
+    for override in overrides:
+        key, _, value = override.partition('=')
+        upstream, _, setting = key.partition('.')
+        if upstream not in profile or setting not in profile[upstream]:
+            raise ValueError(f"Unknown setting {key!r}")
+        profile[upstream][setting] = type(profile[upstream][setting])(value)
+    return profile
+
+PROGRAM_PROMPT = re.compile(r'Create (\d+) meditation scripts')
+
+def fake_script(words):
+    """Meditation-shaped text with paragraph breaks every ~60 words"""
+    rng = random.Random(words)
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        count = min(remaining, 60)
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(count))
+        paragraphs.append(sentence[0].upper() + sentence[1:] + '.')
+        remaining -= count
+    return "Welcome to this meditation.\n\n" + '\n\n'.join(paragraphs)
+
+def fake_mp3(text, seconds_per_char):
+    """Silent mp3 about as long as ElevenLabs would make for this text"""
+    frames = max(1, int(len(text) * seconds_per_char / MP3_FRAME_SECONDS))
+    return MP3_FRAME * frames
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, upstream, status):
+        with self._lock:
+            key = f"{upstream}:{status}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real APIs, so connection pooling behaves the same
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def profile(self):
+        return self.server.profile
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _wait(self, settings):
+        delay = settings['latency_ms'] + random.uniform(-settings['jitter_ms'], settings['jitter_ms'])
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _maybe_fail(self, upstream, settings, error_body):
+        if random.random() >= settings['error_rate']:
+            return False
+        status = random.choice(ERROR_STATUSES)
+        headers = {'Retry-After': '1'} if status == 429 else None
+        self.server.stats.record(upstream, status)
+        self._send_json(status, error_body(status), headers)
+        return True
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {'detail': 'Not found'})
+
+    def do_POST(self):
+        try:
+            if self.path.rstrip('/').endswith('/chat/completions'):
+                self._chat_completions()
+            elif '/v1/text-to-speech/' in self.path:
+                self._text_to_speech()
+            else:
+                self._send_json(404, {'detail': 'Not found'})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up mid-stream (e.g. a failed generation); nothing to report
+            self.close_connection = True
+
+    def _chat_completions(self):
+        settings = self.profile['openai']
+        request = self._read_json()
+        self._wait(settings)
+        if self._maybe_fail('openai', settings, lambda status: {
+            'error': {'message': 'Rate limit reached' if status == 429 else 'The server had an error', 'type': 'mock_error'}
+        }):
+            return
+
+        script = fake_script(settings['script_words'])
+        # Program prompts ask for several scripts, each opened by a marker line
+        prompt = ' '.join(str(m.get('content', '')) for m in request.get('messages', []))
+        program = PROGRAM_PROMPT.search(prompt)
+        if program:
+            script = '\n\n'.join(f"=== MEDITATION {n} ===\n{script}" for n in range(1, int(program.group(1)) + 1))
+        words = script.split(' ')
+        completion_id = f"chatcmpl-mock{random.getrandbits(48):x}"
+        created = int(time.time())
+        model = request.get('model', 'mock')
+        self.server.stats.record('openai', 200)
+
+        if not request.get('stream'):
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': script},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {
+                    'prompt_tokens': 80,
+                    'completion_tokens': len(words),
+                    'total_tokens': 80 + len(words)
+                }
+            })
+            return
+
+        self._start_chunked('text/event-stream')
+        pause = 1 / settings['tokens_per_second'] if settings['tokens_per_second'] else 0
+        for index, word in enumerate(words):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': word if index == 0 else ' ' + word},
+                    'finish_reason': None
+                }]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            if pause:
+                time.sleep(pause)
+        done = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self._write_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self._end_chunked()
+
+    def _text_to_speech(self):
+        settings = self.profile['elevenlabs']
+        request = self._read_json()
+        self._wait(settings)
+        if self._maybe_fail('elevenlabs', settings, lambda status: {
+            'detail': {'status': 'rate_limited' if status == 429 else 'server_error', 'message': 'Mock upstream error'}
+        }):
+            return
+
+        audio = fake_mp3(request.get('text', ''), settings['seconds_per_char'])
+        self.server.stats.record('elevenlabs', 200)
+        if not settings['bytes_per_second']:
+            self._send(200, audio, 'audio/mpeg')
+            return
+
+        # Paced delivery, so streamed playback and time-to-first-byte can be measured
+        self._start_chunked('audio/mpeg')
+        chunk_size = 16 * 1024
+        for start in range(0, len(audio), chunk_size):
+            chunk = audio[start:start + chunk_size]
+            self._write_chunk(chunk)
+            time.sleep(len(chunk) / settings['bytes_per_second'])
+        self._end_chunked()
+
+class MockUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, profile):
+        super().__init__(address, MockHandler)
+        self.profile = profile
+        self.stats = MockStats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread; returns self"""
+        threading.Thread(target=self.serve_forever, name='mock-upstreams', daemon=True).start()
+        return self
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve mock OpenAI and ElevenLabs APIs for benchmarking")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--profile', default='realistic', choices=sorted(PROFILES))
+    parser.add_argument('--set', action='append', default=[], metavar='UPSTREAM.SETTING=VALUE',
+                        help="override a profile setting, e.g. --set elevenlabs.error_rate=0.2")
+    args = parser.parse_args(argv)
+
+    server = MockUpstreamServer((args.host, args.port), load_profile(args.profile, args.set))
+    print(f"Mock upstreams on {server.base_url} (profile {args.profile})")
+    print(f"  OPENAI_BASE_URL={server.base_url}/v1")
+    print(f"  ELEVENLABS_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
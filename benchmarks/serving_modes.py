@@ -0,0 +1,159 @@
+"""Compare the sync (threaded WSGI) and async (ASGI) serving modes under gunicorn.
+
+Both modes are started with gunicorn.conf.py against the same mock upstreams,
+with one worker each by default, and driven with the same fresh (uncached)
+generation load at each concurrency level:
+
+    python -m benchmarks.serving_modes --profile realistic --concurrency 16,64,256 --requests 256
+
+A sync worker can only have WEB_THREADS generations in flight; an async worker
+keeps accepting them while it awaits the upstreams. Rate limiting is switched
+off and the stage caps raised so the servers themselves are what's measured.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import requests
+
+from benchmarks.mock_upstreams import MockUpstreamServer, load_profile, PROFILES
+from benchmarks.load_test import run_level, print_table
+
+SERVING_MODES = ('sync', 'async')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def worker_pid(master_pid):
+    """PID of a gunicorn master's first worker, for memory sampling"""
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            children = f.read().split()
+        return int(children[0]) if children else master_pid
+    except OSError:
+        return master_pid
+
+def start_server(mode, mock_url, workers, threads, workdir):
+    """Start gunicorn in `mode`; returns (process, base URL) once it accepts requests"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        WEB_THREADS=str(threads),
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY') or 'benchmark',
+        ELEVENLABS_API_KEY=os.environ.get('ELEVENLABS_API_KEY') or 'benchmark',
+        OPENAI_BASE_URL=f"{mock_url}/v1",
+        ELEVENLABS_BASE_URL=mock_url,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        AUDIO_STORAGE='local',
+        AUDIO_LOCAL_DIR=os.path.join(workdir, 'audio'),
+        TRANSCODE_ENABLED='false',
+        AUDIO_QUOTA_BYTES='0',
+        RATE_LIMIT_ENABLED='false',
+        SCRIPT_STAGE_CONCURRENCY='10000',
+        AUDIO_STAGE_CONCURRENCY='10000',
+    )
+    # The app logs every generation at INFO; keep that out of the results
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'ab') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null'],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn ({mode}) exited with status {process.returncode}; see {log_path}")
+        try:
+            requests.get(f"{base_url}/healthz", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn ({mode}) did not start listening on port {port}; see {log_path}")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sync and async serving modes against mock upstreams")
+    parser.add_argument('--profile', default='realistic', choices=sorted(PROFILES), help="mock upstream profile")
+    parser.add_argument('--set', action='append', default=[], metavar='UPSTREAM.SETTING=VALUE',
+                        help="override a profile setting, e.g. --set openai.latency_ms=200")
+    parser.add_argument('--concurrency', default='16,64,256', help="comma-separated client counts")
+    parser.add_argument('--requests', type=int, default=256, help="requests per concurrency level")
+    parser.add_argument('--workers', type=int, default=1, help="gunicorn workers per mode")
+    parser.add_argument('--threads', type=int, default=32, help="threads per worker in sync mode")
+    parser.add_argument('--modes', default=','.join(SERVING_MODES), help="comma-separated serving modes to run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    modes = [m for m in args.modes.split(',') if m.strip()]
+    for mode in modes:
+        if mode not in SERVING_MODES:
+            parser.error(f"unknown serving mode {mode!r}")
+
+    mock = MockUpstreamServer(('127.0.0.1', 0), load_profile(args.profile, args.set)).start()
+    results = {
+        'profile': args.profile,
+        'overrides': args.set,
+        'workers': args.workers,
+        'threads': args.threads,
+        'modes': {}
+    }
+    for mode in modes:
+        process, base_url = start_server(mode, mock.base_url, args.workers, args.threads,
+                                         tempfile.mkdtemp(prefix=f"meditation-serving-{mode}-"))
+        try:
+            pid = worker_pid(process.pid)
+            mode_levels = []
+            for index, concurrency in enumerate(levels):
+                # The same seed per level, so both modes see the same selections
+                level = run_level(base_url, concurrency, args.requests, 'sync', 1.0, pid, args.seed + index, 0.2)
+                mode_levels.append(level)
+                print(f"{mode} c={concurrency}: {level['rps']} req/s, p50 {level['p50_ms']} ms, "
+                      f"p99 {level['p99_ms']} ms, {level['failed']} failed", file=sys.stderr)
+            results['modes'][mode] = mode_levels
+        finally:
+            stop_server(process)
+    results['upstream_calls'] = mock.stats.snapshot()
+
+    for mode, mode_levels in results['modes'].items():
+        print(f"\n{mode}")
+        print_table(mode_levels)
+
+    if set(SERVING_MODES) <= set(results['modes']):
+        print("\nasync vs sync")
+        for sync_level, async_level in zip(results['modes']['sync'], results['modes']['async']):
+            speedup = async_level['rps'] / sync_level['rps'] if sync_level['rps'] else float('inf')
+            print(f"  c={sync_level['concurrency']}: {speedup:.2f}x throughput, "
+                  f"p95 {sync_level['p95_ms']} -> {async_level['p95_ms']} ms, "
+                  f"peak RSS {sync_level['rss_peak_mb']} -> {async_level['rss_peak_mb']} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
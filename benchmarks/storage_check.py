@@ -0,0 +1,147 @@
+"""Contract check for the audio storage backends, with S3 served by moto.
+
+Runs the same operations against LocalAudioStorage (in a temporary
+directory) and S3AudioStorage (against moto's in-memory S3, so no bucket or
+credentials are needed):
+
+    python -m benchmarks.storage_check
+    python -m benchmarks.storage_check --backend s3
+
+Needs `pip install boto3 moto` for the S3 backend. The exit status is
+non-zero when a check fails, so this can gate CI.
+"""
+import os
+import sys
+import argparse
+import tempfile
+from contextlib import contextmanager
+
+from flask import Flask
+
+from services.storage import AudioStorage, LocalAudioStorage, S3AudioStorage, AUDIO_URL_PREFIX
+
+BACKENDS = ('local', 's3')
+
+BUCKET = 'meditation-audio-check'
+
+AUDIO = b'ID3' + bytes(range(256)) * 64
+
+@contextmanager
+def local_storage():
+    with tempfile.TemporaryDirectory(prefix='storage-check-') as root:
+        yield LocalAudioStorage(root=root)
+
+@contextmanager
+def s3_storage():
+    try:
+        import boto3
+        from moto import mock_aws
+    except ImportError:
+        raise RuntimeError("the s3 backend check needs boto3 and moto (pip install boto3 moto)")
+
+    # moto intercepts botocore, but the SDK still wants credentials and a region
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield S3AudioStorage(BUCKET, client=client)
+
+def check_backend(storage):
+    """Run every check against one storage; returns a list of (check, error or None)"""
+    results = []
+
+    def check(name, fn):
+        try:
+            fn()
+            results.append((name, None))
+        except Exception as e:
+            results.append((name, f"{type(e).__name__}: {e}"))
+
+    def expect(value, expected):
+        if value != expected:
+            raise AssertionError(f"expected {expected!r}, got {value!r}")
+
+    def save():
+        expect(storage.save('check.mp3', AUDIO), f"{AUDIO_URL_PREFIX}check.mp3")
+        expect(storage.exists('check.mp3'), True)
+        expect(storage.exists('missing.mp3'), False)
+        expect(storage.size('check.mp3'), len(AUDIO))
+
+    def read():
+        with storage.open('check.mp3') as f:
+            expect(f.read(), AUDIO)
+
+    def save_file():
+        path = os.path.join(storage.spool_dir, 'spooled.mp3.part')
+        with open(path, 'wb') as f:
+            f.write(AUDIO)
+        storage.save_file('spooled.mp3', path)
+        expect(storage.size('spooled.mp3'), len(AUDIO))
+        expect(os.path.exists(path), False)
+
+    def listing():
+        storage.save('renditions/check/opus_32k.opus', b'opus')
+        storage.save('renditions/check/hls/segment_000.ts', b'ts')
+        # Only top-level mp3s are listed; renditions are listed by prefix
+        expect(sorted(f.name for f in storage.list()), ['check.mp3', 'spooled.mp3'])
+        expect(sorted((f.name, f.size) for f in storage.list_prefix('renditions/')),
+               [('renditions/check/hls/segment_000.ts', 2), ('renditions/check/opus_32k.opus', 4)])
+
+    def serve():
+        app = Flask(__name__)
+        with app.test_request_context():
+            response = storage.serve('check.mp3')
+            expect(response.status_code in (200, 302), True)
+            expect(bool(response.headers.get('Cache-Control')), True)
+            response.close()
+
+    def delete():
+        expect(storage.delete_prefix('renditions/check/'), 2)
+        expect(list(storage.list_prefix('renditions/')), [])
+        expect(storage.delete('spooled.mp3'), True)
+        expect(storage.delete('spooled.mp3'), False)
+
+    def incomplete_backend():
+        class Incomplete(AudioStorage):
+            def save(self, name, data):
+                return self.url(name)
+        try:
+            Incomplete()
+        except TypeError:
+            return
+        raise AssertionError("a backend missing abstract methods could be created")
+
+    for name, fn in [('save', save), ('read', read), ('save_file', save_file), ('list', listing),
+                     ('serve', serve), ('delete', delete), ('incomplete backend', incomplete_backend)]:
+        check(name, fn)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the audio storage backends (S3 against moto)")
+    parser.add_argument('--backend', action='append', choices=BACKENDS, help="backends to check (repeatable)")
+    args = parser.parse_args(argv)
+
+    factories = {'local': local_storage, 's3': s3_storage}
+    failures = 0
+    for backend in args.backend or list(BACKENDS):
+        print(backend)
+        try:
+            with factories[backend]() as storage:
+                results = check_backend(storage)
+        except RuntimeError as e:
+            print(f"  skipped: {e}")
+            failures += 1
+            continue
+        for name, error in results:
+            print(f"  {'ok  ' if error is None else 'FAIL'}  {name}{'' if error is None else f': {error}'}")
+            failures += error is not None
+
+    if failures:
+        print(f"{failures} storage checks failed")
+        return 1
+    print("All storage checks passed")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
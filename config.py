@@ -7,3 +7,111 @@ class Config:
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     ELEVENLABS_API_KEY = os.environ.get('ELEVENLABS_API_KEY')
     ELEVENLABS_VOICE_ID = os.environ.get('ELEVENLABS_VOICE_ID', 'sX7PMBZDfORL1SPZi4XW')
+
+    # Rate limiting in front of the paid APIs: token buckets per client and per upstream
+    # ('memory' per process or 'redis' shared across workers), a bounded wait queue,
+    # and concurrency caps for the script (OpenAI) and audio (ElevenLabs) stages
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+    RATE_LIMIT_CLIENT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_CLIENT_PER_MINUTE', 5))
+    RATE_LIMIT_CLIENT_BURST = int(os.environ.get('RATE_LIMIT_CLIENT_BURST', 3))
+    RATE_LIMIT_OPENAI_PER_MINUTE = float(os.environ.get('RATE_LIMIT_OPENAI_PER_MINUTE', 60))
+    RATE_LIMIT_OPENAI_BURST = int(os.environ.get('RATE_LIMIT_OPENAI_BURST', 10))
+    RATE_LIMIT_ELEVENLABS_PER_MINUTE = float(os.environ.get('RATE_LIMIT_ELEVENLABS_PER_MINUTE', 20))
+    RATE_LIMIT_ELEVENLABS_BURST = int(os.environ.get('RATE_LIMIT_ELEVENLABS_BURST', 5))
+    RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', 30))
+    SCRIPT_STAGE_CONCURRENCY = int(os.environ.get('SCRIPT_STAGE_CONCURRENCY', 8))
+    AUDIO_STAGE_CONCURRENCY = int(os.environ.get('AUDIO_STAGE_CONCURRENCY', 4))
+    STAGE_SLOT_TIMEOUT = float(os.environ.get('STAGE_SLOT_TIMEOUT', 120))
+
+    # Generation mode when a request doesn't pick one: 'custom' writes and voices a new
+    # script with OpenAI and ElevenLabs; 'composed' joins pre-built segments locally (build
+    # them with `python -m services.script_composer`) and falls back to custom when a
+    # selection has no segment yet
+    GENERATION_MODE = os.environ.get('GENERATION_MODE', 'custom')
+
+    # Request coalescing: identical generations in flight at once share one result.
+    # COALESCE_ACROSS_PROCESSES extends this to every worker through a lease row in the
+    # database; a lease left by a crashed worker can be taken over after COALESCE_LEASE_SECONDS
+    COALESCE_ENABLED = os.environ.get('COALESCE_ENABLED', 'true').lower() != 'false'
+    COALESCE_ACROSS_PROCESSES = os.environ.get('COALESCE_ACROSS_PROCESSES', 'false').lower() == 'true'
+    COALESCE_LEASE_SECONDS = float(os.environ.get('COALESCE_LEASE_SECONDS', 300))
+    COALESCE_WAIT_TIMEOUT = float(os.environ.get('COALESCE_WAIT_TIMEOUT', 300))
+    COALESCE_POLL_INTERVAL = float(os.environ.get('COALESCE_POLL_INTERVAL', 0.5))
+
+    # Upstream API locations; point these at benchmarks/mock_upstreams.py to run without credits
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # None uses the OpenAI default
+    ELEVENLABS_BASE_URL = os.environ.get('ELEVENLABS_BASE_URL', 'https://api.elevenlabs.io')
+
+    # Meditation cache: how many distinct variants to keep per selection key,
+    # how long cached meditations stay valid, and how many keys stay in memory
+    MEDITATION_CACHE_ENABLED = os.environ.get('MEDITATION_CACHE_ENABLED', 'true').lower() != 'false'
+    MEDITATION_CACHE_VARIANTS = int(os.environ.get('MEDITATION_CACHE_VARIANTS', 1))
+    MEDITATION_CACHE_TTL = int(os.environ.get('MEDITATION_CACHE_TTL', 7 * 24 * 3600))
+    MEDITATION_CACHE_MAX_ENTRIES = int(os.environ.get('MEDITATION_CACHE_MAX_ENTRIES', 1024))
+
+    # Serialized meditation summaries kept in memory for read-heavy endpoints
+    SERIALIZED_CACHE_MAX_ENTRIES = int(os.environ.get('SERIALIZED_CACHE_MAX_ENTRIES', 4096))
+
+    # Background generation jobs: worker threads and how many jobs may wait
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+    JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 32))
+
+    # Batch generation (POST /api/generate-meditations/batch): most meditations per batch,
+    # scripts written per OpenAI completion, and concurrent ElevenLabs requests per batch
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 14))
+    BATCH_SCRIPTS_PER_CALL = int(os.environ.get('BATCH_SCRIPTS_PER_CALL', 4))
+    BATCH_TTS_CONCURRENCY = int(os.environ.get('BATCH_TTS_CONCURRENCY', 3))
+
+    # Segmented speech synthesis: concurrent ElevenLabs requests per meditation
+    TTS_SEGMENT_CONCURRENCY = int(os.environ.get('TTS_SEGMENT_CONCURRENCY', 3))
+
+    # Shared upstream HTTP clients: keep-alive pool sizes and retry backoff for 429/5xx
+    HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+    # Connections per event loop for the async server (SERVER_MODE=async in gunicorn.conf.py)
+    ASYNC_HTTP_POOL_MAXSIZE = int(os.environ.get('ASYNC_HTTP_POOL_MAXSIZE', 500))
+    # Threads the async server uses for database work and for routes still served by Flask
+    ASYNC_BLOCKING_THREADS = int(os.environ.get('ASYNC_BLOCKING_THREADS', 32))
+    UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 3))
+    UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))
+    UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 8.0))
+
+    # Audio storage: 'local' (AUDIO_LOCAL_DIR) or 's3' (any S3-compatible store, e.g. MinIO
+    # via AUDIO_S3_ENDPOINT_URL). AUDIO_PUBLIC_BASE_URL points at a CDN in front of the bucket;
+    # without it clients are redirected to presigned URLs.
+    AUDIO_STORAGE = os.environ.get('AUDIO_STORAGE', 'local')
+    AUDIO_LOCAL_DIR = os.environ.get('AUDIO_LOCAL_DIR', os.path.join('static', 'audio'))
+    AUDIO_S3_BUCKET = os.environ.get('AUDIO_S3_BUCKET')
+    AUDIO_S3_PREFIX = os.environ.get('AUDIO_S3_PREFIX', 'audio/')
+    AUDIO_S3_ENDPOINT_URL = os.environ.get('AUDIO_S3_ENDPOINT_URL')
+    AUDIO_S3_REGION = os.environ.get('AUDIO_S3_REGION')
+    AUDIO_PUBLIC_BASE_URL = os.environ.get('AUDIO_PUBLIC_BASE_URL')
+    AUDIO_PRESIGN_EXPIRES = int(os.environ.get('AUDIO_PRESIGN_EXPIRES', 3600))
+    AUDIO_CACHE_MAX_AGE = int(os.environ.get('AUDIO_CACHE_MAX_AGE', 365 * 24 * 3600))
+
+    # Let the front-end web server send local audio files: 'x-accel-redirect' (nginx,
+    # internal location at AUDIO_ACCEL_PREFIX) or 'x-sendfile' (Apache/lighttpd)
+    AUDIO_SENDFILE = os.environ.get('AUDIO_SENDFILE')
+    AUDIO_ACCEL_PREFIX = os.environ.get('AUDIO_ACCEL_PREFIX', '/protected-audio/')
+
+    # Audio retention: total bytes of stored audio before unsaved meditations are evicted
+    # (least recently played first, never younger than the minimum age; 0 disables),
+    # and how old an unreferenced file must be before it is treated as orphaned
+    AUDIO_QUOTA_BYTES = int(os.environ.get('AUDIO_QUOTA_BYTES', 1024 ** 3))
+    AUDIO_EVICTION_MIN_AGE_SECONDS = int(os.environ.get('AUDIO_EVICTION_MIN_AGE_SECONDS', 24 * 3600))
+    AUDIO_ORPHAN_GRACE_SECONDS = int(os.environ.get('AUDIO_ORPHAN_GRACE_SECONDS', 3600))
+    AUDIO_QUOTA_CHECK_INTERVAL = int(os.environ.get('AUDIO_QUOTA_CHECK_INTERVAL', 300))
+    AUDIO_ACCESS_TOUCH_INTERVAL = int(os.environ.get('AUDIO_ACCESS_TOUCH_INTERVAL', 3600))
+
+    # Background transcoding into an Opus/AAC bitrate ladder plus an HLS playlist
+    # (needs ffmpeg on PATH; skipped when it is missing)
+    TRANSCODE_ENABLED = os.environ.get('TRANSCODE_ENABLED', 'true').lower() != 'false'
+    TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', 2))
+
+    # Latency metrics: /metrics serves Prometheus text; with SERVER_TIMING_ENABLED, API
+    # responses also carry per-stage timings in a Server-Timing header (visible in devtools)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
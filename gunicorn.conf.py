@@ -0,0 +1,43 @@
+"""Production server: `gunicorn -c gunicorn.conf.py`.
+
+SERVER_MODE picks how each worker serves requests:
+  sync   threaded WSGI workers running app:app; every in-flight generation
+         holds one of WEB_THREADS threads while it waits on the upstream APIs
+  async  uvicorn workers running asgi:app; generations are awaited on an
+         event loop, so a worker holds hundreds of them at once
+"""
+import os
+import multiprocessing
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'sync')
+if SERVER_MODE not in ('sync', 'async'):
+    raise ValueError(f"SERVER_MODE must be 'sync' or 'async', not '{SERVER_MODE}'")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count())))
+# Generations take tens of seconds; don't let the arbiter kill workers waiting on upstream
+timeout = int(os.environ.get('WEB_TIMEOUT', 180))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+if SERVER_MODE == 'async':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'app:app'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 32))
+
+def on_starting(server):
+    # Tables are created once, in the master, before any worker imports the app
+    from app import prepare_database
+    prepare_database()
+
+def post_worker_init(worker):
+    # Jobs left unfinished by the previous deployment are resumed by one worker only
+    if worker.age == 1:
+        from app import app
+        from services.job_queue import job_queue
+        with app.app_context():
+            job_queue.resume_pending()
@@ -0,0 +1,119 @@
+from sqlalchemy import inspect, text
+from models import db, Meditation
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns added after the initial schema: (table, column, DDL type)
+ADDED_COLUMNS = [
+    ('meditation', 'cache_key', 'VARCHAR(64)'),
+    ('meditation', 'last_accessed_at', 'TIMESTAMP'),
+    ('meditation', 'renditions', 'TEXT'),
+    ('generation_job', 'results', 'TEXT'),
+]
+
+# Indexes added to existing tables: (index name, table, comma-separated columns)
+ADDED_INDEXES = [
+    ('ix_meditation_cache_key', 'meditation', 'cache_key'),
+    ('ix_meditation_created_at', 'meditation', 'created_at'),
+    ('ix_meditation_saved_created_at', 'meditation', 'saved, created_at, id'),
+]
+
+# Rows updated per commit when backfilling cache keys and tags
+BACKFILL_BATCH_SIZE = 500
+
+def add_missing_columns():
+    """Add columns that db.create_all() won't add to existing tables"""
+    inspector = inspect(db.engine)
+    added = []
+    for table, column, ddl_type in ADDED_COLUMNS:
+        if not inspector.has_table(table):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table)}
+        if column not in existing:
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+            added.append(f"{table}.{column}")
+
+    for index_name, table, columns in ADDED_INDEXES:
+        if not inspector.has_table(table):
+            continue
+        existing = {i['name'] for i in inspector.get_indexes(table)}
+        if index_name not in existing:
+            db.session.execute(text(f'CREATE INDEX {index_name} ON {table} ({columns})'))
+
+    db.session.commit()
+    if added:
+        logger.info(f"Added columns: {', '.join(added)}")
+    return added
+
+def backfill_cache_keys(batch_size=BACKFILL_BATCH_SIZE):
+    """Key meditations created before the cache existed under the legacy prompt version.
+
+    Which prompt, model and token limit wrote these scripts isn't recorded,
+    and some were cut off at the old max_tokens, so they must never be served
+    for current requests. A legacy key keeps them out of cache lookups while
+    still grouping repeated selections together.
+    """
+    from services.meditation_cache import cache_key_for
+    from services.script_generator import LEGACY_PROMPT_VERSION
+
+    count = 0
+    last_id = 0
+    while True:
+        # Walk by id so each batch is a short transaction and work already done is skipped
+        batch = (
+            Meditation.query
+            .filter(Meditation.id > last_id)
+            .filter(Meditation.cache_key.is_(None))
+            .order_by(Meditation.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for meditation in batch:
+            meditation.cache_key = cache_key_for(
+                meditation.get_emotions(), meditation.get_goals(), meditation.get_outcomes(),
+                prompt_version=LEGACY_PROMPT_VERSION
+            )
+            last_id = meditation.id
+        count += len(batch)
+        db.session.commit()
+    if count:
+        logger.info(f"Backfilled legacy cache keys for {count} meditations")
+    return count
+
+def backfill_tags(batch_size=BACKFILL_BATCH_SIZE):
+    """Create tag links from the JSON selection columns of untagged meditations"""
+    count = 0
+    last_id = 0
+    while True:
+        # Walk by id so each batch is a short transaction and work already done is skipped
+        batch = (
+            Meditation.query
+            .filter(Meditation.id > last_id)
+            .filter(~Meditation.tag_links.any())
+            .order_by(Meditation.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for meditation in batch:
+            emotions, goals, outcomes = meditation.get_emotions(), meditation.get_goals(), meditation.get_outcomes()
+            meditation.set_tags('emotion', emotions)
+            meditation.set_tags('goal', goals)
+            meditation.set_tags('outcome', outcomes)
+            count += bool(meditation.tag_links)
+            last_id = meditation.id
+        db.session.commit()
+    if count:
+        logger.info(f"Backfilled tags for {count} meditations")
+    return count
+
+def upgrade():
+    """Bring an existing database up to the current schema (idempotent)"""
+    db.create_all()
+    add_missing_columns()
+    backfill_cache_keys()
+    backfill_tags()
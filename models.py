@@ -1,9 +1,62 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import json
 
 db = SQLAlchemy()
 
+# Kinds of selection stored as tags
+TAG_KINDS = ('emotion', 'goal', 'outcome')
+
+def normalize_tag(name):
+    """Case-insensitive form used to match tags"""
+    return name.strip().casefold()
+
+class Tag(db.Model):
+    """One selectable emotion, goal or outcome"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)     # emotion, goal or outcome
+    name = db.Column(db.String(64), nullable=False)     # as first selected, for display
+    normalized = db.Column(db.String(64), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'normalized', name='uq_tag_kind_normalized'),
+    )
+
+    def __repr__(self):
+        return f'<Tag {self.kind}:{self.name}>'
+
+    @classmethod
+    def find(cls, kind, name):
+        return cls.query.filter_by(kind=kind, normalized=normalize_tag(name)).first()
+
+    @classmethod
+    def get_or_create(cls, kind, name):
+        """Existing tag for this kind and name, or a new one (safe against concurrent inserts)"""
+        tag = cls.find(kind, name)
+        if tag:
+            return tag
+        try:
+            with db.session.begin_nested():
+                tag = cls(kind=kind, name=name.strip(), normalized=normalize_tag(name))
+                db.session.add(tag)
+            return tag
+        except IntegrityError:
+            # Another request created it first
+            return cls.find(kind, name)
+
+class MeditationTag(db.Model):
+    """Links a meditation to its selected tags, keeping the order they were chosen in"""
+    meditation_id = db.Column(db.Integer, db.ForeignKey('meditation.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    tag = db.relationship('Tag', lazy='joined')
+
+    # Filtering by tag goes tag -> meditations
+    __table_args__ = (
+        db.Index('ix_meditation_tag_tag_id', 'tag_id', 'meditation_id'),
+    )
+
 class Meditation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=True)  # Optional title for saved meditations
@@ -11,52 +64,103 @@ class Meditation(db.Model):
     audio_url = db.Column(db.String(255), nullable=False)
     duration_seconds = db.Column(db.Integer, nullable=True)  # Duration in seconds
     
-    # Metadata fields for user selections
+    # Metadata fields for user selections. The JSON copies are kept for older
+    # readers; queries and API responses use the normalized tags below.
     emotions = db.Column(db.Text, nullable=True)  # JSON string of emotions
     goals = db.Column(db.Text, nullable=True)     # JSON string of goals
     outcomes = db.Column(db.Text, nullable=True)  # JSON string of outcomes
+    tag_links = db.relationship(
+        'MeditationTag', order_by='MeditationTag.position', lazy='selectin',
+        cascade='all, delete-orphan', passive_deletes=True
+    )
+    
+    # Hash of the normalized selections plus model/voice/prompt version,
+    # used to serve repeated combinations from the meditation cache
+    cache_key = db.Column(db.String(64), nullable=True, index=True)
+    
+    # Transcoded renditions (JSON list of {name, url, mime_type, bitrate_kbps}),
+    # filled in after generation by the transcoder
+    renditions = db.Column(db.Text, nullable=True)
     
     # Save this in library
     saved = db.Column(db.Boolean, default=False)
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_accessed_at = db.Column(db.DateTime, default=datetime.utcnow)  # LRU order for audio eviction
+
+    # Library listing: saved filter plus newest-first keyset order
+    __table_args__ = (
+        db.Index('ix_meditation_saved_created_at', 'saved', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f'<Meditation {self.id}>'
     
+    def set_tags(self, kind, names):
+        """Replace the tags of one kind, keeping the order given"""
+        links = [link for link in self.tag_links if link.tag.kind != kind]
+        seen = set()
+        for position, name in enumerate(names or []):
+            if not name or not name.strip() or normalize_tag(name) in seen:
+                continue
+            seen.add(normalize_tag(name))
+            tag = Tag.get_or_create(kind, name)
+            links.append(MeditationTag(tag=tag, position=position))
+        self.tag_links = links
+    
+    def get_tags(self, kind):
+        """Tag names of one kind, in selection order"""
+        return [link.tag.name for link in self.tag_links if link.tag.kind == kind]
+    
+    def _get_selections(self, kind, json_value):
+        # Rows created before tags existed only have the JSON copy until backfilled
+        if self.tag_links:
+            return self.get_tags(kind)
+        if json_value:
+            return json.loads(json_value)
+        return []
+    
     def set_emotions(self, emotions_list):
-        """Store emotions as JSON string"""
+        """Store emotions as tags and a JSON string"""
         if emotions_list:
             self.emotions = json.dumps(emotions_list)
+            self.set_tags('emotion', emotions_list)
     
     def get_emotions(self):
         """Get emotions as Python list"""
-        if self.emotions:
-            return json.loads(self.emotions)
-        return []
+        return self._get_selections('emotion', self.emotions)
     
     def set_goals(self, goals_list):
-        """Store goals as JSON string"""
+        """Store goals as tags and a JSON string"""
         if goals_list:
             self.goals = json.dumps(goals_list)
+            self.set_tags('goal', goals_list)
     
     def get_goals(self):
         """Get goals as Python list"""
-        if self.goals:
-            return json.loads(self.goals)
-        return []
+        return self._get_selections('goal', self.goals)
     
     def set_outcomes(self, outcomes_list):
-        """Store outcomes as JSON string"""
+        """Store outcomes as tags and a JSON string"""
         if outcomes_list:
             self.outcomes = json.dumps(outcomes_list)
+            self.set_tags('outcome', outcomes_list)
     
     def get_outcomes(self):
         """Get outcomes as Python list"""
-        if self.outcomes:
-            return json.loads(self.outcomes)
+        return self._get_selections('outcome', self.outcomes)
+    
+    def set_renditions(self, renditions_list):
+        """Store renditions as JSON string"""
+        if renditions_list:
+            self.renditions = json.dumps(renditions_list)
+    
+    def get_renditions(self):
+        """Get renditions as Python list"""
+        if self.renditions:
+            return json.loads(self.renditions)
         return []
     
     def to_dict(self):
@@ -70,6 +174,111 @@ class Meditation(db.Model):
             'emotions': self.get_emotions(),
             'goals': self.get_goals(),
             'outcomes': self.get_outcomes(),
+            'renditions': self.get_renditions(),
             'saved': self.saved,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class GenerationJob(db.Model):
+    """A queued meditation generation, persisted so it survives restarts"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, succeeded, failed
+    stage = db.Column(db.String(20), nullable=False, default='queued')  # queued, script, audio, saving, done
+    
+    # Request parameters
+    params = db.Column(db.Text, nullable=False)  # JSON string of emotions/goals/outcomes
+    cache_key = db.Column(db.String(64), nullable=True)
+    
+    # Per-item progress of a batch job (JSON list), updated as items finish
+    results = db.Column(db.Text, nullable=True)
+    
+    # Result
+    meditation_id = db.Column(db.Integer, db.ForeignKey('meditation.id'), nullable=True)
+    meditation = db.relationship('Meditation')
+    error = db.Column(db.Text, nullable=True)
+    error_type = db.Column(db.String(32), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<GenerationJob {self.id} {self.status}>'
+    
+    def set_params(self, params):
+        """Store request parameters as JSON string"""
+        self.params = json.dumps(params)
+    
+    def get_params(self):
+        """Get request parameters as Python dict"""
+        if self.params:
+            return json.loads(self.params)
+        return {}
+    
+    def set_results(self, results):
+        """Store per-item batch results as JSON string"""
+        self.results = json.dumps(results)
+    
+    def get_results(self):
+        """Get per-item batch results as a list (empty for single generations)"""
+        if self.results:
+            return json.loads(self.results)
+        return []
+    
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+    
+    def to_dict(self):
+        """Convert job to dictionary for API responses"""
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'meditation_id': self.meditation_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+        if self.status == 'succeeded' and self.meditation:
+            data['meditation'] = self.meditation.to_dict()
+        if self.results:
+            items = self.get_results()
+            data['items'] = items
+            data['succeeded_items'] = sum(1 for item in items if item['status'] == 'succeeded')
+            data['failed_items'] = sum(1 for item in items if item['status'] == 'failed')
+        if self.status == 'failed':
+            data['error'] = self.error
+            data['error_type'] = self.error_type
+        return data
+
+class ScriptSegment(db.Model):
+    """A pre-generated, pre-synthesized part of a script that composed meditations are assembled from"""
+    id = db.Column(db.Integer, primary_key=True)
+    slot = db.Column(db.String(20), nullable=False)  # welcome, breathing, emotion, goal, outcome, closing
+    selection = db.Column(db.String(100), nullable=False, default='')  # normalized tag, '' for shared slots
+    text = db.Column(db.Text, nullable=False)
+    audio_url = db.Column(db.String(255), nullable=False)
+
+    # Segments are only joined with others spoken by the same voice and model
+    voice_id = db.Column(db.String(64), nullable=False)
+    tts_model = db.Column(db.String(64), nullable=False)
+    prompt_version = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_script_segment_lookup', 'voice_id', 'slot', 'selection'),
+    )
+
+    def __repr__(self):
+        return f'<ScriptSegment {self.slot}:{self.selection} {self.id}>'
+
+class GenerationLease(db.Model):
+    """Marks a cache key as being generated, so other processes wait instead of duplicating it"""
+    cache_key = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(32), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<GenerationLease {self.cache_key[:12]} {self.owner}>'
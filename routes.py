@@ -0,0 +1,454 @@
+from flask import Blueprint, current_app, render_template, request, jsonify, redirect, Response, stream_with_context, g, abort
+from sqlalchemy import text
+from sqlalchemy.orm import defer
+from models import db, Meditation, GenerationJob
+from services.pipeline import create_meditation
+from services.job_queue import job_queue, QueueFullError
+from services.audio_generator import get_active_stream, stream_url_for, open_spooled_part, iter_spooled_bytes
+from services.clients import upstream_stats
+from services.metrics import timed_stage, server_timing_header, render_prometheus, REQUEST_SECONDS, STAGE_SECONDS, RATE_LIMITED
+from services.rate_limit import admit_generation, client_id, RateLimitedError, UPSTREAMS
+from services.generation import clean_selections, selection_errors, cached_meditation
+from services.batch import item_result, upstream_costs
+from services.script_composer import can_compose
+from services.storage import get_storage
+from services.audio_retention import RetentionReport, record_access, run_retention, sweep_orphans
+from services.meditation_cache import get_meditation_cache, cache_key_for
+from services.library import list_meditations
+from services.serialization import (
+    parse_fields, serialize_meditation, row_version, etag_for, not_modified, set_validators, LIST_FIELDS,
+    get_serialized_cache
+)
+from collections import namedtuple
+import math
+import time
+
+# Every route of the app; registered by create_app() in app.py
+bp = Blueprint('meditations', __name__)
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_timing(response):
+    """Observe API latency and, when enabled, report stage timings to the client"""
+    started = g.pop('request_started', None)
+    if started is None or not request.path.startswith('/api/'):
+        return response
+    elapsed = time.perf_counter() - started
+    # Labelled by view name, without the blueprint prefix
+    endpoint = request.endpoint.rpartition('.')[2] if request.endpoint else 'unknown'
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=response.status_code)
+    if current_app.config['SERVER_TIMING_ENABLED']:
+        stages = server_timing_header()
+        total = f"total;dur={elapsed * 1000:.1f}"
+        response.headers['Server-Timing'] = f"{stages}, {total}" if stages else total
+    return response
+
+@bp.route('/')
+def index():
+    return render_template('index.html')
+
+# A validated, admitted generation request
+GenerationPlan = namedtuple('GenerationPlan', 'emotions goals outcomes mode cache_key coalesce stream_audio pipelined job wait')
+
+def prepare_generation(data):
+    """Validate a generation request, serve it from the cache or admit it.
+
+    Returns (response, None) when the request is already answered (validation
+    error, cache hit, 429) or (None, GenerationPlan) when it should generate.
+    Shared by the Flask view and the async server in asgi.py.
+    """
+    current_app.logger.info(f"Received meditation generation request with data: {data}")
+    
+    # Detailed validation with specific error messages
+    if not data:
+        current_app.logger.error("No JSON data received in request")
+        return (jsonify({'error': 'No data received. Please provide meditation parameters.'}), 400), None
+    
+    # Sanitize inputs
+    try:
+        emotions, goals, outcomes = clean_selections(data.get('emotions', []), data.get('goals', []), data.get('outcomes', []))
+    except Exception as e:
+        current_app.logger.error(f"Input data parsing error: {e}")
+        return (jsonify({'error': 'Invalid input format. Please refresh and try again.'}), 400), None
+
+    # 'composed' assembles pre-built segments; 'custom' writes a whole new script
+    mode = data.get('mode') or request.args.get('mode') or current_app.config['GENERATION_MODE']
+    validation_errors = selection_errors(emotions, goals, outcomes, mode)
+    if validation_errors:
+        error_message = " ".join(validation_errors)
+        current_app.logger.error(f"Validation error: {error_message}")
+        return (jsonify({
+            'error': error_message,
+            'validation_errors': validation_errors
+        }), 400), None
+
+    # Serve repeated selection combinations from the cache unless a fresh one is requested
+    cache_key = cache_key_for(emotions, goals, outcomes, mode=mode)
+    if not data.get('fresh'):
+        cached = cached_meditation(cache_key)
+        if cached:
+            with timed_stage('serialize'):
+                response = serialize_meditation(cached)
+                response['cached'] = True
+                body = jsonify(response)
+            return (body, 200), None
+
+    # Admission control: answer 429 now rather than fail against a saturated upstream later
+    try:
+        # Composed meditations don't call the paid APIs, so only the client's own budget applies;
+        # selections the segment library can't cover fall back to a custom script and are admitted as one
+        composable = mode == 'composed' and can_compose(emotions, goals, outcomes)
+        wait = admit_generation(client_id(), upstreams=() if composable else UPSTREAMS)
+    except RateLimitedError as e:
+        return rate_limited_response(e), None
+
+    return None, GenerationPlan(
+        emotions=emotions,
+        goals=goals,
+        outcomes=outcomes,
+        mode=mode,
+        cache_key=cache_key,
+        # A fresh request wants its own variant, so it isn't merged with identical in-flight ones
+        coalesce=not data.get('fresh'),
+        stream_audio=bool(data.get('stream') or request.args.get('stream')),
+        pipelined=bool(data.get('pipelined') or request.args.get('pipelined')),
+        job=bool(data.get('async') or request.args.get('async')),
+        wait=wait
+    )
+
+def rate_limited_response(e):
+    """429 response for a request turned away by admission control"""
+    RATE_LIMITED.inc(scope=e.scope)
+    retry_after = max(1, math.ceil(e.retry_after))
+    current_app.logger.warning(f"Rate limited ({e.scope}), retry after {retry_after}s")
+    response = jsonify({'error': str(e), 'error_type': 'rate_limited', 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def queue_full_response(e):
+    """503 response for a job the queue has no room for"""
+    current_app.logger.warning(f"Job queue full: {e}")
+    response = jsonify({'error': str(e), 'error_type': 'queue_full'})
+    response.headers['Retry-After'] = '10'
+    return response, 503
+
+def job_accepted_response(job, wait):
+    """202 response pointing the client at a queued job"""
+    body = job.to_dict()
+    body['estimated_wait_seconds'] = math.ceil(wait)
+    response = jsonify(body)
+    response.headers['Location'] = f"/api/jobs/{job.id}"
+    return response, 202
+
+def generation_response(meditation):
+    """201 response for a newly generated meditation"""
+    # Use the to_dict method to create a consistent response
+    with timed_stage('serialize'):
+        response = serialize_meditation(meditation)
+        response['stream_url'] = stream_url_for(meditation.audio_url)
+        body = jsonify(response)
+    return body, 201
+
+def generation_error(e):
+    """Error response for an exception raised while generating"""
+    if isinstance(e, ValueError):
+        current_app.logger.error(f"Value error in generate_meditation: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'error_type': 'value_error'
+        }), 400
+    if isinstance(e, RuntimeError):
+        current_app.logger.error(f"Runtime error in generate_meditation: {str(e)}")
+        return jsonify({
+            'error': str(e),
+            'error_type': 'runtime_error',
+            'message': 'There was a problem with the meditation generation service.'
+        }), 500
+    current_app.logger.error(f"Unexpected error in generate_meditation: {str(e)}", exc_info=e)
+    return jsonify({
+        'error': 'An unexpected error occurred. Please try again later.',
+        'error_type': 'unexpected_error',
+        'message': 'Our servers encountered an issue while generating your meditation.'
+    }), 500
+
+@bp.route('/api/generate-meditation', methods=['POST'])
+def generate_meditation():
+    response, plan = prepare_generation(request.json)
+    if response is not None:
+        return response
+
+    # Job mode: queue the work and let the client poll /api/jobs/<id>. A request that has to
+    # wait for upstream capacity is queued as a delayed job too, so it doesn't hold a request thread
+    if plan.job or plan.wait:
+        if not plan.job:
+            current_app.logger.info(f"Queueing request as a job to wait {plan.wait:.1f}s for upstream capacity")
+        try:
+            job = job_queue.submit(plan.emotions, plan.goals, plan.outcomes, cache_key=plan.cache_key, stream_audio=plan.stream_audio,
+                                   pipelined=plan.pipelined, delay=plan.wait, coalesce=plan.coalesce, mode=plan.mode)
+        except QueueFullError as e:
+            return queue_full_response(e)
+        return job_accepted_response(job, plan.wait)
+
+    try:
+        meditation = create_meditation(plan.emotions, plan.goals, plan.outcomes, cache_key=plan.cache_key, stream_audio=plan.stream_audio,
+                                       pipelined=plan.pipelined, coalesce=plan.coalesce, mode=plan.mode)
+        return generation_response(meditation)
+    except Exception as e:
+        return generation_error(e)
+
+@bp.route('/api/generate-meditations/batch', methods=['POST'])
+def generate_meditation_batch():
+    """Queue a program of several meditations as one job.
+
+    The body has `items`, a list of {emotions, goals, outcomes} selections,
+    plus optional `fresh` and `mode` that apply to every item. Repeated
+    selections within a batch get distinct variants. Progress and per-item
+    results (including partial failures) are polled at /api/jobs/<id>.
+    """
+    data = request.json
+    current_app.logger.info(f"Received batch generation request with data: {data}")
+    max_items = current_app.config['BATCH_MAX_ITEMS']
+    entries = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'Please provide a list of meditations to generate in "items".'}), 400
+    if len(entries) > max_items:
+        return jsonify({'error': f"Please request at most {max_items} meditations per batch."}), 400
+
+    mode = data.get('mode') or request.args.get('mode') or current_app.config['GENERATION_MODE']
+    items = []
+    item_errors = []
+    for index, entry in enumerate(entries):
+        try:
+            emotions, goals, outcomes = clean_selections(entry.get('emotions', []), entry.get('goals', []), entry.get('outcomes', []))
+        except Exception as e:
+            current_app.logger.error(f"Input data parsing error in batch item {index}: {e}")
+            item_errors.append({'index': index, 'validation_errors': ['Invalid input format. Please refresh and try again.']})
+            continue
+        errors = selection_errors(emotions, goals, outcomes, mode)
+        if errors:
+            item_errors.append({'index': index, 'validation_errors': errors})
+        items.append({
+            'emotions': emotions,
+            'goals': goals,
+            'outcomes': outcomes,
+            'cache_key': cache_key_for(emotions, goals, outcomes, mode=mode)
+        })
+    if item_errors:
+        current_app.logger.error(f"Validation errors in batch: {item_errors}")
+        return jsonify({
+            'error': 'Some meditations in this batch are invalid.',
+            'item_errors': item_errors
+        }), 400
+
+    # Each distinct selection may be served from the cache once; repeats are new variants
+    results = []
+    seen = set()
+    for index, item in enumerate(items):
+        cached = None
+        if not data.get('fresh') and item['cache_key'] not in seen:
+            cached = cached_meditation(item['cache_key'])
+        seen.add(item['cache_key'])
+        results.append(item_result(index, 'succeeded', cached.id, True) if cached else item_result(index))
+
+    # Admission reserves every upstream call the batch will make, not one per request;
+    # composed items only call upstream when the segment library can't cover them
+    generating = sum(
+        1 for item, result in zip(items, results)
+        if result['status'] != 'succeeded'
+        and not (mode == 'composed' and can_compose(item['emotions'], item['goals'], item['outcomes']))
+    )
+    try:
+        wait = admit_generation(
+            client_id(), upstreams=UPSTREAMS if generating else (),
+            costs=upstream_costs(generating)
+        )
+    except RateLimitedError as e:
+        return rate_limited_response(e)
+
+    try:
+        job = job_queue.submit_batch(items, results, delay=wait, mode=mode)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return job_accepted_response(job, wait)
+
+@bp.route('/api/meditations', methods=['GET'])
+def library():
+    """Page through meditations, newest first, optionally filtered by saved flag and selections"""
+    saved = request.args.get('saved')
+    try:
+        fields = parse_fields(request.args.get('fields'), default=LIST_FIELDS)
+        meditations, next_cursor = list_meditations(
+            saved=None if saved is None else saved.lower() in ('1', 'true', 'yes'),
+            emotions=request.args.getlist('emotion'),
+            goals=request.args.getlist('goal'),
+            outcomes=request.args.getlist('outcome'),
+            limit=request.args.get('limit', 20, type=int),
+            cursor=request.args.get('cursor'),
+            load_script='script' in fields
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e), 'error_type': 'value_error'}), 400
+
+    # The page is unchanged while the same rows are at the same versions
+    versions = [row_version(m.updated_at, m.created_at) for m in meditations]
+    page = ';'.join(f"{m.id}@{v.isoformat() if v else ''}" for m, v in zip(meditations, versions))
+    etag = etag_for('library', request.query_string.decode('utf-8', 'replace'), None, fields, page)
+    last_modified = max((v for v in versions if v), default=None)
+    if not_modified(etag, last_modified):
+        return set_validators(Response(status=304), etag, last_modified)
+
+    response = jsonify({
+        'meditations': [serialize_meditation(meditation, fields) for meditation in meditations],
+        'next_cursor': next_cursor
+    })
+    return set_validators(response, etag, last_modified)
+
+@bp.route('/api/meditation/<int:meditation_id>', methods=['GET'])
+def get_meditation(meditation_id):
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'error_type': 'value_error'}), 400
+
+    # Revalidation only needs the timestamps, not the whole row
+    row = db.session.query(
+        Meditation.id, Meditation.updated_at, Meditation.created_at, Meditation.last_accessed_at
+    ).filter(Meditation.id == meditation_id).first()
+    if row is None:
+        abort(404)
+    record_access(row)
+
+    version = row_version(row.updated_at, row.created_at)
+    etag = etag_for('meditation', row.id, version, fields)
+    if not_modified(etag, version):
+        return set_validators(Response(status=304), etag, version)
+
+    query = Meditation.query if 'script' in fields else Meditation.query.options(defer(Meditation.script))
+    meditation = query.get_or_404(meditation_id)
+    return set_validators(jsonify(serialize_meditation(meditation, fields)), etag, version)
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = GenerationJob.query.get_or_404(job_id)
+    response = job.to_dict()
+    if 'meditation' in response:
+        response['meditation']['stream_url'] = stream_url_for(job.meditation.audio_url)
+    # Batch items link their meditations' summaries; scripts are fetched per meditation
+    ids = [item['meditation_id'] for item in response.get('items', []) if item['meditation_id']]
+    if ids:
+        meditations = Meditation.query.options(defer(Meditation.script)).filter(Meditation.id.in_(ids)).all()
+        summaries = {m.id: serialize_meditation(m, LIST_FIELDS) for m in meditations}
+        for item in response['items']:
+            if item['meditation_id'] in summaries:
+                item['meditation'] = summaries[item['meditation_id']]
+    return jsonify(response)
+
+@bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = get_meditation_cache().stats()
+    stats['serialized'] = get_serialized_cache().stats()
+    return jsonify(stats)
+
+@bp.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats_view():
+    return jsonify(upstream_stats.snapshot())
+
+@bp.route('/api/metrics/latency', methods=['GET'])
+def latency_stats():
+    """Per-stage latency percentiles as JSON"""
+    return jsonify({stage: stats for (stage,), stats in STAGE_SECONDS.percentiles().items()})
+
+@bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/healthz')
+def health():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@bp.route('/readyz')
+def readiness():
+    """Readiness probe: the database answers and the upstream API keys are configured"""
+    checks = {}
+    try:
+        db.session.execute(text('SELECT 1'))
+        checks['database'] = 'ok'
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Readiness check failed, database unavailable: {e}")
+        checks['database'] = 'unavailable'
+    # Keys are only needed once a generation calls the APIs, so they aren't checked at startup
+    for name in ('OPENAI_API_KEY', 'ELEVENLABS_API_KEY'):
+        checks[name.lower()] = 'ok' if current_app.config.get(name) else 'missing'
+
+    ready = all(status == 'ok' for status in checks.values())
+    return jsonify({'status': 'ready' if ready else 'not_ready', 'checks': checks}), 200 if ready else 503
+
+@bp.route('/static/audio/<path:filename>')
+def serve_audio(filename):
+    return get_storage().serve(filename)
+
+@bp.route('/api/audio-stream/<path:filename>')
+def stream_audio_file(filename):
+    """Play audio while it is still being synthesized, falling back to the finished file.
+
+    A stream running in another worker process is followed through its spool
+    file, which works when the workers share a machine (or the local storage
+    directory). A worker on another machine can't see it, so it answers 503
+    with Retry-After until the finished file is in storage.
+    """
+    stream = get_active_stream(filename)
+    if stream is not None and stream.error is None:
+        body = stream_with_context(stream.iter_bytes())
+    else:
+        part = open_spooled_part(filename)
+        if part is None:
+            storage = get_storage()
+            if storage.exists(filename):
+                return redirect(storage.url(filename))
+            response = jsonify({'error': 'This audio is not available yet. Please try again shortly.', 'error_type': 'not_ready'})
+            response.headers['Retry-After'] = '2'
+            return response, 503
+        body = iter_spooled_bytes(part)
+    return Response(body, mimetype='audio/mpeg', headers={'Cache-Control': 'no-store'})
+
+@bp.route('/api/storage/cleanup', methods=['POST'])
+def storage_cleanup():
+    """Deduplicate audio, delete orphaned files and enforce the disk quota"""
+    data = request.get_json(silent=True) or {}
+    dry_run = bool(data.get('dry_run') or request.args.get('dry_run'))
+    try:
+        report = run_retention(dry_run=dry_run)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error cleaning up audio storage: {str(e)}", exc_info=True)
+        return jsonify({'error': f"Error cleaning up audio storage: {str(e)}"}), 500
+    return jsonify(report.to_dict()), 200
+
+@bp.route('/api/reset-db', methods=['POST'])
+def reset_db():
+    """Reset the database (development only)"""
+    try:
+        db.drop_all()
+        db.create_all()
+        # No meditation refers to any audio now, so remove the files as well
+        report = RetentionReport()
+        sweep_orphans(report, grace_seconds=0)
+        get_meditation_cache().invalidate()
+        get_serialized_cache().invalidate()
+        current_app.logger.info(f"Database reset successfully, reclaimed {report.bytes_reclaimed} bytes of audio")
+        return jsonify({
+            'message': 'Database reset successfully',
+            'files_deleted': report.files_deleted,
+            'bytes_reclaimed': report.bytes_reclaimed
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"Error resetting database: {str(e)}")
+        return jsonify({'error': f"Error resetting database: {str(e)}"}), 500
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+
+from services.pipeline import create_meditation, save_meditation
+from services.script_generator import generate_script_async
+from services.audio_generator import generate_audio_async
+from services.coalescing import async_single_flight, get_coalesce_setting
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+async def run_in_app(app, fn, *args, **kwargs):
+    """Run blocking work (database, storage) in a worker thread with its own app context.
+
+    Flask-SQLAlchemy scopes sessions per thread, so database work never runs
+    on the event loop, where every request would share one session.
+    """
+    def call():
+        with app.app_context():
+            return fn(*args, **kwargs)
+    return await asyncio.to_thread(call)
+
+async def create_meditation_async(app, emotions, goals, outcomes, cache_key=None, coalesce=True, mode='custom'):
+    """create_meditation for the async server; returns the new meditation's id.
+
+    The OpenAI and ElevenLabs calls are awaited on the event loop, so a
+    generation holds no thread while it waits on them; only the final insert
+    runs in a worker thread. Composed meditations and cross-process coalescing
+    make no upstream calls worth awaiting (or need the threaded lease), so
+    they run the regular pipeline in a thread.
+    """
+    with app.app_context():
+        if mode == 'composed' or get_coalesce_setting('COALESCE_ACROSS_PROCESSES'):
+            return await run_in_app(app, lambda: create_meditation(
+                emotions, goals, outcomes, cache_key=cache_key, coalesce=coalesce, mode=mode
+            ).id)
+
+        async def generate():
+            logger.info(f"Generating script with emotions: {emotions}, goals: {goals}, outcomes: {outcomes}")
+            script = await generate_script_async(goals, emotions, outcomes)
+            logger.info(f"Script generated successfully ({len(script)} characters)")
+            audio_url = await generate_audio_async(script)
+            logger.info("Audio generated successfully")
+            return await run_in_app(
+                app, lambda: save_meditation(script, audio_url, emotions, goals, outcomes, cache_key).id
+            )
+
+        if coalesce and cache_key and get_coalesce_setting('COALESCE_ENABLED'):
+            meditation_id, shared = await async_single_flight.run(cache_key, generate)
+            if shared:
+                logger.info(f"Coalesced with in-flight generation of meditation {meditation_id}")
+            return meditation_id
+        return await generate()
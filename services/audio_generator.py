@@ -1,12 +1,41 @@
 import os
-import requests
+import time
+import asyncio
+import hashlib
 import logging
-from flask import current_app
-from functools import lru_cache
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import safe_join
+
+from services.clients import request_with_retry, async_request_with_retry
+from services.metrics import timed_stage, TTS_CHARACTERS, AUDIO_BYTES
+from services.rate_limit import stage_limiter
+from services.mp3 import join_segments, probe
+from services.durations import record_audio, known_durations
+from services.storage import get_storage, audio_name
+from services.text_segments import split_text
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# ElevenLabs model used for text-to-speech
+TTS_MODEL_ID = "eleven_multilingual_v2"
+
+# Longest text ElevenLabs accepts in one request; longer scripts are split
+TTS_MAX_CHARS = 5000
+
+DEFAULT_ELEVENLABS_BASE_URL = "https://api.elevenlabs.io"
+
+# Chunk size used when reading a streamed ElevenLabs response
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Where audio that is still being synthesized can be played from (see routes.stream_audio_file)
+STREAM_URL_PREFIX = "/api/audio-stream/"
+
+# How long a reader in another worker follows a spool file that stops growing (its writer may have died)
+STREAM_IDLE_TIMEOUT = 30.0
+
 def get_elevenlabs_config():
     """Get ElevenLabs config from environment or Flask context"""
     try:
@@ -17,16 +46,32 @@ def get_elevenlabs_config():
         # Not in Flask context, try environment variables
         elevenlabs_api_key = os.environ.get('ELEVENLABS_API_KEY')
         voice_id = os.environ.get('ELEVENLABS_VOICE_ID', 'sX7PMBZDfORL1SPZi4XW')
-    
+
     if not elevenlabs_api_key:
         raise ValueError("ELEVENLABS_API_KEY is not set")
-    
+
     return elevenlabs_api_key, voice_id
 
-def generate_audio(text):
-    """Generate audio from text using ElevenLabs API"""
+def get_elevenlabs_base_url():
+    """ElevenLabs API root from Flask context or environment (overridable for benchmarks)"""
+    try:
+        base_url = current_app.config.get('ELEVENLABS_BASE_URL')
+    except RuntimeError:
+        base_url = os.environ.get('ELEVENLABS_BASE_URL')
+    return (base_url or DEFAULT_ELEVENLABS_BASE_URL).rstrip('/')
+
+def new_audio_file_name():
+    """Random file name for a new meditation mp3"""
+    return f"meditation_{os.urandom(8).hex()}.mp3"
+
+def content_file_name(audio_bytes):
+    """Content-addressed file name, so identical audio is only stored once"""
+    return f"meditation_{hashlib.sha256(audio_bytes).hexdigest()[:32]}.mp3"
+
+def _tts_request(text, previous_text=None):
+    """(url, headers, JSON body) of an ElevenLabs text-to-speech request"""
     elevenlabs_api_key, voice_id = get_elevenlabs_config()
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    url = f"{get_elevenlabs_base_url()}/v1/text-to-speech/{voice_id}"
 
     headers = {
         "Accept": "audio/mpeg",
@@ -36,7 +81,7 @@ def generate_audio(text):
 
     data = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
+        "model_id": TTS_MODEL_ID,
         "voice_settings": {
             "stability": 1.0,          # More stable setting
             "similarity_boost": 0.8,    # Higher similarity
@@ -45,91 +90,449 @@ def generate_audio(text):
         }
     }
 
+    # Text spoken just before this segment keeps intonation continuous across joins
+    if previous_text:
+        data["previous_text"] = previous_text
+
+    return url, headers, data
+
+def _tts_error(status_code, error_detail):
+    """User-facing exception for an ElevenLabs error status"""
+    log_message = f"ElevenLabs API HTTP Error {status_code}: {error_detail}"
+    logger.error(log_message)
+
+    if status_code == 401:
+        return ValueError("Authentication failed with the audio service. Please check your API key.")
+    elif status_code == 429:
+        return RuntimeError("Audio generation quota exceeded. Please try again later.")
+    elif status_code >= 500:
+        return RuntimeError("The audio service is currently experiencing issues. Please try again later.")
+    else:
+        return RuntimeError(f"Failed to generate audio: {error_detail}")
+
+def _error_detail(error_response):
     try:
-        logger.info("Sending request to ElevenLabs API")
-        
-        # Add timeout and error handling for the API call
-        try:
-            response = requests.post(
-                url, 
-                json=data, 
+        error_json = error_response.json()
+        return error_json.get('detail', error_json.get('message', 'Unknown error'))
+    except:
+        # If we can't parse JSON, use the text response
+        return error_response.text[:100] if error_response.text else "Unknown error"
+
+TIMEOUT_MESSAGE = "The audio generation service timed out. Please try again with a shorter meditation script."
+CONNECTION_MESSAGE = "Could not connect to the audio generation service. Please check your internet connection and try again."
+
+def request_tts(text, stream=False, previous_text=None):
+    """Send text to ElevenLabs and return the successful response.
+
+    Upstream failures are mapped to ValueError (configuration) or
+    RuntimeError (service problems) with user-facing messages.
+    """
+    import requests
+
+    url, headers, data = _tts_request(text, previous_text)
+
+    logger.info("Sending request to ElevenLabs API")
+
+    TTS_CHARACTERS.inc(len(text))
+
+    # Add timeout and error handling for the API call; 429/5xx are retried with backoff
+    try:
+        # For streamed responses this times the wait for the first byte
+        with timed_stage('tts'):
+            response = request_with_retry(
+                'POST',
+                url,
+                upstream='elevenlabs',
+                json=data,
                 headers=headers,
-                timeout=90  # Extended timeout for audio generation
+                timeout=90,  # Extended timeout for audio generation
+                stream=stream
             )
             response.raise_for_status()
-            
-            # In a production environment, you'd save this file to a cloud storage service
-            # and return the URL. For this MVP, we'll save it locally.
-            file_name = f"meditation_{os.urandom(8).hex()}.mp3"
-            file_path = os.path.join('static', 'audio', file_name)
-            
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-
-            logger.info(f"Audio saved to {file_path}")
-            return f"/static/audio/{file_name}"
-            
-        except requests.exceptions.Timeout:
-            error_msg = "The audio generation service timed out. Please try again with a shorter meditation script."
-            logger.error(error_msg)
-            raise RuntimeError(error_msg)
-            
-        except requests.exceptions.HTTPError as http_err:
-            # Detailed error handling for different HTTP error codes
-            error_response = http_err.response
-            status_code = error_response.status_code
-            error_detail = "Unknown error"
-            
-            try:
-                error_json = error_response.json()
-                error_detail = error_json.get('detail', error_json.get('message', 'Unknown error'))
-            except:
-                # If we can't parse JSON, use the text response
-                error_detail = error_response.text[:100] if error_response.text else "Unknown error"
-            
-            log_message = f"ElevenLabs API HTTP Error {status_code}: {error_detail}"
-            logger.error(log_message)
-            
-            if status_code == 401:
-                raise ValueError("Authentication failed with the audio service. Please check your API key.")
-            elif status_code == 429:
-                raise RuntimeError("Audio generation quota exceeded. Please try again later.")
-            elif status_code >= 500:
-                raise RuntimeError("The audio service is currently experiencing issues. Please try again later.")
-            else:
-                raise RuntimeError(f"Failed to generate audio: {error_detail}")
-                
-        except requests.exceptions.ConnectionError:
-            error_msg = "Could not connect to the audio generation service. Please check your internet connection and try again."
-            logger.error(error_msg)
-            raise RuntimeError(error_msg)
-            
+        return response
+
+    except requests.exceptions.Timeout:
+        logger.error(TIMEOUT_MESSAGE)
+        raise RuntimeError(TIMEOUT_MESSAGE)
+
+    except requests.exceptions.HTTPError as http_err:
+        # Detailed error handling for different HTTP error codes
+        error_response = http_err.response
+        raise _tts_error(error_response.status_code, _error_detail(error_response))
+
+    except requests.exceptions.ConnectionError:
+        logger.error(CONNECTION_MESSAGE)
+        raise RuntimeError(CONNECTION_MESSAGE)
+
+async def request_tts_async(text, previous_text=None):
+    """request_tts for coroutines; returns the mp3 bytes"""
+    import httpx
+
+    url, headers, data = _tts_request(text, previous_text)
+
+    logger.info("Sending request to ElevenLabs API")
+
+    TTS_CHARACTERS.inc(len(text))
+
+    try:
+        with timed_stage('tts'):
+            response = await async_request_with_retry(
+                'POST',
+                url,
+                upstream='elevenlabs',
+                json=data,
+                headers=headers,
+                timeout=90
+            )
+    except httpx.TimeoutException:
+        logger.error(TIMEOUT_MESSAGE)
+        raise RuntimeError(TIMEOUT_MESSAGE)
+    except httpx.TransportError:
+        logger.error(CONNECTION_MESSAGE)
+        raise RuntimeError(CONNECTION_MESSAGE)
+
+    if not response.is_success:
+        raise _tts_error(response.status_code, _error_detail(response))
+    return response.content
+
+def _log_audio_error(log_error):
+    try:
+        current_app.logger.error(log_error)
+    except RuntimeError:
+        logger.error(log_error)
+
+def save_audio(audio_bytes):
+    """Store mp3 bytes with the configured storage backend and return their URL"""
+    storage = get_storage()
+    file_name = content_file_name(audio_bytes)
+    # Measured from the frame headers while the bytes are still in memory
+    record_audio(file_name, audio_bytes)
+    with timed_stage('file_write'):
+        if storage.exists(file_name):
+            logger.info(f"Audio already stored as {file_name}, reusing it")
+            return storage.url(file_name)
+        AUDIO_BYTES.inc(len(audio_bytes))
+        return storage.save(file_name, audio_bytes)
+
+def get_segment_concurrency():
+    """How many segments may be synthesized at once"""
+    try:
+        return current_app.config.get('TTS_SEGMENT_CONCURRENCY', 3)
+    except RuntimeError:
+        return int(os.environ.get('TTS_SEGMENT_CONCURRENCY', 3))
+
+def generate_audio(text):
+    """Generate audio from text using ElevenLabs API"""
+    # Scripts over the per-request limit are synthesized in segments and joined
+    if len(text) > TTS_MAX_CHARS:
+        logger.info(f"Script has {len(text)} characters, synthesizing in segments")
+        return generate_segmented_audio(split_text(text))
+
+    try:
+        with stage_limiter.slot('audio'):
+            response = request_tts(text)
+        return save_audio(response.content)
+
     except ValueError as e:
         # Handle configuration errors
-        log_error = f"Configuration error in audio generation: {e}"
-        try:
-            current_app.logger.error(log_error)
-        except RuntimeError:
-            logger.error(log_error)
+        _log_audio_error(f"Configuration error in audio generation: {e}")
         raise
-        
+
     except RuntimeError as e:
         # Pass through runtime errors with logging
-        log_error = f"Runtime error in audio generation: {e}"
-        try:
-            current_app.logger.error(log_error)
-        except RuntimeError:
-            logger.error(log_error)
+        _log_audio_error(f"Runtime error in audio generation: {e}")
         raise
-        
+
     except Exception as e:
         # Handle unexpected errors
-        log_error = f"Unexpected error generating audio: {str(e)}"
+        _log_audio_error(f"Unexpected error generating audio: {str(e)}")
+        raise RuntimeError("An unexpected error occurred while creating your meditation audio. Please try again later.")
+
+def generate_segmented_audio(segments, max_workers=None):
+    """Synthesize text segments concurrently and join the mp3s in order.
+
+    `segments` may be a generator that is still producing text (e.g. from a
+    streamed script); each segment is sent to ElevenLabs as soon as it is
+    yielded, with at most `max_workers` requests in flight.
+    """
+    max_workers = max_workers or get_segment_concurrency()
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def synthesize(text, previous_text):
+        # Worker threads need the app context for configuration
+        if app is None:
+            with stage_limiter.slot('audio'):
+                return request_tts(text, previous_text=previous_text).content
+        with app.app_context(), stage_limiter.slot('audio'):
+            return request_tts(text, previous_text=previous_text).content
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts-segment')
+    try:
+        futures = []
+        previous_text = None
+        for segment in segments:
+            futures.append(executor.submit(synthesize, segment, previous_text))
+            previous_text = segment
+        logger.info(f"Synthesizing {len(futures)} audio segments")
+        return save_audio(join_segments(future.result() for future in futures))
+
+    except ValueError as e:
+        _log_audio_error(f"Configuration error in audio generation: {e}")
+        raise
+
+    except RuntimeError as e:
+        _log_audio_error(f"Runtime error in audio generation: {e}")
+        raise
+
+    except Exception as e:
+        _log_audio_error(f"Unexpected error generating audio: {str(e)}")
+        raise RuntimeError("An unexpected error occurred while creating your meditation audio. Please try again later.")
+
+    finally:
+        # Don't start segments that are still queued after a failure
+        executor.shutdown(wait=True, cancel_futures=True)
+
+async def generate_audio_async(text):
+    """generate_audio for the async server: segments are awaited concurrently instead of using threads"""
+    segments = split_text(text) if len(text) > TTS_MAX_CHARS else [text]
+    if len(segments) > 1:
+        logger.info(f"Script has {len(text)} characters, synthesizing {len(segments)} segments")
+    limit = asyncio.Semaphore(get_segment_concurrency())
+
+    async def synthesize(segment, previous_text):
+        async with limit, stage_limiter.async_slot('audio'):
+            return await request_tts_async(segment, previous_text=previous_text)
+
+    tasks = [
+        asyncio.ensure_future(synthesize(segment, segments[i - 1] if i else None))
+        for i, segment in enumerate(segments)
+    ]
+    try:
+        parts = await asyncio.gather(*tasks)
+        audio = parts[0] if len(parts) == 1 else join_segments(parts)
+        # Hashing, probing and the storage write stay off the event loop
+        return await asyncio.to_thread(save_audio, audio)
+
+    except ValueError as e:
+        _log_audio_error(f"Configuration error in audio generation: {e}")
+        raise
+
+    except RuntimeError as e:
+        _log_audio_error(f"Runtime error in audio generation: {e}")
+        raise
+
+    except Exception as e:
+        _log_audio_error(f"Unexpected error generating audio: {str(e)}")
+        raise RuntimeError("An unexpected error occurred while creating your meditation audio. Please try again later.")
+
+    finally:
+        # Don't keep synthesizing segments after a failure
+        for task in tasks:
+            task.cancel()
+
+class AudioStream:
+    """An mp3 that is still being written from a streamed ElevenLabs response.
+
+    Bytes go to `<file>.part` in the storage backend's spool directory; once
+    the upstream response is exhausted the file is handed to storage under its
+    final name, so the regular audio URL only ever serves complete files.
+    """
+
+    def __init__(self, file_name, storage):
+        self.file_name = file_name
+        self.storage = storage
+        self.part_path = os.path.join(storage.spool_dir, file_name + '.part')
+        self.bytes_written = 0
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+        self._callbacks = []
+
+    @property
+    def audio_url(self):
+        return self.storage.url(self.file_name)
+
+    @property
+    def stream_url(self):
+        return f"{STREAM_URL_PREFIX}{self.file_name}"
+
+    def write_from(self, response):
+        """Copy the upstream body to disk chunk by chunk, waking readers as it grows"""
+        try:
+            with open(self.part_path, 'ab') as f:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    f.flush()
+                    with self._condition:
+                        self.bytes_written += len(chunk)
+                        self._condition.notify_all()
+            with open(self.part_path, 'rb') as f:
+                info = probe(f)
+            if info is not None:
+                known_durations.put(self.file_name, info.duration_seconds)
+            self.storage.save_file(self.file_name, self.part_path)
+            AUDIO_BYTES.inc(self.bytes_written)
+            logger.info(f"Streamed audio saved as {self.file_name} ({self.bytes_written} bytes)")
+        except Exception as e:
+            self.error = e
+            logger.error(f"Audio stream for {self.file_name} failed: {e}")
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
+        finally:
+            response.close()
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+                callbacks, self._callbacks = self._callbacks, []
+            _active_streams.pop(self.file_name, None)
+            for callback in callbacks:
+                try:
+                    callback(self)
+                except Exception as e:
+                    logger.error(f"Audio stream callback for {self.file_name} failed: {e}")
+
+    def add_done_callback(self, callback):
+        """Call callback(stream) once the file is complete (or failed); immediately if it already is"""
+        with self._condition:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def iter_bytes(self, chunk_size=STREAM_CHUNK_SIZE, poll_timeout=1.0):
+        """Yield the file's bytes as they are written, until the stream ends"""
+        # The writer moves .part into storage when it finishes; an open handle keeps working
         try:
-            current_app.logger.error(log_error)
-        except RuntimeError:
-            logger.error(log_error)
-        
+            f = open(self.part_path, 'rb')
+        except FileNotFoundError:
+            f = self.storage.open(self.file_name)
+
+        with f:
+            while True:
+                chunk = f.read(chunk_size)
+                if chunk:
+                    yield chunk
+                    continue
+                with self._condition:
+                    if self.done:
+                        break
+                    if f.tell() >= self.bytes_written:
+                        self._condition.wait(poll_timeout)
+
+            # Drain anything written between the last read and completion
+            remainder = f.read()
+            if remainder and self.error is None:
+                yield remainder
+
+# Streams currently being written, keyed by file name
+_active_streams = {}
+
+def start_audio_stream(text):
+    """Start streaming synthesis and return an AudioStream once audio begins arriving.
+
+    Upstream errors (auth, quota, timeouts before the first byte) are raised
+    here exactly as in generate_audio; the body is written in the background.
+    """
+    # The audio slot stays taken until the body has been read, not just until headers arrive
+    release_slot = stage_limiter.acquire('audio')
+    try:
+        response = request_tts(text, stream=True)
+
+        stream = AudioStream(new_audio_file_name(), get_storage())
+        open(stream.part_path, 'wb').close()
+        stream.add_done_callback(lambda s: release_slot())
+        _active_streams[stream.file_name] = stream
+
+        threading.Thread(
+            target=stream.write_from,
+            args=(response,),
+            name=f"audio-stream-{stream.file_name}",
+            daemon=True
+        ).start()
+        return stream
+
+    except ValueError as e:
+        release_slot()
+        _log_audio_error(f"Configuration error in audio generation: {e}")
+        raise
+
+    except RuntimeError as e:
+        release_slot()
+        _log_audio_error(f"Runtime error in audio generation: {e}")
+        raise
+
+    except Exception as e:
+        release_slot()
+        _log_audio_error(f"Unexpected error generating audio: {str(e)}")
         raise RuntimeError("An unexpected error occurred while creating your meditation audio. Please try again later.")
+
+def get_active_stream(file_name):
+    """Return the in-progress AudioStream for a file, if synthesis is still running"""
+    return _active_streams.get(file_name)
+
+def spooled_part_path(file_name):
+    """Path of a file's .part spool file on this machine (whether or not it exists), or None for unsafe names"""
+    return safe_join(get_storage().spool_dir, file_name + '.part')
+
+def open_spooled_part(file_name):
+    """Open the .part file of audio that is being streamed to this machine's spool, or return None.
+
+    Used when the stream is running in another worker process, so it isn't
+    in this process's registry.
+    """
+    part_path = spooled_part_path(file_name)
+    if part_path is None:
+        return None
+    try:
+        return open(part_path, 'rb')
+    except FileNotFoundError:
+        return None
+
+def iter_spooled_bytes(f, poll_interval=0.25, idle_timeout=STREAM_IDLE_TIMEOUT):
+    """Yield a .part file's bytes as another process writes them, until the stream ends.
+
+    The writer moves the file into storage (or removes it on failure) when it
+    finishes; the open handle keeps reading, so the stream ends once the path
+    is gone and the rest has been read. Gives up after `idle_timeout` seconds
+    without new bytes.
+    """
+    with f:
+        idle_since = time.monotonic()
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                idle_since = time.monotonic()
+                yield chunk
+                continue
+            if not os.path.exists(f.name):
+                # Drain anything written between the last read and completion
+                remainder = f.read()
+                if remainder:
+                    yield remainder
+                return
+            if time.monotonic() - idle_since > idle_timeout:
+                logger.warning(f"Spooled audio {os.path.basename(f.name)} stopped growing; ending the stream")
+                return
+            time.sleep(poll_interval)
+
+def stream_url_for(audio_url):
+    """Streaming URL for an audio URL whose file is still being synthesized.
+
+    Any worker on the machine doing the synthesis reports the same URL: a
+    stream in another process is recognized by its .part spool file, which
+    /api/audio-stream follows the same way.
+    """
+    file_name = audio_name(audio_url)
+    if not file_name:
+        return None
+    stream = get_active_stream(file_name)
+    if stream is not None:
+        return stream.stream_url
+    part_path = spooled_part_path(file_name)
+    if part_path is not None and os.path.isfile(part_path):
+        return f"{STREAM_URL_PREFIX}{file_name}"
+    return None
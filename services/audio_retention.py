@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+
+from models import db, Meditation, MeditationTag, GenerationJob, ScriptSegment
+from services.storage import get_storage, audio_name
+from services.transcoder import delete_renditions, rendition_dir, RENDITIONS_PREFIX
+from services.audio_generator import STREAM_IDLE_TIMEOUT
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+DEFAULTS = {
+    'AUDIO_QUOTA_BYTES': 1024 ** 3,           # 0 disables quota eviction
+    'AUDIO_ORPHAN_GRACE_SECONDS': 3600,       # files newer than this may not have their row committed yet
+    'AUDIO_EVICTION_MIN_AGE_SECONDS': 24 * 3600,
+    'AUDIO_QUOTA_CHECK_INTERVAL': 300,
+    'AUDIO_ACCESS_TOUCH_INTERVAL': 3600,
+}
+
+def get_retention_setting(name):
+    """Read a retention setting from Flask context or environment"""
+    default = DEFAULTS[name]
+    try:
+        value = current_app.config.get(name, default)
+    except RuntimeError:
+        value = os.environ.get(name, default)
+    return int(value)
+
+class RetentionReport:
+    """What a cleanup run found and removed"""
+
+    def __init__(self):
+        self.usage_before = 0
+        self.usage_after = 0
+        self.files_deleted = 0
+        self.bytes_reclaimed = 0
+        self.duplicates_merged = 0
+        self.orphans_deleted = 0
+        self.spool_bytes_reclaimed = 0   # abandoned .part files, which usage() doesn't count
+        self.meditations_evicted = 0
+        self.dry_run = False
+
+    def deleted(self, size, files=1):
+        self.files_deleted += files
+        self.bytes_reclaimed += size
+
+    def to_dict(self):
+        return dict(vars(self))
+
+def record_access(meditation):
+    """Note that a meditation was read, for LRU eviction.
+
+    Writes are throttled and leave updated_at untouched, so reads don't turn
+    into frequent writes or change the row's modification time.
+    """
+    now = datetime.utcnow()
+    interval = timedelta(seconds=get_retention_setting('AUDIO_ACCESS_TOUCH_INTERVAL'))
+    if meditation.last_accessed_at and now - meditation.last_accessed_at < interval:
+        return
+    table = Meditation.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == meditation.id)
+        .values(last_accessed_at=now, updated_at=table.c.updated_at)
+    )
+    db.session.commit()
+
+def reference_counts():
+    """How many meditations and library segments point at each stored audio file"""
+    counts = Counter()
+    for (audio_url,) in db.session.query(Meditation.audio_url).union_all(db.session.query(ScriptSegment.audio_url)):
+        name = audio_name(audio_url)
+        if name:
+            counts[name] += 1
+    return counts
+
+def stored_renditions(storage):
+    """Stored rendition files grouped by their rendition directory (see rendition_dir)"""
+    groups = defaultdict(list)
+    for stored in storage.list_prefix(RENDITIONS_PREFIX):
+        directory = stored.name[len(RENDITIONS_PREFIX):].split('/', 1)[0]
+        groups[RENDITIONS_PREFIX + directory].append(stored)
+    return groups
+
+def usage(storage=None):
+    """Total bytes and number of stored audio files, renditions included"""
+    storage = storage or get_storage()
+    files = list(storage.list()) + list(storage.list_prefix(RENDITIONS_PREFIX))
+    return sum(f.size for f in files), len(files)
+
+def delete_audio(report, storage, stored, renditions, dry_run=False):
+    """Delete a stored mp3 and its renditions; returns the bytes freed.
+
+    `renditions` is the stored_renditions() map; the file's entry is removed
+    from it.
+    """
+    files = renditions.pop(rendition_dir(stored.name), [])
+    if not dry_run:
+        storage.delete(stored.name)
+        delete_renditions(storage, stored.name)
+    freed = stored.size + sum(f.size for f in files)
+    report.deleted(stored.size)
+    if files:
+        report.deleted(freed - stored.size, files=len(files))
+    return freed
+
+def content_hash(storage, name):
+    """sha256 of a stored file, read in chunks so memory use stays flat"""
+    digest = hashlib.sha256()
+    with storage.open(name) as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def deduplicate(report, dry_run=False, storage=None):
+    """Point meditations with byte-identical audio at one file and delete the copies"""
+    storage = storage or get_storage()
+    refs = reference_counts()
+    renditions = stored_renditions(storage)
+
+    # Only files of equal size can be identical, so only those get hashed
+    by_size = defaultdict(list)
+    for stored in storage.list():
+        by_size[stored.size].append(stored)
+
+    for size, files in by_size.items():
+        if len(files) < 2:
+            continue
+        by_hash = defaultdict(list)
+        for stored in files:
+            by_hash[content_hash(storage, stored.name)].append(stored)
+
+        for copies in by_hash.values():
+            if len(copies) < 2:
+                continue
+            # Keep the most referenced (then oldest) copy so the fewest rows change
+            copies.sort(key=lambda f: (-refs[f.name], f.modified))
+            keep, duplicates = copies[0], copies[1:]
+            # Repointed rows take over the kept file's renditions (if it has any yet)
+            keep_renditions = db.session.query(Meditation.renditions).filter(
+                Meditation.audio_url == storage.url(keep.name), Meditation.renditions.isnot(None)
+            ).limit(1).scalar()
+            for duplicate in duplicates:
+                logger.info(f"{duplicate.name} duplicates {keep.name}")
+                if not dry_run:
+                    Meditation.query.filter(
+                        Meditation.audio_url == storage.url(duplicate.name)
+                    ).update({
+                        'audio_url': storage.url(keep.name),
+                        'renditions': keep_renditions
+                    }, synchronize_session=False)
+                    ScriptSegment.query.filter(
+                        ScriptSegment.audio_url == storage.url(duplicate.name)
+                    ).update({'audio_url': storage.url(keep.name)}, synchronize_session=False)
+                    db.session.commit()
+                delete_audio(report, storage, duplicate, renditions, dry_run=dry_run)
+                report.duplicates_merged += 1
+
+def stale_spool_files(storage, cutoff):
+    """.part spool files last written before `cutoff`, left behind by streams whose writer died"""
+    spool_dir = storage.spool_dir
+    for entry in os.scandir(spool_dir):
+        if not (entry.is_file() and entry.name.endswith('.part')):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime <= cutoff:
+            yield entry.path, stat.st_size
+
+def sweep_orphans(report, dry_run=False, grace_seconds=None, storage=None):
+    """Delete audio files no meditation refers to, renditions whose mp3 is gone and stale spool files"""
+    storage = storage or get_storage()
+    if grace_seconds is None:
+        grace_seconds = get_retention_setting('AUDIO_ORPHAN_GRACE_SECONDS')
+    refs = reference_counts()
+    cutoff = time.time() - grace_seconds
+    renditions = stored_renditions(storage)
+
+    stored_files = list(storage.list())
+    for stored in stored_files:
+        if refs[stored.name] or stored.modified > cutoff:
+            continue
+        logger.info(f"Deleting orphaned audio {stored.name}")
+        delete_audio(report, storage, stored, renditions, dry_run=dry_run)
+        report.orphans_deleted += 1
+
+    # What's left belongs to kept files, or to mp3s that were deleted without their renditions
+    kept = {rendition_dir(stored.name) for stored in stored_files}
+    for directory, files in renditions.items():
+        if directory in kept or max(f.modified for f in files) > cutoff:
+            continue
+        logger.info(f"Deleting orphaned renditions {directory}")
+        if not dry_run:
+            storage.delete_prefix(directory + '/')
+        report.orphans_deleted += 1
+        report.deleted(sum(f.size for f in files), files=len(files))
+
+    # A live stream appends to its .part file at least every STREAM_IDLE_TIMEOUT seconds
+    for path, size in stale_spool_files(storage, time.time() - max(grace_seconds, STREAM_IDLE_TIMEOUT)):
+        logger.info(f"Deleting abandoned spool file {path}")
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        report.orphans_deleted += 1
+        report.spool_bytes_reclaimed += size
+        report.deleted(size)
+
+def enforce_quota(report, quota_bytes=None, dry_run=False, storage=None):
+    """Evict unsaved meditations, least recently used first, until audio fits the quota"""
+    storage = storage or get_storage()
+    if quota_bytes is None:
+        quota_bytes = get_retention_setting('AUDIO_QUOTA_BYTES')
+    if not quota_bytes:
+        return
+
+    stored_files = {stored.name: stored for stored in storage.list()}
+    renditions = stored_renditions(storage)
+    total = sum(f.size for f in stored_files.values()) + sum(f.size for files in renditions.values() for f in files)
+    if total <= quota_bytes:
+        return
+
+    refs = reference_counts()
+    min_age = timedelta(seconds=get_retention_setting('AUDIO_EVICTION_MIN_AGE_SECONDS'))
+    candidates = (
+        Meditation.query
+        .filter(Meditation.saved.isnot(True))
+        .filter(Meditation.created_at < datetime.utcnow() - min_age)
+        .order_by(db.func.coalesce(Meditation.last_accessed_at, Meditation.created_at).asc())
+    )
+
+    evicted_ids = []
+    for meditation in candidates.yield_per(100):
+        if total <= quota_bytes:
+            break
+        name = audio_name(meditation.audio_url)
+        evicted_ids.append(meditation.id)
+        report.meditations_evicted += 1
+        refs[name] -= 1
+        # Shared (deduplicated) files go once their last meditation is evicted
+        if refs[name] <= 0 and name in stored_files:
+            total -= delete_audio(report, storage, stored_files.pop(name), renditions, dry_run=dry_run)
+
+    if evicted_ids and not dry_run:
+        GenerationJob.query.filter(GenerationJob.meditation_id.in_(evicted_ids)).update(
+            {'meditation_id': None}, synchronize_session=False
+        )
+        # Bulk deletes skip ORM cascades, so tag links go explicitly
+        MeditationTag.query.filter(MeditationTag.meditation_id.in_(evicted_ids)).delete(synchronize_session=False)
+        Meditation.query.filter(Meditation.id.in_(evicted_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    if total > quota_bytes:
+        logger.warning(f"Audio still uses {total} bytes after eviction (quota {quota_bytes}); remaining files are saved or recent")
+
+def run_retention(dry_run=False, quota_bytes=None, grace_seconds=None):
+    """Deduplicate, sweep orphans and enforce the quota; returns a RetentionReport"""
+    storage = get_storage()
+    report = RetentionReport()
+    report.dry_run = dry_run
+    report.usage_before, _ = usage(storage)
+
+    deduplicate(report, dry_run=dry_run, storage=storage)
+    sweep_orphans(report, dry_run=dry_run, grace_seconds=grace_seconds, storage=storage)
+    enforce_quota(report, quota_bytes=quota_bytes, dry_run=dry_run, storage=storage)
+
+    if dry_run:
+        report.usage_after = report.usage_before - (report.bytes_reclaimed - report.spool_bytes_reclaimed)
+    else:
+        report.usage_after = usage(storage)[0]
+    logger.info(f"Audio retention reclaimed {report.bytes_reclaimed} bytes in {report.files_deleted} files")
+    return report
+
+_last_quota_check = 0.0
+_quota_lock = threading.Lock()
+
+def enforce_quota_if_due():
+    """Cheap hook for the generation path: check the quota at most every few minutes"""
+    global _last_quota_check
+    interval = get_retention_setting('AUDIO_QUOTA_CHECK_INTERVAL')
+    with _quota_lock:
+        if time.monotonic() - _last_quota_check < interval:
+            return None
+        _last_quota_check = time.monotonic()
+    report = RetentionReport()
+    try:
+        enforce_quota(report)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Audio quota check failed: {e}")
+        return None
+    if report.files_deleted:
+        logger.info(f"Quota eviction reclaimed {report.bytes_reclaimed} bytes")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deduplicate, clean up and enforce the quota on meditation audio")
+    parser.add_argument('--dry-run', action='store_true', help="report what would be deleted without deleting")
+    parser.add_argument('--quota-bytes', type=int, default=None, help="override AUDIO_QUOTA_BYTES (0 = no quota)")
+    parser.add_argument('--grace-seconds', type=int, default=None, help="override AUDIO_ORPHAN_GRACE_SECONDS")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+        report = run_retention(dry_run=args.dry_run, quota_bytes=args.quota_bytes, grace_seconds=args.grace_seconds)
+    print(json.dumps(report.to_dict(), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
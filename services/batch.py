@@ -0,0 +1,189 @@
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import current_app
+
+from models import db
+from services.script_generator import generate_scripts
+from services.audio_generator import generate_audio
+from services.durations import audio_duration
+from services.meditation_cache import get_meditation_cache
+from services.audio_retention import enforce_quota_if_due
+from services.transcoder import transcoder
+from services.metrics import timed_stage
+from services.pipeline import build_meditation
+from services.script_composer import compose_meditation, MissingSegmentError
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+def upstream_costs(count):
+    """Upstream calls `count` generated items will make, for admit_generation"""
+    return {
+        'openai': math.ceil(count / current_app.config['BATCH_SCRIPTS_PER_CALL']),
+        'elevenlabs': count,
+    }
+
+def item_result(index, status='queued', meditation_id=None, cached=False):
+    """Progress entry for one item of a batch.
+
+    `status` moves through queued, script, audio and saving to succeeded or
+    failed; a failed item also carries `error` and `error_type`.
+    """
+    return {
+        'index': index,
+        'status': status,
+        'meditation_id': meditation_id,
+        'cached': cached,
+        'error': None,
+        'error_type': None,
+    }
+
+def _error_details(e):
+    """(message, error_type) for an item that failed with `e`, as the job queue reports them"""
+    if isinstance(e, ValueError):
+        return str(e), 'value_error'
+    if isinstance(e, RuntimeError):
+        return str(e), 'runtime_error'
+    logger.error(f"Unexpected error in batch item: {e}", exc_info=e)
+    return 'An unexpected error occurred. Please try again later.', 'unexpected_error'
+
+def run_batch(job, on_stage):
+    """Generate every unfinished item of a batch job; returns the per-item results.
+
+    Scripts are written BATCH_SCRIPTS_PER_CALL at a time in one completion
+    each, and every script is voiced as soon as its completion returns, with
+    at most BATCH_TTS_CONCURRENCY ElevenLabs requests at once. The new
+    Meditation rows are inserted in a single transaction together with the
+    final item results. An item that fails is recorded with its error and
+    doesn't stop the others. Items already marked succeeded (cache hits, or
+    saved before a restart) are left alone.
+    """
+    params = job.get_params()
+    items = params['items']
+    mode = params.get('mode', 'custom')
+    results = job.get_results()
+    app = current_app._get_current_object()
+
+    def report():
+        job.set_results(results)
+        db.session.commit()
+
+    def fail(index, e):
+        results[index]['status'] = 'failed'
+        results[index]['error'], results[index]['error_type'] = _error_details(e)
+        logger.warning(f"Batch job {job.id} item {index} failed: {results[index]['error']}")
+
+    def in_app(fn, *args):
+        # Pool threads need their own app context for settings and storage
+        def run():
+            with app.app_context():
+                return fn(*args)
+        return run
+
+    pending = [i for i, result in enumerate(results) if result['status'] != 'succeeded']
+    for i in pending:
+        results[i].update(item_result(i))
+    generated = {}  # index -> (script, audio_url)
+
+    if mode == 'composed':
+        on_stage('composing')
+        for i in list(pending):
+            item = items[i]
+            try:
+                generated[i] = compose_meditation(item['emotions'], item['goals'], item['outcomes'])
+                results[i]['status'] = 'saving'
+                pending.remove(i)
+            except MissingSegmentError as e:
+                logger.info(f"Can't compose batch item {i} ({e}); writing a custom script instead")
+
+    if pending:
+        on_stage('script')
+        for i in pending:
+            results[i]['status'] = 'script'
+        report()
+
+        per_call = current_app.config['BATCH_SCRIPTS_PER_CALL']
+        chunks = [pending[start:start + per_call] for start in range(0, len(pending), per_call)]
+        scripts = {}
+        with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix='batch-script') as script_pool, \
+                ThreadPoolExecutor(max_workers=current_app.config['BATCH_TTS_CONCURRENCY'],
+                                   thread_name_prefix='batch-audio') as audio_pool:
+            running = {}
+            voicing = False
+            for chunk in chunks:
+                selection_sets = [(items[i]['goals'], items[i]['emotions'], items[i]['outcomes']) for i in chunk]
+                running[script_pool.submit(in_app(generate_scripts, selection_sets))] = ('script', chunk)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, target = running.pop(future)
+                    if kind == 'script':
+                        try:
+                            written = future.result()
+                        except Exception as e:
+                            for i in target:
+                                fail(i, e)
+                            continue
+                        # Voice each script of the completion while the others are still being written
+                        for i, script in zip(target, written):
+                            scripts[i] = script
+                            results[i]['status'] = 'audio'
+                            running[audio_pool.submit(in_app(generate_audio, script))] = ('audio', i)
+                    else:
+                        try:
+                            generated[target] = (scripts[target], future.result())
+                            results[target]['status'] = 'saving'
+                        except Exception as e:
+                            fail(target, e)
+                if not voicing and not any(kind == 'script' for kind, _ in running.values()):
+                    voicing = True
+                    on_stage('audio')
+                report()
+
+    if generated:
+        on_stage('saving')
+        _save_items(job, items, results, generated)
+    return results
+
+def _save_items(job, items, results, generated):
+    """Insert the generated meditations and the job's results in one transaction"""
+    meditations = {}
+    for i, (script, audio_url) in sorted(generated.items()):
+        item = items[i]
+        meditations[i] = build_meditation(
+            script, audio_url, item['emotions'], item['goals'], item['outcomes'],
+            cache_key=item.get('cache_key'), duration_seconds=audio_duration(audio_url)
+        )
+
+    try:
+        with timed_stage('db_commit'):
+            db.session.add_all(meditations.values())
+            db.session.flush()
+            for i, meditation in meditations.items():
+                results[i]['status'] = 'succeeded'
+                results[i]['meditation_id'] = meditation.id
+            job.set_results(results)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Saving batch job {job.id} failed: {e}", exc_info=True)
+        for i in meditations:
+            results[i].update(item_result(i, status='failed'))
+            results[i]['error'] = 'An unexpected error occurred while saving your meditation. Please try again later.'
+            results[i]['error_type'] = 'unexpected_error'
+        job.set_results(results)
+        db.session.commit()
+        return
+    logger.info(f"Batch job {job.id} saved {len(meditations)} meditations")
+
+    cache = get_meditation_cache()
+    for meditation in meditations.values():
+        if meditation.cache_key:
+            cache.put(meditation.cache_key, meditation)
+        # Bandwidth-friendly renditions are encoded in the background
+        transcoder.schedule(meditation)
+
+    # New audio may have pushed storage over its quota
+    enforce_quota_if_due()
@@ -0,0 +1,240 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
+
+from flask import current_app
+
+from services.metrics import UPSTREAM_SECONDS
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Upstream responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULTS = {
+    'HTTP_POOL_CONNECTIONS': 10,   # distinct hosts kept in the pool
+    'HTTP_POOL_MAXSIZE': 20,       # keep-alive connections per host
+    'UPSTREAM_MAX_RETRIES': 3,
+    'UPSTREAM_BACKOFF_BASE': 0.5,  # seconds, doubled on each attempt
+    'UPSTREAM_BACKOFF_MAX': 8.0,
+    'ASYNC_HTTP_POOL_MAXSIZE': 500,  # connections per host for the async server's clients
+}
+
+def get_client_setting(name):
+    """Read a client setting from Flask context or environment"""
+    default = DEFAULTS[name]
+    try:
+        value = current_app.config.get(name, default)
+    except RuntimeError:
+        value = os.environ.get(name, default)
+    return type(default)(value)
+
+class UpstreamStats:
+    """Per-upstream call counts and timings"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, upstream, seconds, error=False, retries=0):
+        with self._lock:
+            stats = self._stats.setdefault(upstream, {
+                'calls': 0, 'errors': 0, 'retries': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0
+            })
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['retries'] += retries
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        UPSTREAM_SECONDS.observe(seconds, upstream=upstream, outcome='error' if error else 'ok')
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for upstream, stats in self._stats.items():
+                result[upstream] = dict(stats)
+                result[upstream]['avg_seconds'] = round(stats['total_seconds'] / stats['calls'], 4) if stats['calls'] else 0.0
+            return result
+
+upstream_stats = UpstreamStats()
+
+@contextmanager
+def timed_upstream(upstream):
+    """Time a call to an upstream API, counting it as an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        upstream_stats.record(upstream, time.perf_counter() - start, error=True)
+        raise
+    upstream_stats.record(upstream, time.perf_counter() - start)
+
+# The HTTP libraries and the OpenAI SDK are imported on first use, not with this
+# module, so importing the app stays fast (openai alone takes most of a second)
+@lru_cache(maxsize=None)
+def _build_session(pool_connections, pool_maxsize):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    # Retries are handled in request_with_retry so they can be jittered and timed
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_http_session():
+    """Process-wide requests.Session with keep-alive connection pooling"""
+    return _build_session(
+        get_client_setting('HTTP_POOL_CONNECTIONS'),
+        get_client_setting('HTTP_POOL_MAXSIZE')
+    )
+
+@lru_cache(maxsize=None)
+def _build_openai_client(api_key, base_url, max_retries, pool_maxsize):
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+    )
+    # The OpenAI client retries 429/5xx itself with jittered exponential backoff
+    return OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries, http_client=http_client)
+
+def get_openai_client(api_key, base_url=None):
+    """One pooled OpenAI client per API key and endpoint for the whole process"""
+    return _build_openai_client(
+        api_key,
+        base_url,
+        get_client_setting('UPSTREAM_MAX_RETRIES'),
+        get_client_setting('HTTP_POOL_MAXSIZE')
+    )
+
+# Async clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+def _loop_client(key, build):
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = build()
+        return clients[key]
+
+def _async_limits():
+    import httpx
+
+    maxsize = get_client_setting('ASYNC_HTTP_POOL_MAXSIZE')
+    return httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize)
+
+def get_async_http_client():
+    """Pooled httpx.AsyncClient for the running event loop"""
+    import httpx
+
+    return _loop_client('http', lambda: httpx.AsyncClient(limits=_async_limits()))
+
+def get_async_openai_client(api_key, base_url=None):
+    """One pooled AsyncOpenAI client per API key and endpoint for the running event loop"""
+    import httpx
+    from openai import AsyncOpenAI
+
+    return _loop_client(('openai', api_key, base_url), lambda: AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=get_client_setting('UPSTREAM_MAX_RETRIES'),
+        http_client=httpx.AsyncClient(limits=_async_limits())
+    ))
+
+async def close_async_clients():
+    """Close the running event loop's pooled clients (on server shutdown)"""
+    import httpx
+
+    with _async_clients_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        # httpx calls it aclose(), the OpenAI SDK close()
+        await (client.aclose() if isinstance(client, httpx.AsyncClient) else client.close())
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring a server's Retry-After when given"""
+    if retry_after:
+        try:
+            return min(float(retry_after), get_client_setting('UPSTREAM_BACKOFF_MAX'))
+        except ValueError:
+            pass
+    ceiling = min(get_client_setting('UPSTREAM_BACKOFF_MAX'), get_client_setting('UPSTREAM_BACKOFF_BASE') * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+def request_with_retry(method, url, upstream, **kwargs):
+    """Send a request through the shared session, retrying 429/5xx and connection errors.
+
+    The last response is returned even if it is still an error, so callers keep
+    handling status codes with raise_for_status() as before.
+    """
+    import requests
+
+    session = get_http_session()
+    max_retries = get_client_setting('UPSTREAM_MAX_RETRIES')
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError:
+            if attempt >= max_retries:
+                upstream_stats.record(upstream, time.perf_counter() - start, error=True, retries=attempt)
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"{upstream} connection failed, retrying in {delay:.2f}s")
+        except Exception:
+            upstream_stats.record(upstream, time.perf_counter() - start, error=True, retries=attempt)
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                upstream_stats.record(upstream, time.perf_counter() - start, error=not response.ok, retries=attempt)
+                return response
+            delay = backoff_delay(attempt, response.headers.get('Retry-After'))
+            logger.warning(f"{upstream} returned {response.status_code}, retrying in {delay:.2f}s")
+            response.close()
+
+        attempt += 1
+        time.sleep(delay)
+
+async def async_request_with_retry(method, url, upstream, **kwargs):
+    """request_with_retry for coroutines, sent through the loop's shared httpx.AsyncClient"""
+    import httpx
+
+    client = get_async_http_client()
+    max_retries = get_client_setting('UPSTREAM_MAX_RETRIES')
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt >= max_retries:
+                upstream_stats.record(upstream, time.perf_counter() - start, error=True, retries=attempt)
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"{upstream} connection failed, retrying in {delay:.2f}s")
+        except Exception:
+            upstream_stats.record(upstream, time.perf_counter() - start, error=True, retries=attempt)
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                upstream_stats.record(upstream, time.perf_counter() - start, error=not response.is_success, retries=attempt)
+                return response
+            delay = backoff_delay(attempt, response.headers.get('Retry-After'))
+            logger.warning(f"{upstream} returned {response.status_code}, retrying in {delay:.2f}s")
+
+        attempt += 1
+        await asyncio.sleep(delay)
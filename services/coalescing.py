@@ -0,0 +1,242 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Meditation, GenerationLease
+from services.metrics import COALESCED
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'COALESCE_ENABLED': True,
+    'COALESCE_ACROSS_PROCESSES': False,   # also coordinate through a lease row in the database
+    'COALESCE_LEASE_SECONDS': 300.0,      # a crashed holder's lease can be taken over after this
+    'COALESCE_WAIT_TIMEOUT': 300.0,       # give up waiting and generate separately after this
+    'COALESCE_POLL_INTERVAL': 0.5,        # how often other processes check the lease
+}
+
+def get_coalesce_setting(name):
+    """Read a coalescing setting from Flask context or environment"""
+    default = DEFAULTS[name]
+    try:
+        value = current_app.config.get(name, default)
+    except RuntimeError:
+        value = os.environ.get(name, default)
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.lower() not in ('false', '0', 'no')
+    return type(default)(value)
+
+class _Call:
+    """One in-flight generation and, once done, its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.meditation_id = None
+        self.error = None
+
+class SingleFlight:
+    """Runs at most one generation per cache key at a time in this process.
+
+    Callers that arrive while a generation for the same key is running wait
+    for it and get the same meditation (or the same error) instead of making
+    their own OpenAI and ElevenLabs calls. With COALESCE_ACROSS_PROCESSES the
+    leader also takes a GenerationLease row, so workers in other processes
+    wait on it the same way.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def run(self, key, generate, on_wait=None):
+        """Generate once for `key`; returns (meditation, shared).
+
+        `generate` creates and commits the meditation. `on_wait` is called
+        before waiting on another caller's generation. `shared` tells whether
+        the meditation came from someone else's generation.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            return self._follow(key, call, generate, on_wait)
+
+        try:
+            if get_coalesce_setting('COALESCE_ACROSS_PROCESSES'):
+                meditation, shared = _run_with_lease(key, generate, on_wait)
+            else:
+                meditation, shared = generate(), False
+            call.meditation_id = meditation.id
+            return meditation, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _follow(self, key, call, generate, on_wait):
+        if on_wait:
+            on_wait()
+        logger.info(f"Waiting on in-flight generation for key {key[:12]}")
+        if not call.done.wait(get_coalesce_setting('COALESCE_WAIT_TIMEOUT')):
+            logger.warning(f"In-flight generation for key {key[:12]} is taking too long; generating separately")
+            return generate(), False
+        if call.error is not None:
+            raise call.error
+
+        # The leader's row belongs to its session; load it into ours
+        meditation = Meditation.query.get(call.meditation_id)
+        if meditation is None:
+            return generate(), False
+        COALESCED.inc(source='local')
+        return meditation, True
+
+def _acquire_lease(key, owner):
+    """Take the lease for a key, or take over an expired one; True on success"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=get_coalesce_setting('COALESCE_LEASE_SECONDS'))
+    try:
+        with db.session.begin_nested():
+            db.session.add(GenerationLease(cache_key=key, owner=owner, acquired_at=now, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Another process holds it
+        pass
+
+    # Take over a lease whose holder died without releasing it
+    taken = GenerationLease.query.filter(
+        GenerationLease.cache_key == key,
+        GenerationLease.expires_at < now
+    ).update({'owner': owner, 'acquired_at': now, 'expires_at': expires_at}, synchronize_session=False)
+    db.session.commit()
+    return taken == 1
+
+def _release_lease(key, owner):
+    GenerationLease.query.filter_by(cache_key=key, owner=owner).delete(synchronize_session=False)
+    db.session.commit()
+
+def _wait_for_lease(key, deadline):
+    """Wait until another process's lease on `key` ends; returns its meditation, if it made one"""
+    poll_interval = get_coalesce_setting('COALESCE_POLL_INTERVAL')
+    # If the lease is already gone, only a meditation made while we looked counts
+    acquired_at = datetime.utcnow()
+    while time.monotonic() < deadline:
+        # Column queries always hit the database (the identity map would hide updates)
+        lease = db.session.query(GenerationLease.acquired_at, GenerationLease.expires_at).filter_by(cache_key=key).first()
+        db.session.commit()
+        if lease is None or lease.expires_at < datetime.utcnow():
+            break
+        acquired_at = lease.acquired_at
+        time.sleep(poll_interval)
+    else:
+        return None
+
+    # The holder commits its meditation before releasing the lease, using its own clock for both
+    return (
+        Meditation.query
+        .filter(Meditation.cache_key == key, Meditation.created_at >= acquired_at)
+        .order_by(Meditation.created_at.desc())
+        .first()
+    )
+
+def _run_with_lease(key, generate, on_wait):
+    deadline = time.monotonic() + get_coalesce_setting('COALESCE_WAIT_TIMEOUT')
+    waiting = False
+    while True:
+        owner = uuid.uuid4().hex
+        if _acquire_lease(key, owner):
+            try:
+                meditation = generate()
+            except Exception:
+                db.session.rollback()
+                _release_lease(key, owner)
+                raise
+            _release_lease(key, owner)
+            return meditation, False
+
+        if not waiting:
+            waiting = True
+            if on_wait:
+                on_wait()
+            logger.info(f"Waiting on another process's generation for key {key[:12]}")
+
+        meditation = _wait_for_lease(key, deadline)
+        if meditation is not None:
+            COALESCED.inc(source='lease')
+            return meditation, True
+        if time.monotonic() >= deadline:
+            logger.warning(f"Lease on key {key[:12]} outlasted the wait timeout; generating separately")
+            return generate(), False
+        # The holder failed or its lease expired; try to take over
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop.
+
+    `generate` is a coroutine function returning the new meditation's id;
+    followers await the leader's future instead of blocking a thread. Only
+    callers on the same event loop are coalesced; the threaded SingleFlight
+    and the database lease still cover everything else.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def run(self, key, generate):
+        """Generate once for `key`; returns (meditation id, shared)"""
+        future = self._calls.get(key)
+        if future is not None:
+            logger.info(f"Waiting on in-flight generation for key {key[:12]}")
+            try:
+                # shield: a follower giving up mustn't cancel the leader's generation
+                meditation_id = await asyncio.wait_for(
+                    asyncio.shield(future), get_coalesce_setting('COALESCE_WAIT_TIMEOUT')
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"In-flight generation for key {key[:12]} is taking too long; generating separately")
+                return await generate(), False
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader's client went away mid-generation; carry on without it
+                return await generate(), False
+            COALESCED.inc(source='local')
+            return meditation_id, True
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            meditation_id = await generate()
+            future.set_result(meditation_id)
+            return meditation_id, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't let the loop warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+# Process-wide single-flight group for generations
+single_flight = SingleFlight()
+
+# Single-flight group for the async server's event loop
+async_single_flight = AsyncSingleFlight()
@@ -0,0 +1,143 @@
+import sys
+import json
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from sqlalchemy.orm import load_only
+
+from models import db, Meditation
+from services.mp3 import probe, probe_bytes
+from services.storage import get_storage, audio_name
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 200
+
+# Words per second of spoken audio, for when the file can't be measured yet
+ESTIMATED_SECONDS_PER_WORD = 0.4
+
+class _Durations:
+    """Durations of recently saved files, so they needn't be read back from storage"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, name, seconds):
+        with self._lock:
+            self._entries[name] = seconds
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, name):
+        with self._lock:
+            return self._entries.get(name)
+
+known_durations = _Durations()
+
+def estimate_duration(script):
+    """Rough duration from the word count"""
+    return int(len(script.split()) * ESTIMATED_SECONDS_PER_WORD)
+
+def record_audio(name, audio_bytes):
+    """Measure mp3 bytes that are being saved under `name`"""
+    info = probe_bytes(audio_bytes)
+    if info is None:
+        logger.warning(f"{name} doesn't look like mp3; its duration will be estimated")
+        return None
+    known_durations.put(name, info.duration_seconds)
+    return info
+
+def measure(name, storage=None, trust_vbr_header=True):
+    """Mp3Info of a stored file, read in chunks, or None if it is missing or not mp3"""
+    storage = storage or get_storage()
+    try:
+        with storage.open(name) as f:
+            return probe(f, trust_vbr_header=trust_vbr_header)
+    except Exception as e:
+        logger.warning(f"Could not read {name} to measure it: {e}")
+        return None
+
+def audio_duration(audio_url):
+    """Whole seconds of audio behind an audio URL, or None if it can't be measured"""
+    name = audio_name(audio_url)
+    if not name:
+        return None
+    seconds = known_durations.get(name)
+    if seconds is None:
+        info = measure(name)
+        if info is None:
+            return None
+        seconds = info.duration_seconds
+        known_durations.put(name, seconds)
+    return round(seconds)
+
+def backfill_durations(batch_size=BACKFILL_BATCH_SIZE, dry_run=False):
+    """Replace estimated durations with ones measured from the stored mp3s.
+
+    Rows are walked by id in batches and each file is read in chunks, so
+    memory stays flat however many or however large the files are. Every
+    frame header is read (VBR headers aren't trusted) because files joined
+    before join_segments dropped them carry one describing only their first
+    segment.
+    """
+    storage = get_storage()
+    report = {'checked': 0, 'updated': 0, 'unreadable': 0}
+    measured = {}  # name -> seconds, for files shared by several rows
+    last_id = 0
+    while True:
+        batch = (
+            Meditation.query
+            .options(load_only(Meditation.id, Meditation.audio_url, Meditation.duration_seconds))
+            .filter(Meditation.id > last_id)
+            .order_by(Meditation.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for meditation in batch:
+            last_id = meditation.id
+            report['checked'] += 1
+            name = audio_name(meditation.audio_url)
+            if name not in measured:
+                info = measure(name, storage, trust_vbr_header=False) if name else None
+                measured[name] = round(info.duration_seconds) if info else None
+            seconds = measured[name]
+            if seconds is None:
+                report['unreadable'] += 1
+                continue
+            if seconds != meditation.duration_seconds:
+                logger.info(f"Meditation {meditation.id}: {meditation.duration_seconds}s -> {seconds}s")
+                meditation.duration_seconds = seconds
+                report['updated'] += 1
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+    if report['updated']:
+        logger.info(f"Measured durations for {report['updated']} meditations")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure meditation durations from their mp3 files")
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE, help="rows per transaction")
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without saving")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+        report = backfill_durations(batch_size=args.batch_size, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
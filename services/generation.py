@@ -0,0 +1,72 @@
+import logging
+from flask import current_app
+
+from services.pipeline import create_meditation
+from services.meditation_cache import get_meditation_cache, cache_key_for
+from services.audio_retention import record_access
+from services.script_composer import GENERATION_MODES, get_generation_mode
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Most emotions, goals and outcomes one meditation may combine
+MAX_SELECTIONS = 15
+
+def clean_selections(emotions, goals, outcomes):
+    """Strip whitespace and drop empty names from each selection list"""
+    def clean(values):
+        return [v.strip() for v in values or [] if v and v.strip()]
+    return clean(emotions), clean(goals), clean(outcomes)
+
+def selection_errors(emotions, goals, outcomes, mode='custom'):
+    """User-facing problems with cleaned selections; an empty list when they can be generated"""
+    errors = []
+    if not emotions:
+        errors.append("Please provide at least one emotion.")
+    if not goals:
+        errors.append("Please provide at least one goal.")
+    if not outcomes:
+        errors.append("Please provide at least one desired outcome.")
+
+    # Check for too many selections
+    if len(emotions) + len(goals) + len(outcomes) > MAX_SELECTIONS:  # Arbitrary limit to prevent overloading API
+        errors.append(f"Please select fewer options for better results (maximum {MAX_SELECTIONS} total selections).")
+
+    if mode not in GENERATION_MODES:
+        errors.append(f"Unknown mode '{mode}'. Choose one of: {', '.join(GENERATION_MODES)}.")
+    return errors
+
+def cached_meditation(cache_key):
+    """A stored meditation for these selections, if the cache has a usable one"""
+    if not current_app.config.get('MEDITATION_CACHE_ENABLED', True):
+        return None
+    cached = get_meditation_cache().get(cache_key)
+    if cached:
+        logger.info(f"Serving cached meditation {cached.id} for key {cache_key[:12]}")
+        record_access(cached)
+    return cached
+
+def get_or_create_meditation(emotions, goals, outcomes, mode=None, fresh=False, **options):
+    """The generation entry point for callers without their own admission step (e.g. Streamlit).
+
+    Returns (meditation, cached). A cached meditation for the same
+    selections is reused unless `fresh` is set; otherwise a new one is
+    generated, saved to the database and added to the cache, exactly as
+    for the API. `options` go to create_meditation (stream_audio, pipelined,
+    on_stage). Raises ValueError for invalid selections.
+    """
+    emotions, goals, outcomes = clean_selections(emotions, goals, outcomes)
+    mode = mode or get_generation_mode()
+    errors = selection_errors(emotions, goals, outcomes, mode)
+    if errors:
+        raise ValueError(" ".join(errors))
+
+    cache_key = cache_key_for(emotions, goals, outcomes, mode=mode)
+    if not fresh:
+        cached = cached_meditation(cache_key)
+        if cached:
+            return cached, True
+
+    # A fresh request wants its own variant, so it isn't merged with identical in-flight ones
+    meditation = create_meditation(emotions, goals, outcomes, cache_key=cache_key, coalesce=not fresh, mode=mode, **options)
+    return meditation, False
@@ -0,0 +1,207 @@
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, GenerationJob
+from services.pipeline import create_meditation
+from services.batch import run_batch
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class QueueFullError(RuntimeError):
+    """Raised when too many jobs are already waiting"""
+
+class JobQueue:
+    """Bounded worker pool that runs generation jobs stored in the database.
+
+    Job rows are the source of truth: the pool only holds job IDs, so jobs
+    that were queued or running when the process stopped are picked up again
+    by resume_pending() on the next start.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._pending = 0
+        self._limit = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._limit = app.config.get('JOB_QUEUE_LIMIT', 32)
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config.get('JOB_WORKERS', 4),
+            thread_name_prefix='meditation-job'
+        )
+
+    def submit(self, emotions, goals, outcomes, cache_key=None, stream_audio=False, pipelined=False, delay=0.0,
+               coalesce=True, mode='custom'):
+        """Persist a new job and schedule it; raises QueueFullError when saturated.
+
+        `delay` is the admission wait from the rate limiter; the job starts no
+        earlier than that many seconds from now.
+        """
+        job = GenerationJob(id=uuid.uuid4().hex, cache_key=cache_key)
+        job.set_params({
+            'emotions': emotions,
+            'goals': goals,
+            'outcomes': outcomes,
+            'stream_audio': stream_audio,
+            'pipelined': pipelined,
+            'coalesce': coalesce,
+            'mode': mode,
+            'not_before': time.time() + delay if delay else None
+        })
+        self._enqueue(job)
+        logger.info(f"Queued generation job {job.id}")
+        return job
+
+    def submit_batch(self, items, results, delay=0.0, mode='custom'):
+        """Persist a batch job and schedule it; raises QueueFullError when saturated.
+
+        `items` are dicts of cleaned emotions, goals, outcomes and cache_key;
+        `results` their initial progress entries (see services.batch), where
+        items already served from the cache are marked succeeded.
+        """
+        job = GenerationJob(id=uuid.uuid4().hex)
+        job.set_params({
+            'batch': True,
+            'items': items,
+            'mode': mode,
+            'not_before': time.time() + delay if delay else None
+        })
+        job.set_results(results)
+        self._enqueue(job)
+        logger.info(f"Queued batch job {job.id} with {len(items)} meditations")
+        return job
+
+    def _enqueue(self, job):
+        with self._lock:
+            if self._pending >= self._limit:
+                raise QueueFullError("Too many meditations are being generated right now. Please try again shortly.")
+            self._pending += 1
+
+        try:
+            db.session.add(job)
+            db.session.commit()
+            self._executor.submit(self._run, job.id)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def resume_pending(self):
+        """Reschedule jobs left unfinished by a previous process"""
+        jobs = GenerationJob.query.filter(GenerationJob.status.in_(('queued', 'running'))).all()
+        for job in jobs:
+            job.status = 'queued'
+            job.stage = 'queued'
+        db.session.commit()
+
+        for job in jobs:
+            with self._lock:
+                self._pending += 1
+            self._executor.submit(self._run, job.id)
+        if jobs:
+            logger.info(f"Resumed {len(jobs)} unfinished generation jobs")
+        return len(jobs)
+
+    def shutdown(self, wait=True):
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                self._process(job_id)
+        except Exception as e:
+            logger.error(f"Generation job {job_id} crashed: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _process(self, job_id):
+        job = GenerationJob.query.get(job_id)
+        if job is None or job.finished:
+            return
+
+        params = job.get_params()
+        # Wait out the rate limiter's queue position before calling upstream
+        remaining = (params.get('not_before') or 0) - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        job.status = 'running'
+        job.attempts += 1
+        db.session.commit()
+
+        def on_stage(stage):
+            job.stage = stage
+            db.session.commit()
+
+        if params.get('batch'):
+            self._process_batch(job, on_stage)
+            return
+
+        try:
+            meditation = create_meditation(
+                params.get('emotions', []),
+                params.get('goals', []),
+                params.get('outcomes', []),
+                cache_key=job.cache_key,
+                on_stage=on_stage,
+                stream_audio=params.get('stream_audio', False),
+                pipelined=params.get('pipelined', False),
+                coalesce=params.get('coalesce', True),
+                mode=params.get('mode', 'custom')
+            )
+        except ValueError as e:
+            self._fail(job, str(e), 'value_error')
+            return
+        except RuntimeError as e:
+            self._fail(job, str(e), 'runtime_error')
+            return
+        except Exception as e:
+            logger.error(f"Unexpected error in generation job {job_id}: {e}", exc_info=True)
+            self._fail(job, 'An unexpected error occurred. Please try again later.', 'unexpected_error')
+            return
+
+        job.meditation_id = meditation.id
+        job.status = 'succeeded'
+        job.stage = 'done'
+        db.session.commit()
+        logger.info(f"Generation job {job_id} finished with meditation {meditation.id}")
+
+    def _process_batch(self, job, on_stage):
+        try:
+            results = run_batch(job, on_stage)
+        except Exception as e:
+            logger.error(f"Unexpected error in batch job {job.id}: {e}", exc_info=True)
+            self._fail(job, 'An unexpected error occurred. Please try again later.', 'unexpected_error')
+            return
+
+        # Some meditations of a program are still worth returning; per-item errors are in the results
+        failed = [result for result in results if result['status'] == 'failed']
+        if failed and len(failed) == len(results):
+            self._fail(job, failed[0]['error'], failed[0]['error_type'])
+            return
+        job.status = 'succeeded'
+        job.stage = 'done'
+        db.session.commit()
+        logger.info(f"Batch job {job.id} finished: {len(results) - len(failed)} of {len(results)} meditations succeeded")
+
+    def _fail(self, job, message, error_type):
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = message
+        job.error_type = error_type
+        db.session.commit()
+        logger.error(f"Generation job {job.id} failed: {message}")
+
+# Process-wide queue, bound to the Flask app in app.py
+job_queue = JobQueue()
@@ -0,0 +1,61 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy.orm import defer
+
+from models import db, Meditation, MeditationTag, Tag, normalize_tag
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(meditation):
+    """Opaque position after this row in newest-first order"""
+    payload = json.dumps([meditation.created_at.isoformat(), meditation.id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; ValueError if it was tampered with"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, meditation_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(meditation_id)
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor. Start again from the first page.")
+
+def _has_tag(kind, name):
+    """Filter matching meditations linked to one tag (unknown tags match nothing)"""
+    tag_ids = db.session.query(Tag.id).filter(Tag.kind == kind, Tag.normalized == normalize_tag(name))
+    return Meditation.id.in_(
+        db.session.query(MeditationTag.meditation_id).filter(MeditationTag.tag_id.in_(tag_ids))
+    )
+
+def list_meditations(saved=None, emotions=(), goals=(), outcomes=(), limit=DEFAULT_PAGE_SIZE, cursor=None,
+                     load_script=False):
+    """One page of meditations, newest first, matching every given tag.
+
+    Uses keyset pagination on (created_at, id), so pages stay fast and stable
+    while new meditations are being added. The script column is only loaded
+    with `load_script`. Returns (meditations, next_cursor).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = Meditation.query
+    if not load_script:
+        query = query.options(defer(Meditation.script))
+    if saved is not None:
+        query = query.filter(Meditation.saved.is_(True) if saved else Meditation.saved.isnot(True))
+    for kind, names in (('emotion', emotions), ('goal', goals), ('outcome', outcomes)):
+        for name in names:
+            if name and name.strip():
+                query = query.filter(_has_tag(kind, name))
+    if cursor:
+        created_at, meditation_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            Meditation.created_at < created_at,
+            db.and_(Meditation.created_at == created_at, Meditation.id < meditation_id)
+        ))
+
+    # One extra row tells whether there is another page
+    rows = query.order_by(Meditation.created_at.desc(), Meditation.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
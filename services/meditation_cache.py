@@ -0,0 +1,216 @@
+import os
+import json
+import random
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+
+from models import Meditation
+from services.script_generator import SCRIPT_MODEL, PROMPT_VERSION
+from services.audio_generator import TTS_MODEL_ID
+from services.storage import get_storage, audio_name
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+DEFAULT_VOICE_ID = 'sX7PMBZDfORL1SPZi4XW'
+
+def normalize_selections(emotions, goals, outcomes):
+    """Case-fold, de-duplicate and sort selections so equivalent requests match"""
+    def normalize(values):
+        return sorted({v.strip().casefold() for v in values or [] if v and v.strip()})
+    return normalize(emotions), normalize(goals), normalize(outcomes)
+
+def get_voice_id():
+    """Get the configured ElevenLabs voice from Flask context or environment"""
+    try:
+        return current_app.config.get('ELEVENLABS_VOICE_ID') or DEFAULT_VOICE_ID
+    except RuntimeError:
+        return os.environ.get('ELEVENLABS_VOICE_ID', DEFAULT_VOICE_ID)
+
+def cache_key_for(emotions, goals, outcomes, voice_id=None, mode='custom', prompt_version=PROMPT_VERSION):
+    """Hash normalized selections with everything else that shapes the output"""
+    emotions, goals, outcomes = normalize_selections(emotions, goals, outcomes)
+    payload = {
+        'emotions': emotions,
+        'goals': goals,
+        'outcomes': outcomes,
+        'script_model': SCRIPT_MODEL,
+        'prompt_version': prompt_version,
+        'tts_model': TTS_MODEL_ID,
+        'voice_id': voice_id or get_voice_id(),
+    }
+    # Left out for custom scripts so keys from before composition existed stay valid
+    if mode != 'custom':
+        payload['mode'] = mode
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def audio_exists(audio_url):
+    """Check that the mp3 behind an audio URL is still in storage"""
+    name = audio_name(audio_url)
+    return bool(name) and get_storage().exists(name)
+
+class MeditationCache:
+    """In-memory LRU index over cached meditation IDs, backed by Meditation.cache_key.
+
+    Each key holds up to `variants` meditation IDs. Until a key has that many
+    variants, lookups count as misses so new variants get generated; after
+    that, lookups pick one of the stored variants at random.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=7 * 24 * 3600, variants=1):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.variants = variants
+        self._entries = OrderedDict()  # key -> (loaded_at, [meditation ids])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_entries=None, ttl_seconds=None, variants=None):
+        """Update limits, e.g. from the Flask config"""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            if variants is not None:
+                self.variants = max(1, variants)
+            self._evict_overflow()
+
+    def get(self, key):
+        """Return a cached Meditation for this key, or None on a miss"""
+        ids = self._cached_ids(key)
+        if ids is None:
+            ids = self._load_ids(key)
+
+        if len(ids) < self.variants:
+            self._record(hit=False)
+            return None
+
+        # Try variants in random order; drop any whose row or audio has gone
+        for meditation_id in random.sample(ids, len(ids)):
+            meditation = Meditation.query.get(meditation_id)
+            if meditation and audio_exists(meditation.audio_url) and not self._expired(meditation.created_at):
+                self._record(hit=True)
+                return meditation
+            self._discard(key, meditation_id)
+
+        self._record(hit=False)
+        return None
+
+    def cached_variants(self, key):
+        """Number of usable variants stored for this key, without counting a lookup"""
+        ids = self._cached_ids(key)
+        if ids is None:
+            ids = self._load_ids(key)
+        count = 0
+        for meditation_id in ids:
+            meditation = Meditation.query.get(meditation_id)
+            if meditation and audio_exists(meditation.audio_url):
+                count += 1
+        return count
+
+    def put(self, key, meditation):
+        """Register a freshly generated meditation as a variant for this key"""
+        with self._lock:
+            _, ids = self._entries.pop(key, (time.monotonic(), []))
+            if meditation.id not in ids:
+                ids = (ids + [meditation.id])[-self.variants:]
+            self._entries[key] = (time.monotonic(), ids)
+            self._evict_overflow()
+
+    def invalidate(self, key=None):
+        """Forget one key, or everything when no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'variants': self.variants,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def _cached_ids(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            loaded_at, ids = entry
+            if time.monotonic() - loaded_at > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return list(ids)
+
+    def _load_ids(self, key):
+        query = Meditation.query.filter_by(cache_key=key)
+        if self.ttl_seconds:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            query = query.filter(Meditation.created_at >= cutoff)
+        rows = query.order_by(Meditation.created_at.desc()).limit(self.variants).all()
+        ids = [m.id for m in rows]
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), ids)
+            self._entries.move_to_end(key)
+            self._evict_overflow()
+        return ids
+
+    def _discard(self, key, meditation_id):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and meditation_id in entry[1]:
+                entry[1].remove(meditation_id)
+
+    def _expired(self, created_at):
+        if not self.ttl_seconds or created_at is None:
+            return False
+        return datetime.utcnow() - created_at > timedelta(seconds=self.ttl_seconds)
+
+    def _evict_overflow(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+# Process-wide cache instance
+meditation_cache = MeditationCache()
+
+def get_meditation_cache():
+    """Get the shared cache, configured from the Flask context when available"""
+    try:
+        config = current_app.config
+        meditation_cache.configure(
+            max_entries=config.get('MEDITATION_CACHE_MAX_ENTRIES'),
+            ttl_seconds=config.get('MEDITATION_CACHE_TTL'),
+            variants=config.get('MEDITATION_CACHE_VARIANTS'),
+        )
+    except RuntimeError:
+        pass
+    return meditation_cache
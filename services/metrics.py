@@ -0,0 +1,219 @@
+import time
+import bisect
+import random
+import threading
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+# Latency buckets in seconds, from fast cache hits to slow TTS calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120)
+
+# Samples kept per series for percentile estimates
+RESERVOIR_SIZE = 1024
+
+# Quantiles reported alongside each histogram
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class _HistogramSeries:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.reservoir = []
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        # Reservoir sampling keeps a uniform sample for percentiles in bounded memory
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.reservoir[slot] = value
+
+    def quantile(self, q):
+        if not self.reservoir:
+            return None
+        ordered = sorted(self.reservoir)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Histogram:
+    """Bucketed histogram with labels, plus sampled percentiles"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(self.buckets)
+            series.observe(value)
+
+    def percentiles(self):
+        """{label values: {'p50': ..., 'p99': ..., 'count': n}} for JSON views"""
+        with self._lock:
+            return {
+                key: dict(
+                    {f"p{int(q * 100)}": series.quantile(q) for q in QUANTILES},
+                    count=series.count
+                )
+                for key, series in self._series.items()
+            }
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        quantile_lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+                lines.append(f"{self.name}_count{labels} {series.count}")
+                for q in QUANTILES:
+                    value = series.quantile(q)
+                    if value is not None:
+                        quantile_labels = _format_labels(self.labelnames, key, [('quantile', q)])
+                        quantile_lines.append(f"{self.name}_quantile{quantile_labels} {_format_value(value)}")
+        if quantile_lines:
+            # Sampled percentiles as a separate gauge family, for dashboards without histogram_quantile()
+            lines.append(f"# HELP {self.name}_quantile Sampled percentiles of {self.name}")
+            lines.append(f"# TYPE {self.name}_quantile gauge")
+            lines.extend(quantile_lines)
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# Generation pipeline metrics
+STAGE_SECONDS = registry.register(Histogram(
+    'meditation_stage_seconds',
+    'Time spent in each generation stage',
+    ['stage']
+))
+UPSTREAM_SECONDS = registry.register(Histogram(
+    'meditation_upstream_request_seconds',
+    'Latency of calls to upstream APIs, including retries',
+    ['upstream', 'outcome']
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'meditation_http_request_seconds',
+    'End-to-end latency of API requests',
+    ['endpoint', 'status']
+))
+LLM_TOKENS = registry.register(Counter(
+    'meditation_llm_tokens_total',
+    'Tokens used by script generation',
+    ['kind']
+))
+SCRIPT_CHARACTERS = registry.register(Counter(
+    'meditation_script_characters_total',
+    'Characters of generated meditation script'
+))
+TTS_CHARACTERS = registry.register(Counter(
+    'meditation_tts_characters_total',
+    'Characters sent to text-to-speech'
+))
+AUDIO_BYTES = registry.register(Counter(
+    'meditation_audio_bytes_total',
+    'Bytes of audio written to storage'
+))
+RATE_LIMITED = registry.register(Counter(
+    'meditation_rate_limited_total',
+    'Generation requests turned away by the rate limiter',
+    ['scope']
+))
+COALESCED = registry.register(Counter(
+    'meditation_coalesced_total',
+    'Generations served from an identical request that was already in flight',
+    ['source']
+))
+
+@contextmanager
+def timed_stage(name):
+    """Time a pipeline stage into the stage histogram and the request's Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if has_request_context():
+            timings = g.setdefault('server_timings', [])
+            timings.append((name, elapsed))
+
+def server_timing_header():
+    """Server-Timing header value for the current request, or None"""
+    timings = g.get('server_timings') if has_request_context() else None
+    if not timings:
+        return None
+    # Stages can repeat (e.g. several TTS segments); report their totals
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ', '.join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
+
+def render_prometheus():
+    return registry.render()
@@ -0,0 +1,211 @@
+from collections import namedtuple
+
+PROBE_CHUNK_SIZE = 64 * 1024
+
+# Bitrates in kbps by (MPEG-1?, layer), indexed by the header's 4-bit bitrate field
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates by the header's 2-bit version field (1 is reserved)
+_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),   # MPEG-2.5
+    2: (22050, 24000, 16000),  # MPEG-2
+    3: (44100, 48000, 32000),  # MPEG-1
+}
+
+FrameHeader = namedtuple('FrameHeader', 'mpeg1 layer bitrate_kbps sample_rate channels samples frame_length')
+
+Mp3Info = namedtuple('Mp3Info', 'duration_seconds bitrate_kbps sample_rate channels frames')
+
+def id3v2_size(data):
+    """Length of a leading ID3v2 tag (header, body and footer), or 0"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    # Tag size is a 28-bit "syncsafe" integer (7 bits per byte)
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    has_footer = data[5] & 0x10
+    return 10 + size + (10 if has_footer else 0)
+
+def strip_tags(data):
+    """Remove a leading ID3v2 tag and a trailing ID3v1 tag, leaving only frames"""
+    start = id3v2_size(data)
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    return data[start:end]
+
+def parse_frame_header(data, offset=0):
+    """FrameHeader for the four bytes at `offset`, or None if they aren't a valid MPEG audio header"""
+    if len(data) - offset < 4:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    # Reserved version/layer, free-format or bad bitrate, reserved sample rate
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if b3 >> 6 == 3 else 2
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or mpeg1 else 576
+        frame_length = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return FrameHeader(mpeg1, layer, bitrate, sample_rate, channels, samples, frame_length)
+
+def vbr_header(frame, header):
+    """(frames, bytes) from a Xing/Info or VBRI header in this frame, or None.
+
+    Either value may be None when the encoder left it out. These frames carry
+    no audio; they describe the whole stream for players.
+    """
+    # Xing/Info sits right after the side information
+    if header.mpeg1:
+        offset = 4 + (32 if header.channels == 2 else 17)
+    else:
+        offset = 4 + (17 if header.channels == 2 else 9)
+    if frame[offset:offset + 4] in (b'Xing', b'Info') and len(frame) >= offset + 8:
+        flags = int.from_bytes(frame[offset + 4:offset + 8], 'big')
+        position = offset + 8
+        frames = total_bytes = None
+        if flags & 0x1 and len(frame) >= position + 4:
+            frames = int.from_bytes(frame[position:position + 4], 'big')
+            position += 4
+        if flags & 0x2 and len(frame) >= position + 4:
+            total_bytes = int.from_bytes(frame[position:position + 4], 'big')
+        return frames, total_bytes
+
+    # VBRI (Fraunhofer) always sits 32 bytes after the header
+    if frame[36:40] == b'VBRI' and len(frame) >= 54:
+        return int.from_bytes(frame[50:54], 'big'), int.from_bytes(frame[46:50], 'big')
+    return None
+
+def strip_vbr_header(data):
+    """Drop a leading Xing/Info/VBRI frame, which would describe only this part of a joined stream"""
+    header = parse_frame_header(data)
+    if header and vbr_header(data[:header.frame_length], header) is not None:
+        return data[header.frame_length:]
+    return data
+
+def join_segments(segments):
+    """Concatenate mp3 segments into one stream.
+
+    MPEG frames are self-contained, so segments encoded with the same settings
+    can be joined by appending their frames. Tags in the middle of the stream
+    would be played as noise by some decoders, and a segment's VBR header would
+    tell players the whole stream is as long as that segment, so both are
+    stripped.
+    """
+    return b''.join(strip_vbr_header(strip_tags(segment)) for segment in segments)
+
+class FrameScanner:
+    """Walks MPEG frame headers of an mp3 fed in chunks, without decoding audio.
+
+    Only a partial frame is ever buffered, so memory stays constant however
+    large the file is. With `trust_vbr_header`, a Xing/Info/VBRI header in
+    the first frame is taken at its word and `complete` turns true right
+    away, so callers can stop reading.
+    """
+
+    def __init__(self, trust_vbr_header=True):
+        self.trust_vbr_header = trust_vbr_header
+        self.first = None
+        self.frames = 0
+        self.samples = 0
+        self.audio_bytes = 0
+        self.vbr = None
+        self.complete = False
+        self._buffer = bytearray()
+        self._skip = 0
+        self._started = False
+
+    def feed(self, chunk):
+        buffer = self._buffer
+        buffer += chunk
+        position = 0
+        if not self._started:
+            if len(buffer) < 10:
+                return
+            self._skip = id3v2_size(buffer)
+            self._started = True
+
+        while not self.complete:
+            if self._skip:
+                skipped = min(self._skip, len(buffer) - position)
+                position += skipped
+                self._skip -= skipped
+                if self._skip:
+                    break
+            if len(buffer) - position < 4:
+                break
+            header = parse_frame_header(buffer, position)
+            if header is None:
+                # Trailing ID3v1 tag, junk or a lost sync: look for the next header
+                position += 1
+                continue
+
+            if self.first is None:
+                # The whole first frame is needed to check it for a VBR header
+                if len(buffer) - position < header.frame_length:
+                    break
+                self.first = header
+                self.vbr = vbr_header(bytes(buffer[position:position + header.frame_length]), header)
+                self._skip = header.frame_length
+                if self.vbr is not None:
+                    self.complete = self.trust_vbr_header and self.vbr[0] is not None
+                    continue
+
+            self.frames += 1
+            self.samples += header.samples
+            self.audio_bytes += header.frame_length
+            self._skip = header.frame_length
+
+        del buffer[:position]
+
+    def info(self):
+        """Mp3Info for what has been seen, or None if no frame was found"""
+        if self.first is None:
+            return None
+        frames, samples, audio_bytes = self.frames, self.samples, self.audio_bytes
+        if self.complete:
+            frames = self.vbr[0]
+            samples = frames * self.first.samples
+            audio_bytes = self.vbr[1]
+
+        duration = samples / self.first.sample_rate
+        if audio_bytes and duration:
+            bitrate = round(audio_bytes * 8 / duration / 1000)
+        else:
+            bitrate = self.first.bitrate_kbps
+        return Mp3Info(duration, bitrate, self.first.sample_rate, self.first.channels, frames)
+
+def probe(fileobj, chunk_size=PROBE_CHUNK_SIZE, trust_vbr_header=True):
+    """Mp3Info for a binary file-like object read in chunks, or None if it isn't mp3"""
+    scanner = FrameScanner(trust_vbr_header)
+    while not scanner.complete:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        scanner.feed(chunk)
+    return scanner.info()
+
+def probe_bytes(data, trust_vbr_header=True):
+    """Mp3Info for mp3 bytes already in memory, or None if they aren't mp3"""
+    scanner = FrameScanner(trust_vbr_header)
+    scanner.feed(data)
+    return scanner.info()
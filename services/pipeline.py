@@ -0,0 +1,175 @@
+import logging
+from contextlib import nullcontext
+from flask import current_app, has_app_context
+
+from models import db, Meditation
+from services.script_generator import generate_script, stream_script
+from services.audio_generator import (
+    generate_audio, generate_segmented_audio, start_audio_stream, get_active_stream, TTS_MAX_CHARS
+)
+from services.durations import audio_duration, estimate_duration
+from services.storage import audio_name
+from services.text_segments import iter_segments
+from services.meditation_cache import get_meditation_cache
+from services.audio_retention import enforce_quota_if_due
+from services.transcoder import transcoder
+from services.metrics import timed_stage
+from services.coalescing import single_flight, get_coalesce_setting
+from services.script_composer import compose_meditation, MissingSegmentError
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Pipeline stages, in order, as reported to job status callers. A request that
+# is coalesced with an identical in-flight one reports 'waiting' instead, and a
+# composed meditation reports 'composing' before any fallback to these stages.
+STAGES = ('script', 'audio', 'saving')
+
+def create_meditation(emotions, goals, outcomes, cache_key=None, on_stage=None, stream_audio=False, pipelined=False,
+                      coalesce=True, mode='custom'):
+    """Run script generation, audio generation and the DB insert for one meditation.
+
+    `on_stage` is called with each stage name before it starts so callers
+    (e.g. the job queue) can report progress. With `stream_audio`, the row is
+    saved as soon as ElevenLabs starts sending audio; the mp3 keeps being
+    written in the background and can be played from its stream URL meanwhile.
+    With `pipelined`, the script is streamed from OpenAI and each paragraph is
+    sent to ElevenLabs as soon as it is complete, overlapping the two stages.
+    With `coalesce` and a `cache_key`, a request identical to one already in
+    flight waits for that one and returns the same meditation. In 'composed'
+    `mode` the meditation is assembled from the segment library without any
+    upstream calls, falling back to a custom script if segments are missing.
+    """
+    def enter(stage):
+        if on_stage:
+            on_stage(stage)
+
+    def generate():
+        return _generate_meditation(emotions, goals, outcomes, cache_key, enter, stream_audio, pipelined, mode)
+
+    if coalesce and cache_key and get_coalesce_setting('COALESCE_ENABLED'):
+        meditation, shared = single_flight.run(cache_key, generate, on_wait=lambda: enter('waiting'))
+        if shared:
+            logger.info(f"Coalesced with in-flight generation of meditation {meditation.id}")
+        return meditation
+    return generate()
+
+def _generate_meditation(emotions, goals, outcomes, cache_key, enter, stream_audio, pipelined, mode):
+    script = None
+    if mode == 'composed':
+        enter('composing')
+        try:
+            script, audio_url = compose_meditation(emotions, goals, outcomes)
+        except MissingSegmentError as e:
+            logger.warning(f"Can't compose this meditation ({e}); writing a custom script instead")
+
+    if script is None:
+        if pipelined:
+            script, audio_url = _pipelined_script_and_audio(emotions, goals, outcomes, enter)
+        else:
+            script, audio_url = _script_and_audio(emotions, goals, outcomes, enter, stream_audio)
+
+    enter('saving')
+    return save_meditation(script, audio_url, emotions, goals, outcomes, cache_key)
+
+def save_meditation(script, audio_url, emotions, goals, outcomes, cache_key=None):
+    """Insert a finished meditation and start its follow-up work (cache, renditions, quota)"""
+    # Audio that is still streaming is measured once it is complete
+    stream = get_active_stream(audio_name(audio_url))
+    duration = audio_duration(audio_url) if stream is None else None
+    meditation = build_meditation(script, audio_url, emotions, goals, outcomes, cache_key, duration)
+    with timed_stage('db_commit'):
+        db.session.add(meditation)
+        db.session.commit()
+    logger.info(f"Meditation saved to database with ID: {meditation.id}")
+
+    if stream is not None:
+        _measure_when_streamed(stream, meditation.id)
+
+    if cache_key:
+        get_meditation_cache().put(cache_key, meditation)
+
+    # Bandwidth-friendly renditions are encoded in the background
+    transcoder.schedule(meditation)
+
+    # New audio may have pushed storage over its quota
+    enforce_quota_if_due()
+    return meditation
+
+def _script_and_audio(emotions, goals, outcomes, enter, stream_audio):
+    """Write a custom script, then voice it; returns (script, audio_url)"""
+    enter('script')
+    logger.info(f"Generating script with emotions: {emotions}, goals: {goals}, outcomes: {outcomes}")
+    script = generate_script(goals, emotions, outcomes)
+    logger.info(f"Script generated successfully ({len(script)} characters)")
+
+    enter('audio')
+    # Long scripts can't be streamed in one request; generate_audio segments them
+    if stream_audio and len(script) <= TTS_MAX_CHARS:
+        logger.info("Starting audio stream")
+        audio_url = start_audio_stream(script).audio_url
+        logger.info("Audio stream started")
+    else:
+        logger.info("Generating audio")
+        audio_url = generate_audio(script)
+        logger.info("Audio generated successfully")
+    return script, audio_url
+
+def _pipelined_script_and_audio(emotions, goals, outcomes, enter):
+    """Stream the script into segmented speech synthesis; returns (script, audio_url)"""
+    enter('script')
+    logger.info(f"Generating pipelined script and audio with emotions: {emotions}, goals: {goals}, outcomes: {outcomes}")
+    parts = []
+
+    def script_chunks():
+        for chunk in stream_script(goals, emotions, outcomes):
+            parts.append(chunk)
+            yield chunk
+        # The script is complete; what remains is waiting on queued segments
+        enter('audio')
+
+    audio_url = generate_segmented_audio(iter_segments(script_chunks()))
+    script = ''.join(parts).strip()
+    logger.info(f"Pipelined generation finished ({len(script)} characters)")
+    return script, audio_url
+
+def _measure_when_streamed(stream, meditation_id):
+    """Replace the estimated duration of a streamed meditation once its audio is complete"""
+    app = current_app._get_current_object()
+
+    def update(finished):
+        if finished.error is not None:
+            return
+        # Runs right here if the audio is already complete; pushing a nested
+        # context would tear down the caller's DB session when it pops
+        with nullcontext() if has_app_context() else app.app_context():
+            duration = audio_duration(finished.audio_url)
+            if duration is not None:
+                Meditation.query.filter_by(id=meditation_id).update({'duration_seconds': duration})
+                db.session.commit()
+
+    stream.add_done_callback(update)
+
+def build_meditation(script, audio_url, emotions, goals, outcomes, cache_key=None, duration_seconds=None):
+    """Create (but don't commit) a Meditation row with its selection metadata.
+
+    `duration_seconds` is the measured length of the audio; without it the
+    duration is estimated from the script.
+    """
+    meditation = Meditation(
+        script=script,
+        audio_url=audio_url,
+        cache_key=cache_key,
+        duration_seconds=duration_seconds if duration_seconds is not None else estimate_duration(script)
+    )
+
+    # Store selection metadata
+    meditation.set_emotions(emotions)
+    meditation.set_goals(goals)
+    meditation.set_outcomes(outcomes)
+
+    # Generate a title based on selections
+    emotion_str = emotions[0] if emotions else "Calm"
+    goal_str = goals[0] if goals else "Mindfulness"
+    meditation.title = f"{emotion_str} {goal_str} Meditation"
+    return meditation
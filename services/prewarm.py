@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from itertools import combinations, product
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import func
+
+from models import db, Meditation
+from services.meditation_cache import cache_key_for, get_meditation_cache
+from services.pipeline import create_meditation
+from services.rate_limit import admit_generation, RateLimitedError, UPSTREAMS
+from services.selections import EMOTIONS, GOALS, OUTCOMES
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = os.path.join('instance', 'prewarm_checkpoint.json')
+
+def _subsets(options, max_size):
+    for size in range(1, max_size + 1):
+        for subset in combinations(options, size):
+            yield list(subset)
+
+def list_combinations(max_per_category=1):
+    """Every selection set the front ends can submit, up to max_per_category per list"""
+    return [
+        {'emotions': emotions, 'goals': goals, 'outcomes': outcomes}
+        for emotions, goals, outcomes in product(
+            _subsets(EMOTIONS, max_per_category),
+            list(_subsets(GOALS, max_per_category)),
+            list(_subsets(OUTCOMES, max_per_category))
+        )
+    ]
+
+def historical_frequency():
+    """How often each cache key was generated, with one example selection set"""
+    counts = dict(
+        db.session.query(Meditation.cache_key, func.count(Meditation.id))
+        .filter(Meditation.cache_key.isnot(None))
+        .group_by(Meditation.cache_key)
+        .all()
+    )
+    examples = {}
+    for meditation in Meditation.query.filter(Meditation.cache_key.in_(counts.keys())):
+        examples.setdefault(meditation.cache_key, {
+            'emotions': meditation.get_emotions(),
+            'goals': meditation.get_goals(),
+            'outcomes': meditation.get_outcomes()
+        })
+    return counts, examples
+
+def rank_combinations(max_per_category=1):
+    """Candidate selection sets ordered by how often they were requested before"""
+    counts, examples = historical_frequency()
+    candidates = {}
+    for selections in list_combinations(max_per_category):
+        key = cache_key_for(selections['emotions'], selections['goals'], selections['outcomes'])
+        candidates[key] = selections
+    # Popular combinations outside the matrix (e.g. larger multi-selects) count too
+    for key, selections in examples.items():
+        candidates.setdefault(key, selections)
+
+    # Stable sort keeps matrix order among equally popular combinations
+    ranked = sorted(candidates.items(), key=lambda item: counts.get(item[0], 0), reverse=True)
+    return [(key, selections, counts.get(key, 0)) for key, selections in ranked]
+
+class Checkpoint:
+    """JSON file of finished and failed cache keys so interrupted runs can resume"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.done = set(data.get('done', []))
+            self.failed = data.get('failed', {})
+
+    def mark(self, key, error=None):
+        with self._lock:
+            if error is None:
+                self.done.add(key)
+                self.failed.pop(key, None)
+            else:
+                self.failed[key] = error
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'done': sorted(self.done), 'failed': self.failed}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def parse_window(window):
+    """Parse 'HH:MM-HH:MM' into (start, end) times; the window may wrap midnight"""
+    start, end = window.split('-')
+    return (datetime.strptime(start, '%H:%M').time(), datetime.strptime(end, '%H:%M').time())
+
+def in_window(window, now=None):
+    if window is None:
+        return True
+    start, end = window
+    now = (now or datetime.now()).time()
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+def wait_for_upstreams(stop):
+    """Reserve one generation from the shared upstream buckets, waiting as long as it takes.
+
+    Prewarming draws on the same OpenAI and ElevenLabs budget as live
+    traffic (shared across processes with RATE_LIMIT_BACKEND=redis), so a
+    run can't push user requests into 429s. Returns False if `stop` was set
+    while waiting.
+    """
+    while not stop.is_set():
+        try:
+            wait = admit_generation(None, upstreams=UPSTREAMS)
+        except RateLimitedError as e:
+            logger.info(f"Upstream {e.scope} is busy; prewarm retrying in {e.retry_after:.1f}s")
+            stop.wait(e.retry_after)
+            continue
+        if wait:
+            time.sleep(wait)
+        return True
+    return False
+
+def prewarm(app, limit=None, workers=2, max_per_category=1,
+            checkpoint_path=DEFAULT_CHECKPOINT, window=None, dry_run=False):
+    """Generate meditations for the most popular uncached combinations"""
+    with app.app_context():
+        cache = get_meditation_cache()
+        checkpoint = Checkpoint(checkpoint_path)
+        todo = []
+        for key, selections, count in rank_combinations(max_per_category):
+            if key in checkpoint.done or cache.cached_variants(key) >= cache.variants:
+                continue
+            todo.append((key, selections, count))
+            if limit and len(todo) >= limit:
+                break
+
+    logger.info(f"{len(todo)} combinations to prewarm")
+    if dry_run:
+        for key, selections, count in todo:
+            print(f"{count:5d}  {key[:12]}  {json.dumps(selections)}")
+        return {'planned': len(todo), 'generated': 0, 'failed': 0}
+
+    stop = threading.Event()
+    summary = {'planned': len(todo), 'generated': 0, 'failed': 0}
+
+    def generate(key, selections):
+        if stop.is_set():
+            return None
+        if not in_window(window):
+            # Outside the off-peak window: stop here, the checkpoint lets the next run resume
+            stop.set()
+            return None
+        with app.app_context():
+            if not wait_for_upstreams(stop):
+                return None
+            emotions, goals, outcomes = selections['emotions'], selections['goals'], selections['outcomes']
+            try:
+                meditation = create_meditation(emotions, goals, outcomes, cache_key=key)
+            except (ValueError, RuntimeError) as e:
+                checkpoint.mark(key, error=str(e))
+                raise
+            checkpoint.mark(key)
+            return meditation.id
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prewarm') as executor:
+        futures = {executor.submit(generate, key, selections): key for key, selections, _ in todo}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                meditation_id = future.result()
+            except Exception as e:
+                summary['failed'] += 1
+                logger.error(f"Prewarm failed for {key[:12]}: {e}")
+                continue
+            if meditation_id is not None:
+                summary['generated'] += 1
+                logger.info(f"Prewarmed {key[:12]} as meditation {meditation_id}")
+
+    if stop.is_set():
+        logger.info("Left the off-peak window; run again to resume from the checkpoint")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate meditations for popular selection combinations")
+    parser.add_argument('--limit', type=int, default=None, help="maximum number of meditations to generate")
+    parser.add_argument('--workers', type=int, default=2, help="concurrent generations")
+    parser.add_argument('--max-per-category', type=int, default=1, help="largest multi-selection per list to enumerate")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="resume file")
+    parser.add_argument('--window', type=parse_window, default=None, help="off-peak window, e.g. 01:00-06:00; the run stops when it ends")
+    parser.add_argument('--dry-run', action='store_true', help="list the ranked combinations without generating")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+
+    summary = prewarm(
+        app,
+        limit=args.limit,
+        workers=args.workers,
+        max_per_category=args.max_per_category,
+        checkpoint_path=args.checkpoint,
+        window=args.window,
+        dry_run=args.dry_run
+    )
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
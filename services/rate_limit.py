@@ -0,0 +1,273 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from flask import current_app, request
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RATE_LIMIT_ENABLED': True,
+    'RATE_LIMIT_BACKEND': 'memory',          # 'memory' (per process) or 'redis' (shared)
+    'RATE_LIMIT_REDIS_URL': 'redis://localhost:6379/0',
+    'RATE_LIMIT_TRUST_FORWARDED': False,     # key clients by X-Forwarded-For behind a proxy
+    'RATE_LIMIT_CLIENT_PER_MINUTE': 5.0,
+    'RATE_LIMIT_CLIENT_BURST': 3,
+    'RATE_LIMIT_OPENAI_PER_MINUTE': 60.0,
+    'RATE_LIMIT_OPENAI_BURST': 10,
+    'RATE_LIMIT_ELEVENLABS_PER_MINUTE': 20.0,
+    'RATE_LIMIT_ELEVENLABS_BURST': 5,
+    'RATE_LIMIT_MAX_WAIT_SECONDS': 30.0,     # longest queue wait before answering 429
+    'SCRIPT_STAGE_CONCURRENCY': 8,
+    'AUDIO_STAGE_CONCURRENCY': 4,
+    'STAGE_SLOT_TIMEOUT': 120.0,
+}
+
+# Upstreams that generations are admitted against
+UPSTREAMS = ('openai', 'elevenlabs')
+
+def get_rate_limit_setting(name):
+    """Read a rate limit setting from Flask context or environment"""
+    default = DEFAULTS[name]
+    try:
+        value = current_app.config.get(name, default)
+    except RuntimeError:
+        value = os.environ.get(name, default)
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.lower() not in ('false', '0', 'no')
+    return type(default)(value)
+
+class RateLimitedError(RuntimeError):
+    """Raised when a request would wait longer than allowed for a token"""
+
+    def __init__(self, message, retry_after, scope):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+def take(tokens, updated, now, rate, capacity, cost, max_wait):
+    """Token bucket step shared by the backends.
+
+    Tokens may go negative: a request that finds the bucket empty reserves a
+    future token and waits for it, which makes the deficit a queue whose
+    length is bounded by max_wait. Returns (allowed, wait, new tokens).
+    """
+    if tokens is None:
+        tokens = float(capacity)
+    else:
+        tokens = min(float(capacity), tokens + max(0.0, now - updated) * rate)
+    if tokens >= cost:
+        return True, 0.0, tokens - cost
+    wait = (cost - tokens) / rate if rate > 0 else float('inf')
+    if wait > max_wait:
+        return False, wait - max_wait, tokens
+    return True, wait, tokens - cost
+
+class MemoryBackend:
+    """Buckets in this process only"""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def reserve(self, key, rate, capacity, cost=1, max_wait=0.0):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, now))
+            allowed, wait, tokens = take(tokens, updated, now, rate, capacity, cost, max_wait)
+            self._buckets[key] = (tokens, now)
+        return allowed, wait
+
+    def refund(self, key, capacity, cost=1):
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(float(capacity), tokens + cost), updated)
+
+class RedisBackend:
+    """Buckets shared by every process through Redis (optimistic WATCH/MULTI updates)"""
+
+    def __init__(self, url=None, client=None, prefix='meditation:ratelimit:'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ValueError("redis is required for RATE_LIMIT_BACKEND=redis (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _now(self):
+        # Server time, so every process agrees on how much has refilled
+        seconds, microseconds = self.client.time()
+        return seconds + microseconds / 1e6
+
+    def _update(self, key, step):
+        from redis.exceptions import WatchError
+
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    tokens, updated = pipe.hmget(name, 'tokens', 'updated')
+                    now = self._now()
+                    result, tokens = step(
+                        float(tokens) if tokens is not None else None,
+                        float(updated) if updated is not None else now,
+                        now
+                    )
+                    pipe.multi()
+                    pipe.hset(name, mapping={'tokens': tokens, 'updated': now})
+                    pipe.expire(name, 3600)
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+    def reserve(self, key, rate, capacity, cost=1, max_wait=0.0):
+        def step(tokens, updated, now):
+            allowed, wait, tokens = take(tokens, updated, now, rate, capacity, cost, max_wait)
+            return (allowed, wait), tokens
+        return self._update(key, step)
+
+    def refund(self, key, capacity, cost=1):
+        def step(tokens, updated, now):
+            if tokens is None:
+                return None, float(capacity)
+            return None, min(float(capacity), tokens + cost)
+        self._update(key, step)
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend():
+    """Shared limiter backend for the configured RATE_LIMIT_BACKEND"""
+    name = get_rate_limit_setting('RATE_LIMIT_BACKEND').lower()
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name == 'memory':
+                backend = MemoryBackend()
+            elif name == 'redis':
+                backend = RedisBackend(get_rate_limit_setting('RATE_LIMIT_REDIS_URL'))
+            else:
+                raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+            _backends[name] = backend
+        return backend
+
+def client_id():
+    """Who a request counts against"""
+    if get_rate_limit_setting('RATE_LIMIT_TRUST_FORWARDED'):
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded.strip():
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+def _bucket(scope):
+    """(rate per second, burst) for 'client' or an upstream"""
+    prefix = f"RATE_LIMIT_{scope.upper()}"
+    return get_rate_limit_setting(f"{prefix}_PER_MINUTE") / 60.0, get_rate_limit_setting(f"{prefix}_BURST")
+
+def admit_generation(client, upstreams=UPSTREAMS, costs=None):
+    """Admission control for one new generation.
+
+    The client bucket answers immediately (no queueing for a single client);
+    buckets of the `upstreams` the generation will call queue up to
+    RATE_LIMIT_MAX_WAIT_SECONDS. `costs` maps an upstream to how many calls
+    the request will make to it (1 by default), so a batch reserves what it
+    will actually use. A `client` of None skips the client bucket, for
+    background work such as prewarming that still has to share the upstream
+    budget. Returns the estimated seconds to wait before starting, or raises
+    RateLimitedError with a Retry-After estimate.
+    """
+    if not get_rate_limit_setting('RATE_LIMIT_ENABLED'):
+        return 0.0
+    backend = get_backend()
+    max_wait = get_rate_limit_setting('RATE_LIMIT_MAX_WAIT_SECONDS')
+    costs = costs or {}
+
+    reserved = []
+    if client is not None:
+        rate, burst = _bucket('client')
+        allowed, retry_after = backend.reserve(f"client:{client}", rate, burst)
+        if not allowed:
+            raise RateLimitedError(
+                "You're creating meditations faster than we can keep up. Please try again shortly.",
+                retry_after, 'client'
+            )
+        reserved.append(('client', f"client:{client}", burst, 1))
+    wait = 0.0
+    for upstream in upstreams:
+        rate, burst = _bucket(upstream)
+        cost = costs.get(upstream, 1)
+        allowed, upstream_wait = backend.reserve(f"upstream:{upstream}", rate, burst, cost=cost, max_wait=max_wait)
+        if not allowed:
+            # Give back what this request already took, since it won't run
+            for _, key, capacity, taken in reserved:
+                backend.refund(key, capacity, taken)
+            logger.warning(f"Rejecting generation: {upstream} queue is full (retry in {upstream_wait:.1f}s)")
+            raise RateLimitedError(
+                "Our meditation service is experiencing high demand. Please try again in a little while.",
+                upstream_wait, upstream
+            )
+        reserved.append((upstream, f"upstream:{upstream}", burst, cost))
+        wait = max(wait, upstream_wait)
+    return wait
+
+class StageLimiter:
+    """Caps how many script or audio calls run at once in this process"""
+
+    def __init__(self):
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, stage):
+        limit = get_rate_limit_setting(f"{stage.upper()}_STAGE_CONCURRENCY")
+        with self._lock:
+            semaphore, size = self._semaphores.get(stage, (None, None))
+            if semaphore is None or size != limit:
+                semaphore = threading.BoundedSemaphore(limit)
+                self._semaphores[stage] = (semaphore, limit)
+            return semaphore
+
+    def acquire(self, stage):
+        """Wait for a slot; returns a callable that releases it"""
+        semaphore = self._semaphore(stage)
+        if not semaphore.acquire(timeout=get_rate_limit_setting('STAGE_SLOT_TIMEOUT')):
+            raise RuntimeError("Our meditation service is experiencing high demand. Please try again in a few minutes.")
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                semaphore.release()
+        return release
+
+    @contextmanager
+    def slot(self, stage):
+        release = self.acquire(stage)
+        try:
+            yield
+        finally:
+            release()
+
+    @asynccontextmanager
+    async def async_slot(self, stage, poll_interval=0.02):
+        """slot() for coroutines: shares the same caps, but waits without blocking the event loop"""
+        semaphore = self._semaphore(stage)
+        deadline = time.monotonic() + get_rate_limit_setting('STAGE_SLOT_TIMEOUT')
+        while not semaphore.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise RuntimeError("Our meditation service is experiencing high demand. Please try again in a few minutes.")
+            await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+# Process-wide concurrency caps for the 'script' and 'audio' stages
+stage_limiter = StageLimiter()
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import random
+import logging
+import argparse
+from collections import defaultdict
+from functools import lru_cache
+from flask import current_app
+
+from models import db, ScriptSegment, normalize_tag
+from services.script_generator import complete_prompt
+from services.audio_generator import request_tts, save_audio, TTS_MODEL_ID
+from services.meditation_cache import get_voice_id
+from services.metrics import timed_stage
+from services.mp3 import join_segments
+from services.rate_limit import stage_limiter
+from services.selections import EMOTIONS, GOALS, OUTCOMES
+from services.storage import get_storage, audio_name
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Generation modes: 'composed' assembles pre-built segments locally,
+# 'custom' writes and voices a whole new script with the LLM and TTS
+GENERATION_MODES = ('custom', 'composed')
+
+# Order segments are spoken in; the selection slots repeat once per selection
+SEGMENT_SLOTS = ('welcome', 'breathing', 'emotion', 'goal', 'outcome', 'closing')
+SELECTION_OPTIONS = {'emotion': EMOTIONS, 'goal': GOALS, 'outcome': OUTCOMES}
+
+# Keeps composed meditations close to the 300-400 words of a custom script
+MAX_SEGMENTS_PER_KIND = 2
+
+# Bump whenever SEGMENT_PROMPTS change; segments built with older prompts are not used
+SEGMENT_PROMPT_VERSION = 1
+
+SEGMENT_PROMPTS = {
+    'welcome': "Write the opening of a guided meditation: a warm welcome that invites the listener "
+               "to find a comfortable position and set aside a few minutes for themselves.",
+    'breathing': "Write the breathing guidance of a guided meditation: lead the listener through a few "
+                 "slow, deep breaths and help them let go of tension in the body.",
+    'emotion': "Write a section of a guided meditation for a listener who is feeling {selection}. "
+               "Acknowledge the feeling with compassion and help them relate to it gently.",
+    'goal': "Write a section of a guided meditation that helps the listener with {selection}.",
+    'outcome': "Write a section of a guided meditation that guides the listener toward {selection}.",
+    'closing': "Write the closing of a guided meditation: gently bring the listener's attention back "
+               "to the room and end with a kind wish for the rest of their day.",
+}
+
+SEGMENT_GUIDELINES = (
+    "This section will be joined with other sections of the same meditation, so keep it "
+    "self-contained and {greeting}. Write 50-80 words of spoken text only, with no headings, "
+    "labels or stage directions."
+)
+
+class MissingSegmentError(RuntimeError):
+    """Raised when the library has no segment for part of a composition"""
+
+    def __init__(self, missing):
+        super().__init__(f"No segments for {', '.join(f'{slot}:{selection}' if selection else slot for slot, selection in missing)}")
+        self.missing = missing
+
+def get_generation_mode():
+    """Default generation mode from Flask context or environment"""
+    try:
+        return current_app.config.get('GENERATION_MODE', 'custom')
+    except RuntimeError:
+        return os.environ.get('GENERATION_MODE', 'custom')
+
+def segment_prompt(slot, selection=None):
+    """Prompt for one segment of the library"""
+    greeting = {
+        'welcome': "don't say goodbye",
+        'closing': "don't welcome the listener",
+    }.get(slot, "don't welcome the listener or say goodbye")
+    prompt = SEGMENT_PROMPTS[slot].format(selection=selection)
+    return f"{prompt}\n{SEGMENT_GUIDELINES.format(greeting=greeting)}"
+
+def plan_segments(emotions, goals, outcomes):
+    """(slot, normalized selection) pairs, in speaking order, for one meditation"""
+    selections = {'emotion': emotions, 'goal': goals, 'outcome': outcomes}
+    plan = [('welcome', ''), ('breathing', '')]
+    for slot in ('emotion', 'goal', 'outcome'):
+        seen = []
+        for name in selections[slot] or []:
+            if name and name.strip() and normalize_tag(name) not in seen:
+                seen.append(normalize_tag(name))
+        plan.extend((slot, selection) for selection in seen[:MAX_SEGMENTS_PER_KIND])
+    plan.append(('closing', ''))
+    return plan
+
+def _library_query(voice_id):
+    return ScriptSegment.query.filter(
+        ScriptSegment.voice_id == voice_id,
+        ScriptSegment.tts_model == TTS_MODEL_ID,
+        ScriptSegment.prompt_version == SEGMENT_PROMPT_VERSION
+    )
+
+def pick_segments(plan, voice_id=None):
+    """One segment per planned slot, choosing among stored variants at random"""
+    wanted = set(plan)
+    variants = defaultdict(list)
+    query = _library_query(voice_id or get_voice_id()).filter(ScriptSegment.slot.in_({slot for slot, _ in plan}))
+    for segment in query:
+        if (segment.slot, segment.selection) in wanted:
+            variants[(segment.slot, segment.selection)].append(segment)
+
+    missing = [entry for entry in plan if not variants[entry]]
+    if missing:
+        raise MissingSegmentError(missing)
+    return [random.choice(variants[entry]) for entry in plan]
+
+def can_compose(emotions, goals, outcomes):
+    """Whether the library holds a segment for every part of these selections"""
+    try:
+        pick_segments(plan_segments(emotions, goals, outcomes))
+    except MissingSegmentError:
+        return False
+    return True
+
+@lru_cache(maxsize=256)
+def _segment_audio(name):
+    # Stored audio is immutable, so segment bytes can be kept in memory for good
+    with get_storage().open(name) as f:
+        return f.read()
+
+def compose_meditation(emotions, goals, outcomes):
+    """Assemble a script and its audio from the segment library; returns (script, audio_url).
+
+    No upstream calls are made: the mp3s of the chosen segments are joined
+    frame by frame. Raises MissingSegmentError when the library can't cover
+    the selections.
+    """
+    with timed_stage('compose'):
+        segments = pick_segments(plan_segments(emotions, goals, outcomes))
+        try:
+            audio = join_segments(_segment_audio(audio_name(segment.audio_url)) for segment in segments)
+        except Exception as e:
+            logger.error(f"Could not read segment audio: {e}")
+            raise MissingSegmentError([(segment.slot, segment.selection) for segment in segments])
+        script = '\n\n'.join(segment.text for segment in segments)
+    logger.info(f"Composed meditation from segments {[segment.id for segment in segments]}")
+    return script, save_audio(audio)
+
+def library_plan(slots=None):
+    """Every (slot, selection name) the library should hold"""
+    entries = []
+    for slot in slots or SEGMENT_SLOTS:
+        if slot in SELECTION_OPTIONS:
+            entries.extend((slot, name) for name in SELECTION_OPTIONS[slot])
+        else:
+            entries.append((slot, None))
+    return entries
+
+def build_segment(slot, name=None, voice_id=None):
+    """Write and voice one segment, then store it in the library"""
+    text = complete_prompt(segment_prompt(slot, name))
+    with stage_limiter.slot('audio'):
+        response = request_tts(text)
+    segment = ScriptSegment(
+        slot=slot,
+        selection=normalize_tag(name) if name else '',
+        text=text,
+        audio_url=save_audio(response.content),
+        voice_id=voice_id or get_voice_id(),
+        tts_model=TTS_MODEL_ID,
+        prompt_version=SEGMENT_PROMPT_VERSION
+    )
+    db.session.add(segment)
+    db.session.commit()
+    return segment
+
+def build_library(variants=1, slots=None, dry_run=False):
+    """Fill the segment library up to `variants` segments per slot and selection"""
+    voice_id = get_voice_id()
+    counts = defaultdict(int)
+    for segment in _library_query(voice_id):
+        counts[(segment.slot, segment.selection)] += 1
+
+    summary = {'planned': 0, 'built': 0, 'failed': 0}
+    for slot, name in library_plan(slots):
+        needed = variants - counts[(slot, normalize_tag(name) if name else '')]
+        for _ in range(max(0, needed)):
+            summary['planned'] += 1
+            if dry_run:
+                print(f"{slot:10s} {name or ''}")
+                continue
+            try:
+                segment = build_segment(slot, name, voice_id)
+            except (ValueError, RuntimeError) as e:
+                summary['failed'] += 1
+                logger.error(f"Building segment {slot}:{name or ''} failed: {e}")
+                continue
+            summary['built'] += 1
+            logger.info(f"Built segment {segment.id} for {slot}:{name or ''}")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate the script segments composed meditations are built from")
+    parser.add_argument('--variants', type=int, default=1, help="segments to keep per slot and selection")
+    parser.add_argument('--slot', action='append', choices=SEGMENT_SLOTS, help="only build these slots (repeatable)")
+    parser.add_argument('--dry-run', action='store_true', help="list the segments that would be built")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+        summary = build_library(variants=args.variants, slots=args.slot, dry_run=args.dry_run)
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,50 @@
 import os
+import re
 import logging
-from openai import OpenAI
 from flask import current_app
 
+from services.clients import (
+    get_openai_client as get_pooled_openai_client, get_async_openai_client as get_pooled_async_openai_client,
+    timed_upstream
+)
+from services.metrics import timed_stage, LLM_TOKENS, SCRIPT_CHARACTERS
+from services.rate_limit import stage_limiter
+
 # Set up logger
 logger = logging.getLogger(__name__)
 
-def get_openai_client():
-    """Get OpenAI client from environment or Flask context"""
+# Model used for script generation
+SCRIPT_MODEL = "gpt-4o"
+
+# Bump whenever generate_prompt changes so cached meditations are not reused
+PROMPT_VERSION = 1
+
+# Version given to meditations written before prompts were versioned
+LEGACY_PROMPT_VERSION = 0
+
+def get_openai_settings():
+    """(API key, base URL) from environment or Flask context"""
     try:
         # Try to get from Flask context
         api_key = current_app.config.get('OPENAI_API_KEY')
+        base_url = current_app.config.get('OPENAI_BASE_URL')
     except RuntimeError:
         # Not in Flask context, try environment variables
         api_key = os.environ.get('OPENAI_API_KEY')
+        base_url = os.environ.get('OPENAI_BASE_URL')
     
     if not api_key:
         raise ValueError("OPENAI_API_KEY is not set")
     
-    return OpenAI(api_key=api_key)
+    return api_key, base_url or None
+
+def get_openai_client():
+    """Get OpenAI client from environment or Flask context"""
+    return get_pooled_openai_client(*get_openai_settings())
+
+def get_async_openai_client():
+    """Get the async OpenAI client for the running event loop"""
+    return get_pooled_async_openai_client(*get_openai_settings())
 
 def generate_prompt(goals, emotions, outcomes):
     """Generate a prompt for the meditation script"""
@@ -31,68 +57,208 @@ def generate_prompt(goals, emotions, outcomes):
     Start with a warm welcome message about the purpose of the meditation.
     Keep the script concise, around 300-400 words."""
 
+SYSTEM_MESSAGE = "You are a Wellness Coach specializing in creating meditation scripts."
+
+def _completion_args(prompt, max_tokens=1000):
+    """Arguments shared by the blocking and streaming completion calls"""
+    return dict(
+        model=SCRIPT_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.7,
+        timeout=60,  # Extended timeout for API call
+    )
+
+def _api_error(api_error):
+    """Map an OpenAI API error to a user-facing RuntimeError"""
+    # Handle specific OpenAI API errors
+    error_message = str(api_error)
+    logger.error(f"OpenAI API error: {error_message}")
+
+    if "rate limit" in error_message.lower():
+        return RuntimeError("Our meditation service is experiencing high demand. Please try again in a few minutes.")
+    elif "timeout" in error_message.lower():
+        return RuntimeError("The request to our meditation service timed out. Please try again.")
+    elif "token" in error_message.lower() and "maximum" in error_message.lower():
+        return RuntimeError("The meditation couldn't be generated due to complexity limits. Please try with fewer selections.")
+    else:
+        # Re-raise with more context
+        return RuntimeError(f"Problem generating meditation script: {error_message}")
+
+def _record_usage(usage):
+    """Count the tokens a completion used, when the API reports them"""
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, kind='prompt')
+    LLM_TOKENS.inc(usage.completion_tokens or 0, kind='completion')
+
+def _log_script_error(log_error):
+    try:
+        current_app.logger.error(log_error)
+    except RuntimeError:
+        logger.error(log_error)
+
 def generate_script(goals, emotions, outcomes):
     """Generate a meditation script using OpenAI"""
-    prompt = generate_prompt(goals, emotions, outcomes)
+    with timed_stage('prompt_build'):
+        prompt = generate_prompt(goals, emotions, outcomes)
+    logger.info(f"Generating script for goals: {goals}, emotions: {emotions}, outcomes: {outcomes}")
+    return complete_prompt(prompt)
+
+def complete_prompt(prompt, max_tokens=1000):
+    """Send a prompt to the script model and return the generated text"""
     try:
-        logger.info(f"Generating script for goals: {goals}, emotions: {emotions}, outcomes: {outcomes}")
         client = get_openai_client()
         
         # Try to create completion with extended timeout and error handling
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a Wellness Coach specializing in creating meditation scripts."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7,
-                timeout=60,  # Extended timeout for API call
-            )
+            with stage_limiter.slot('script'), timed_stage('llm'), timed_upstream('openai'):
+                response = client.chat.completions.create(**_completion_args(prompt, max_tokens))
             script = response.choices[0].message.content.strip()
+            _record_usage(getattr(response, 'usage', None))
+            SCRIPT_CHARACTERS.inc(len(script))
             logger.info("Script generated successfully")
             return script
         except Exception as api_error:
-            # Handle specific OpenAI API errors
-            error_message = str(api_error)
-            logger.error(f"OpenAI API error: {error_message}")
-            
-            if "rate limit" in error_message.lower():
-                raise RuntimeError("Our meditation service is experiencing high demand. Please try again in a few minutes.")
-            elif "timeout" in error_message.lower():
-                raise RuntimeError("The request to our meditation service timed out. Please try again.")
-            elif "token" in error_message.lower() and "maximum" in error_message.lower():
-                raise RuntimeError("The meditation couldn't be generated due to complexity limits. Please try with fewer selections.")
-            else:
-                # Re-raise with more context
-                raise RuntimeError(f"Problem generating meditation script: {error_message}")
+            raise _api_error(api_error)
                 
     except ValueError as e:
         # Handle configuration/setup errors
-        log_error = f"Configuration error in script generation: {e}"
-        try:
-            current_app.logger.error(log_error)
-        except RuntimeError:
-            logger.error(log_error)
+        _log_script_error(f"Configuration error in script generation: {e}")
         raise ValueError(f"Meditation service configuration error: {str(e)}")
         
     except RuntimeError as e:
         # Pass through runtime errors with logging
-        log_error = f"Runtime error in script generation: {e}"
-        try:
-            current_app.logger.error(log_error)
-        except RuntimeError:
-            logger.error(log_error)
+        _log_script_error(f"Runtime error in script generation: {e}")
         raise
         
     except Exception as e:
         # Handle unexpected errors
-        log_error = f"Unexpected error generating script: {e}"
-        try:
-            current_app.logger.error(log_error)
-        except RuntimeError:
-            logger.error(log_error)
+        _log_script_error(f"Unexpected error generating script: {e}")
         
         # Raise a more user-friendly error
         raise RuntimeError("An unexpected error occurred while creating your meditation script. Please try again later.")
+
+# Line that opens each script in a program response; its number is the selection's position
+PROGRAM_MARKER = "=== MEDITATION {number} ==="
+PROGRAM_MARKER_PATTERN = re.compile(r'^\W*=+\s*MEDITATION\s+(\d+)\s*=+\W*$', re.IGNORECASE | re.MULTILINE)
+
+def generate_program_prompt(selection_sets):
+    """One prompt asking for a script per (goals, emotions, outcomes) set of a program"""
+    listing = "\n\n".join(
+        f"""    Meditation {number}:
+    Goals: {', '.join(goals)}
+    Emotions: {', '.join(emotions)}
+    Desired Outcomes: {', '.join(outcomes)}"""
+        for number, (goals, emotions, outcomes) in enumerate(selection_sets, 1)
+    )
+    return f"""Create {len(selection_sets)} meditation scripts for a program the listener will follow over consecutive sessions, one for each of the following:
+
+{listing}
+
+    Each script should be supportive and guide the listener through a mindful experience.
+    Start each script with a warm welcome message about the purpose of that meditation.
+    Vary the imagery, openings and techniques between scripts so the program doesn't feel repetitive.
+    Keep each script concise, around 300-400 words.
+    Begin each script with a line containing only its marker, e.g. {PROGRAM_MARKER.format(number=1)}, and write nothing outside the scripts."""
+
+def split_program(text, count):
+    """Scripts of a program response by position; None where one is missing or empty"""
+    scripts = [None] * count
+    matches = list(PROGRAM_MARKER_PATTERN.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        index = int(match.group(1)) - 1
+        body = text[match.end():following.start() if following else len(text)].strip()
+        if 0 <= index < count and body and scripts[index] is None:
+            scripts[index] = body
+    return scripts
+
+def generate_scripts(selection_sets):
+    """Write scripts for several (goals, emotions, outcomes) sets in one completion.
+
+    Returns the scripts in order. A script the model left out (or that can't
+    be told apart in its response) is written on its own with
+    generate_script, so callers always get one script per set. Raises like
+    generate_script when the shared call fails.
+    """
+    if len(selection_sets) == 1:
+        return [generate_script(*selection_sets[0])]
+
+    with timed_stage('prompt_build'):
+        prompt = generate_program_prompt(selection_sets)
+    logger.info(f"Generating {len(selection_sets)} scripts in one completion")
+    # Room for every script, as a single one gets
+    scripts = split_program(complete_prompt(prompt, max_tokens=1000 * len(selection_sets)), len(selection_sets))
+
+    missing = [i for i, script in enumerate(scripts) if script is None]
+    if missing:
+        logger.warning(f"Program response is missing {len(missing)} of {len(scripts)} scripts; writing them separately")
+    for i in missing:
+        scripts[i] = generate_script(*selection_sets[i])
+    return scripts
+
+def stream_script(goals, emotions, outcomes):
+    """Generate a meditation script using OpenAI, yielding text as it is produced"""
+    with timed_stage('prompt_build'):
+        prompt = generate_prompt(goals, emotions, outcomes)
+    try:
+        logger.info(f"Streaming script for goals: {goals}, emotions: {emotions}, outcomes: {outcomes}")
+        client = get_openai_client()
+
+        try:
+            with stage_limiter.slot('script'), timed_stage('llm'), timed_upstream('openai'):
+                stream = client.chat.completions.create(stream=True, **_completion_args(prompt))
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        SCRIPT_CHARACTERS.inc(len(chunk.choices[0].delta.content))
+                        yield chunk.choices[0].delta.content
+            logger.info("Script streamed successfully")
+        except Exception as api_error:
+            raise _api_error(api_error)
+
+    except ValueError as e:
+        _log_script_error(f"Configuration error in script generation: {e}")
+        raise ValueError(f"Meditation service configuration error: {str(e)}")
+
+    except RuntimeError as e:
+        _log_script_error(f"Runtime error in script generation: {e}")
+        raise
+
+    except Exception as e:
+        _log_script_error(f"Unexpected error generating script: {e}")
+        raise RuntimeError("An unexpected error occurred while creating your meditation script. Please try again later.")
+
+async def generate_script_async(goals, emotions, outcomes):
+    """generate_script for the async server: the completion is awaited instead of holding a thread"""
+    with timed_stage('prompt_build'):
+        prompt = generate_prompt(goals, emotions, outcomes)
+    try:
+        logger.info(f"Generating script for goals: {goals}, emotions: {emotions}, outcomes: {outcomes}")
+        client = get_async_openai_client()
+
+        try:
+            async with stage_limiter.async_slot('script'):
+                with timed_stage('llm'), timed_upstream('openai'):
+                    response = await client.chat.completions.create(**_completion_args(prompt))
+            script = response.choices[0].message.content.strip()
+            _record_usage(getattr(response, 'usage', None))
+            SCRIPT_CHARACTERS.inc(len(script))
+            logger.info("Script generated successfully")
+            return script
+        except Exception as api_error:
+            raise _api_error(api_error)
+
+    except ValueError as e:
+        _log_script_error(f"Configuration error in script generation: {e}")
+        raise ValueError(f"Meditation service configuration error: {str(e)}")
+
+    except RuntimeError as e:
+        _log_script_error(f"Runtime error in script generation: {e}")
+        raise
+
+    except Exception as e:
+        _log_script_error(f"Unexpected error generating script: {e}")
+        raise RuntimeError("An unexpected error occurred while creating your meditation script. Please try again later.")
@@ -0,0 +1,4 @@
+# Options offered by the front ends (keep static/js/app.js in sync)
+EMOTIONS = ["Happy", "Sad", "Anxious", "Calm", "Angry", "Excited"]
+GOALS = ["Relaxation", "Focus", "Better Sleep", "Stress Relief"]
+OUTCOMES = ["Feeling Calm", "Increased Energy", "Mental Clarity", "Emotional Balance"]
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app, request
+from werkzeug.http import parse_date, parse_etags
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Fields a meditation can be projected to with ?fields=
+MEDITATION_FIELDS = (
+    'id', 'title', 'script', 'audio_url', 'duration_seconds',
+    'emotions', 'goals', 'outcomes', 'renditions', 'saved', 'created_at'
+)
+
+# List views leave out the script, which is most of a row's size
+LIST_FIELDS = tuple(f for f in MEDITATION_FIELDS if f != 'script')
+
+def parse_fields(value, default=MEDITATION_FIELDS):
+    """Fields requested as a comma-separated ?fields= value, in canonical order"""
+    if not value:
+        return default
+    requested = {f.strip() for f in value.split(',') if f.strip()}
+    unknown = requested - set(MEDITATION_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Available fields: {', '.join(MEDITATION_FIELDS)}")
+    return tuple(f for f in MEDITATION_FIELDS if f in requested)
+
+def row_version(updated_at, created_at=None):
+    """When a row last changed, for cache keys and HTTP validators"""
+    return updated_at or created_at
+
+def etag_for(kind, row_id, version, fields=None, extra=''):
+    """ETag for one representation of a row (different projections get different tags)"""
+    parts = f"{kind}:{row_id}:{version.isoformat() if version else ''}:{','.join(fields or ())}:{extra}"
+    return hashlib.sha1(parts.encode('utf-8')).hexdigest()[:20]
+
+def _http_second(moment):
+    """A naive UTC datetime cut to the whole second HTTP dates carry"""
+    return moment.replace(microsecond=0, tzinfo=None)
+
+def not_modified(etag, last_modified):
+    """True when the request's validators show the client's copy is current.
+
+    If-None-Match wins whenever it is sent (RFC 9110 13.1.3), so an ETag
+    always decides. Otherwise If-Modified-Since only counts when the row's
+    updated_at second is strictly older than it: HTTP dates have one-second
+    resolution, so an edit later in the same second must not look unmodified.
+    """
+    if_none_match = parse_etags(request.headers.get('If-None-Match'))
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    modified_since = parse_date(request.headers.get('If-Modified-Since'))
+    if modified_since is None or last_modified is None:
+        return False
+    return _http_second(last_modified) < _http_second(modified_since)
+
+def set_validators(response, etag, last_modified):
+    """Attach ETag/Last-Modified and ask clients to revalidate instead of re-fetching.
+
+    Last-Modified is left out while the row's last edit is in the current
+    second, since another edit in that second wouldn't change it (a weak
+    validator, RFC 9110 8.8.2.2); the ETag still covers revalidation.
+    """
+    response.set_etag(etag)
+    if last_modified and _http_second(last_modified) < _http_second(datetime.utcnow()):
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+class SerializedCache:
+    """LRU of meditation summaries (everything except the script), keyed by row version.
+
+    Entries for a row are only used while its updated_at matches, so any change
+    to the row makes the cached form stale without explicit invalidation.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id -> (version, summary dict)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, meditation_id, version):
+        with self._lock:
+            entry = self._entries.get(meditation_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(meditation_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, meditation_id, version, summary):
+        with self._lock:
+            self._entries[meditation_id] = (version, summary)
+            self._entries.move_to_end(meditation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, meditation_id=None):
+        with self._lock:
+            if meditation_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(meditation_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+# Process-wide cache of serialized meditations
+serialized_cache = SerializedCache()
+
+def get_serialized_cache():
+    """Get the shared cache, sized from the Flask context when available"""
+    try:
+        max_entries = current_app.config.get('SERIALIZED_CACHE_MAX_ENTRIES')
+    except RuntimeError:
+        max_entries = os.environ.get('SERIALIZED_CACHE_MAX_ENTRIES')
+    if max_entries is not None:
+        serialized_cache.max_entries = int(max_entries)
+    return serialized_cache
+
+def _summary(meditation):
+    return {
+        'id': meditation.id,
+        'title': meditation.title,
+        'audio_url': meditation.audio_url,
+        'duration_seconds': meditation.duration_seconds,
+        'emotions': meditation.get_emotions(),
+        'goals': meditation.get_goals(),
+        'outcomes': meditation.get_outcomes(),
+        'renditions': meditation.get_renditions(),
+        'saved': meditation.saved,
+        'created_at': meditation.created_at.isoformat() if meditation.created_at else None
+    }
+
+def serialize_meditation(meditation, fields=MEDITATION_FIELDS):
+    """Meditation as an API dict limited to `fields`, reusing the cached summary when current.
+
+    The script is only read from the row when it is asked for, so list queries
+    can defer loading that column.
+    """
+    cache = get_serialized_cache()
+    version = row_version(meditation.updated_at, meditation.created_at)
+    summary = cache.get(meditation.id, version) if meditation.id is not None else None
+    if summary is None:
+        summary = _summary(meditation)
+        if meditation.id is not None:
+            cache.put(meditation.id, version, summary)
+
+    data = {}
+    for field in fields:
+        data[field] = meditation.script if field == 'script' else summary[field]
+    return data
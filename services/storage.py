@@ -0,0 +1,369 @@
+import os
+import shutil
+import mimetypes
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from flask import current_app, send_from_directory, redirect, Response
+from werkzeug.security import safe_join
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# URL prefix the app serves audio under, whatever the backend
+AUDIO_URL_PREFIX = "/static/audio/"
+
+DEFAULTS = {
+    'AUDIO_STORAGE': 'local',
+    'AUDIO_LOCAL_DIR': os.path.join('static', 'audio'),
+    'AUDIO_S3_BUCKET': None,
+    'AUDIO_S3_PREFIX': 'audio/',
+    'AUDIO_S3_ENDPOINT_URL': None,
+    'AUDIO_S3_REGION': None,
+    'AUDIO_PUBLIC_BASE_URL': None,
+    'AUDIO_PRESIGN_EXPIRES': 3600,
+    'AUDIO_SENDFILE': None,
+    'AUDIO_ACCEL_PREFIX': '/protected-audio/',
+    'AUDIO_CACHE_MAX_AGE': 365 * 24 * 3600,
+}
+
+# One stored file as reported by AudioStorage.list() or list_prefix(); modified is a Unix timestamp
+StoredAudio = namedtuple('StoredAudio', ['name', 'size', 'modified'])
+
+# Types for rendition formats that mimetypes may not know
+CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.opus': 'audio/ogg',
+    '.m4a': 'audio/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+def content_type(name):
+    extension = os.path.splitext(name)[1].lower()
+    return CONTENT_TYPES.get(extension) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+def audio_name(audio_url):
+    """File name of the mp3 behind an audio URL"""
+    if not audio_url:
+        return None
+    return audio_url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1] or None
+
+class AudioStorage(ABC):
+    """Where meditation mp3s live and how clients get them.
+
+    Files are immutable once written (every new recording gets a new name),
+    so they can be cached forever by browsers and CDNs.
+    """
+
+    def __init__(self, cache_max_age=DEFAULTS['AUDIO_CACHE_MAX_AGE']):
+        self.cache_max_age = cache_max_age
+
+    @property
+    def cache_control(self):
+        return f"public, max-age={self.cache_max_age}, immutable"
+
+    def url(self, name):
+        """URL stored on Meditation.audio_url"""
+        return f"{AUDIO_URL_PREFIX}{name}"
+
+    @property
+    @abstractmethod
+    def spool_dir(self):
+        """Local directory for files that are still being written"""
+
+    @abstractmethod
+    def save(self, name, data):
+        """Store mp3 bytes and return their URL"""
+
+    @abstractmethod
+    def save_file(self, name, path):
+        """Move a finished local file (e.g. a spooled stream) into storage and return its URL"""
+
+    @abstractmethod
+    def exists(self, name):
+        """Whether a file is stored under this name"""
+
+    @abstractmethod
+    def size(self, name):
+        """Size of a stored file in bytes"""
+
+    @abstractmethod
+    def open(self, name):
+        """Binary file-like object for reading the stored mp3"""
+
+    @abstractmethod
+    def delete(self, name):
+        """Delete a stored file; returns whether it existed"""
+
+    @abstractmethod
+    def delete_prefix(self, prefix):
+        """Delete every stored file under a path prefix (e.g. a rendition directory)"""
+
+    @abstractmethod
+    def list(self):
+        """Yield a StoredAudio for every stored mp3"""
+
+    @abstractmethod
+    def list_prefix(self, prefix):
+        """Yield a StoredAudio for every file under a path prefix, named by its full path"""
+
+    @abstractmethod
+    def serve(self, name):
+        """Flask response that delivers the file without Python streaming it where possible"""
+
+class LocalAudioStorage(AudioStorage):
+    """Files in a local directory, served by Flask or offloaded to the front-end web server"""
+
+    def __init__(self, root=DEFAULTS['AUDIO_LOCAL_DIR'], sendfile=None,
+                 accel_prefix=DEFAULTS['AUDIO_ACCEL_PREFIX'], **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+        self.sendfile = sendfile
+        self.accel_prefix = accel_prefix
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    @property
+    def spool_dir(self):
+        os.makedirs(self.root, exist_ok=True)
+        return self.root
+
+    def save(self, name, data):
+        os.makedirs(os.path.dirname(self._path(name)), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._path(name)), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(name))
+        logger.info(f"Audio saved to {self._path(name)}")
+        return self.url(name)
+
+    def save_file(self, name, path):
+        os.makedirs(os.path.dirname(self._path(name)), exist_ok=True)
+        shutil.move(path, self._path(name))
+        logger.info(f"Audio saved to {self._path(name)}")
+        return self.url(name)
+
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    def size(self, name):
+        return os.path.getsize(self._path(name))
+
+    def open(self, name):
+        return open(self._path(name), 'rb')
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete_prefix(self, prefix):
+        path = safe_join(self.root, prefix.rstrip('/'))
+        if path is None or not os.path.isdir(path):
+            return 0
+        count = sum(len(files) for _, _, files in os.walk(path))
+        shutil.rmtree(path)
+        return count
+
+    def list(self):
+        if not os.path.isdir(self.root):
+            return
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.endswith('.mp3'):
+                stat = entry.stat()
+                yield StoredAudio(entry.name, stat.st_size, stat.st_mtime)
+
+    def list_prefix(self, prefix):
+        path = safe_join(self.root, prefix.rstrip('/'))
+        if path is None or not os.path.isdir(path):
+            return
+        for directory, _, files in os.walk(path):
+            for file_name in files:
+                file_path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                yield StoredAudio(os.path.relpath(file_path, self.root).replace(os.sep, '/'), stat.st_size, stat.st_mtime)
+
+    def serve(self, name):
+        if self.sendfile in ('x-accel-redirect', 'x-sendfile'):
+            path = safe_join(self.root, name)
+            if path is None or not os.path.isfile(path):
+                return Response(status=404)
+            response = Response(mimetype=content_type(name))
+            if self.sendfile == 'x-accel-redirect':
+                # nginx serves the internal location, including Range and ETag handling
+                response.headers['X-Accel-Redirect'] = f"{self.accel_prefix}{name}"
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(path)
+            response.headers['Cache-Control'] = self.cache_control
+            return response
+
+        # send_file handles Range requests, ETag and If-None-Match/If-Modified-Since
+        response = send_from_directory(
+            os.path.abspath(self.root), name,
+            mimetype=content_type(name), conditional=True, etag=True, max_age=self.cache_max_age
+        )
+        response.headers['Cache-Control'] = self.cache_control
+        return response
+
+class S3AudioStorage(AudioStorage):
+    """Files in an S3-compatible bucket (AWS, MinIO, moto), served by redirecting to it or a CDN"""
+
+    def __init__(self, bucket, prefix=DEFAULTS['AUDIO_S3_PREFIX'], endpoint_url=None, region=None,
+                 public_base_url=None, presign_expires=DEFAULTS['AUDIO_PRESIGN_EXPIRES'], client=None, **kwargs):
+        super().__init__(**kwargs)
+        if not bucket:
+            raise ValueError("AUDIO_S3_BUCKET is not set")
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ValueError("boto3 is required for S3 audio storage (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix or ''
+        self.public_base_url = public_base_url.rstrip('/') if public_base_url else None
+        self.presign_expires = presign_expires
+        self._spool_dir = os.path.join(tempfile.gettempdir(), 'meditation-audio')
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+    @property
+    def spool_dir(self):
+        os.makedirs(self._spool_dir, exist_ok=True)
+        return self._spool_dir
+
+    def _extra_args(self, name):
+        return {'ContentType': content_type(name), 'CacheControl': self.cache_control}
+
+    def save(self, name, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data, **self._extra_args(name))
+        logger.info(f"Audio uploaded to s3://{self.bucket}/{self._key(name)}")
+        return self.url(name)
+
+    def save_file(self, name, path):
+        # upload_file switches to multipart for large files
+        self.client.upload_file(path, self.bucket, self._key(name), ExtraArgs=self._extra_args(name))
+        os.remove(path)
+        logger.info(f"Audio uploaded to s3://{self.bucket}/{self._key(name)}")
+        return self.url(name)
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(name))['Body']
+
+    def delete(self, name):
+        if not self.exists(name):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+        return True
+
+    def delete_prefix(self, prefix):
+        count = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys})
+                count += len(keys)
+        return count
+
+    def list(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(self.prefix):]
+                if name.endswith('.mp3') and '/' not in name:
+                    yield StoredAudio(name, obj['Size'], obj['LastModified'].timestamp())
+
+    def list_prefix(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get('Contents', []):
+                yield StoredAudio(obj['Key'][len(self.prefix):], obj['Size'], obj['LastModified'].timestamp())
+
+    def serve(self, name):
+        # The bucket (or the CDN in front of it) handles Range, ETag and caching
+        if self.public_base_url:
+            location = f"{self.public_base_url}/{self._key(name)}"
+        else:
+            location = self.client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket, 'Key': self._key(name)},
+                ExpiresIn=self.presign_expires
+            )
+        response = redirect(location, code=302)
+        # Presigned URLs expire, so only cache the redirect briefly
+        response.headers['Cache-Control'] = 'public, max-age=300' if not self.public_base_url else self.cache_control
+        return response
+
+def get_storage_config():
+    """Get audio storage settings from Flask context or environment"""
+    try:
+        config = current_app.config
+        return {name: config.get(name, default) for name, default in DEFAULTS.items()}
+    except RuntimeError:
+        return {name: os.environ.get(name, default) for name, default in DEFAULTS.items()}
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+def build_storage(config):
+    backend = (config['AUDIO_STORAGE'] or 'local').lower()
+    cache_max_age = int(config['AUDIO_CACHE_MAX_AGE'])
+    if backend == 'local':
+        return LocalAudioStorage(
+            root=config['AUDIO_LOCAL_DIR'],
+            sendfile=(config['AUDIO_SENDFILE'] or '').lower() or None,
+            accel_prefix=config['AUDIO_ACCEL_PREFIX'],
+            cache_max_age=cache_max_age
+        )
+    if backend == 's3':
+        return S3AudioStorage(
+            bucket=config['AUDIO_S3_BUCKET'],
+            prefix=config['AUDIO_S3_PREFIX'],
+            endpoint_url=config['AUDIO_S3_ENDPOINT_URL'],
+            region=config['AUDIO_S3_REGION'],
+            public_base_url=config['AUDIO_PUBLIC_BASE_URL'],
+            presign_expires=int(config['AUDIO_PRESIGN_EXPIRES']),
+            cache_max_age=cache_max_age
+        )
+    raise ValueError(f"Unknown AUDIO_STORAGE backend: {backend}")
+
+def get_storage():
+    """Shared storage backend for the current configuration"""
+    config = get_storage_config()
+    key = tuple(sorted((name, str(value)) for name, value in config.items()))
+    with _storages_lock:
+        storage = _storages.get(key)
+        if storage is None:
+            storage = _storages[key] = build_storage(config)
+        return storage
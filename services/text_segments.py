@@ -0,0 +1,57 @@
+import re
+
+# Segments are cut at paragraph breaks once they reach MIN_SEGMENT_CHARS, and
+# at sentence (or, failing that, word) boundaries before MAX_SEGMENT_CHARS.
+# Very short segments lose prosody across the join, long ones delay playback.
+MIN_SEGMENT_CHARS = 200
+MAX_SEGMENT_CHARS = 2000
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'[.!?…]["\')\]]*\s+')
+
+def _cut_point(buffer, min_chars, max_chars):
+    """Index to cut the buffer at, or None if more text is needed"""
+    # Prefer the last paragraph break past the minimum size
+    cut = None
+    for match in _PARAGRAPH_BREAK.finditer(buffer, 0, max_chars + 1):
+        if match.start() >= min_chars:
+            cut = match.end()
+    if cut is not None:
+        return cut
+
+    if len(buffer) <= max_chars:
+        return None
+
+    # Too long without a usable paragraph break: last sentence end, then last space
+    for match in _SENTENCE_END.finditer(buffer, 0, max_chars + 1):
+        cut = match.end()
+    if cut is None:
+        space = buffer.rfind(' ', 0, max_chars)
+        cut = space + 1 if space > 0 else max_chars
+    return cut
+
+def iter_segments(chunks, min_chars=MIN_SEGMENT_CHARS, max_chars=MAX_SEGMENT_CHARS):
+    """Group streamed text chunks into speakable segments as soon as each is complete"""
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            cut = _cut_point(buffer, min_chars, max_chars)
+            if cut is None:
+                break
+            segment, buffer = buffer[:cut].strip(), buffer[cut:]
+            if segment:
+                yield segment
+
+    # Whatever is left once the text ends, split further if it is still too long
+    while len(buffer) > max_chars:
+        cut = _cut_point(buffer, 0, max_chars)
+        segment, buffer = buffer[:cut].strip(), buffer[cut:]
+        if segment:
+            yield segment
+    if buffer.strip():
+        yield buffer.strip()
+
+def split_text(text, min_chars=MIN_SEGMENT_CHARS, max_chars=MAX_SEGMENT_CHARS):
+    """Split complete text into segments no longer than max_chars"""
+    return list(iter_segments([text], min_chars, max_chars))
@@ -0,0 +1,269 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import has_app_context
+
+from models import db, Meditation
+from services.storage import get_storage, audio_name
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Bitrate ladder: (name, file extension, ffmpeg codec arguments, MIME type, kbps)
+RENDITIONS = [
+    ('opus_32k', 'opus', ['-c:a', 'libopus', '-b:a', '32k', '-ac', '1'], 'audio/ogg; codecs=opus', 32),
+    ('opus_64k', 'opus', ['-c:a', 'libopus', '-b:a', '64k'], 'audio/ogg; codecs=opus', 64),
+    ('aac_128k', 'm4a', ['-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart'], 'audio/mp4', 128),
+]
+
+# Segmented HLS playlist for players that adapt over long listens
+HLS_BITRATE = '64k'
+HLS_SEGMENT_SECONDS = 6
+HLS_MIME_TYPE = 'application/vnd.apple.mpegurl'
+
+# Storage path prefix under which every mp3's renditions are kept
+RENDITIONS_PREFIX = 'renditions/'
+
+def rendition_dir(name):
+    """Storage path prefix holding the renditions of one mp3"""
+    return f"{RENDITIONS_PREFIX}{os.path.splitext(name)[0]}"
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+def encode_renditions(input_path, output_dir):
+    """Encode the bitrate ladder and HLS playlist for one file (runs in a worker process).
+
+    Returns {rendition name: path relative to output_dir}.
+    """
+    outputs = {}
+    base = ['ffmpeg', '-y', '-v', 'error', '-i', input_path, '-vn']
+
+    for name, extension, codec_args, _, _ in RENDITIONS:
+        relative = f"{name}.{extension}"
+        subprocess.run(base + codec_args + [os.path.join(output_dir, relative)], check=True, timeout=600)
+        outputs[name] = relative
+
+    hls_dir = os.path.join(output_dir, 'hls')
+    os.makedirs(hls_dir, exist_ok=True)
+    subprocess.run(base + [
+        '-c:a', 'aac', '-b:a', HLS_BITRATE,
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(hls_dir, 'segment_%03d.ts'),
+        os.path.join(hls_dir, 'index.m3u8')
+    ], check=True, timeout=600)
+    outputs['hls'] = 'hls/index.m3u8'
+    return outputs
+
+def rendition_entries(storage, name, outputs):
+    """Rendition list stored on Meditation.renditions, original first"""
+    entries = [{
+        'name': 'original',
+        'url': storage.url(name),
+        'mime_type': 'audio/mpeg',
+        'bitrate_kbps': None
+    }]
+    prefix = rendition_dir(name)
+    for rendition_name, _, _, mime_type, kbps in RENDITIONS:
+        if rendition_name in outputs:
+            entries.append({
+                'name': rendition_name,
+                'url': storage.url(f"{prefix}/{outputs[rendition_name]}"),
+                'mime_type': mime_type,
+                'bitrate_kbps': kbps
+            })
+    if 'hls' in outputs:
+        entries.append({
+            'name': 'hls',
+            'url': storage.url(f"{prefix}/{outputs['hls']}"),
+            'mime_type': HLS_MIME_TYPE,
+            'bitrate_kbps': int(HLS_BITRATE.rstrip('k'))
+        })
+    return entries
+
+class Transcoder:
+    """Runs ffmpeg in a process pool so encoding never blocks request workers.
+
+    Copying the mp3 out of storage (an S3 download) happens on a background
+    thread too, so schedule() returns immediately, and so do uploading the
+    renditions and recording them, which mustn't hold up the process pool's
+    management thread.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._prepare_executor = None
+        self._finish_executor = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def enabled(self):
+        return bool(self.app and self.app.config.get('TRANSCODE_ENABLED', True)) and ffmpeg_available()
+
+    def _app_context(self):
+        # Reuse the caller's context: pushing a nested one would tear down its DB session
+        return nullcontext() if has_app_context() else self.app.app_context()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.app.config.get('TRANSCODE_WORKERS', 2))
+            return self._executor
+
+    def _preparer(self):
+        with self._lock:
+            if self._prepare_executor is None:
+                self._prepare_executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get('TRANSCODE_WORKERS', 2),
+                    thread_name_prefix='transcode-prepare'
+                )
+            return self._prepare_executor
+
+    def _finisher(self):
+        with self._lock:
+            if self._finish_executor is None:
+                self._finish_executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get('TRANSCODE_WORKERS', 2),
+                    thread_name_prefix='transcode-finish'
+                )
+            return self._finish_executor
+
+    def schedule(self, meditation):
+        """Queue renditions for a meditation's audio once it is complete.
+
+        Called right after the meditation is saved, so it never blocks on
+        storage and never raises; failures are logged and the meditation
+        simply has no renditions.
+        """
+        try:
+            if not self.enabled:
+                return False
+            name = audio_name(meditation.audio_url)
+
+            # Audio still streaming from ElevenLabs is transcoded when it finishes
+            from services.audio_generator import get_active_stream
+            stream = get_active_stream(name)
+            if stream is not None:
+                stream.add_done_callback(lambda s: s.error is None and self._submit(name))
+                return True
+            return self._submit(name)
+        except Exception as e:
+            logger.error(f"Couldn't schedule transcoding for {meditation.audio_url}: {e}", exc_info=True)
+            return False
+
+    def _submit(self, name):
+        """Claim a file and prepare it on a background thread"""
+        with self._lock:
+            if name in self._in_flight:
+                return False
+            self._in_flight.add(name)
+
+        try:
+            self._preparer().submit(self._prepare, name)
+        except Exception as e:
+            self._abandon(name, None, e)
+            return False
+        return True
+
+    def _prepare(self, name):
+        """Copy an mp3 out of storage and hand it to the encoding pool"""
+        work_dir = None
+        try:
+            with self._app_context():
+                storage = get_storage()
+                # Deduplicated audio may already have renditions from another meditation
+                existing = Meditation.query.filter(
+                    Meditation.audio_url == storage.url(name), Meditation.renditions.isnot(None)
+                ).first()
+                if existing:
+                    self._record(name, existing.get_renditions())
+                    with self._lock:
+                        self._in_flight.discard(name)
+                    return
+
+                work_dir = tempfile.mkdtemp(prefix='transcode-')
+                input_path = os.path.join(work_dir, name)
+                with storage.open(name) as src, open(input_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+
+            output_dir = os.path.join(work_dir, 'out')
+            os.makedirs(output_dir)
+            future = self._pool().submit(encode_renditions, input_path, output_dir)
+        except Exception as e:
+            self._abandon(name, work_dir, e)
+            return
+        future.add_done_callback(lambda f: self._hand_off(name, work_dir, output_dir, f))
+        logger.info(f"Queued transcoding for {name}")
+
+    def _hand_off(self, name, work_dir, output_dir, future):
+        """Done callback of an encode: runs on the process pool's management thread, so only queues _finish"""
+        try:
+            self._finisher().submit(self._finish, name, work_dir, output_dir, future)
+        except Exception as e:
+            self._abandon(name, work_dir, e)
+
+    def _abandon(self, name, work_dir, error):
+        """Give up on a file so a later schedule() can try it again"""
+        logger.error(f"Transcoding {name} failed: {error}")
+        if isinstance(error, BrokenProcessPool):
+            # A crashed worker breaks the whole pool; start a new one next time
+            with self._lock:
+                self._executor = None
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        with self._lock:
+            self._in_flight.discard(name)
+
+    def _finish(self, name, work_dir, output_dir, future):
+        try:
+            outputs = future.result()
+            with self._app_context():
+                storage = get_storage()
+                prefix = rendition_dir(name)
+                for root, _, files in os.walk(output_dir):
+                    for file_name in files:
+                        path = os.path.join(root, file_name)
+                        relative = os.path.relpath(path, output_dir).replace(os.sep, '/')
+                        storage.save_file(f"{prefix}/{relative}", path)
+                self._record(name, rendition_entries(storage, name, outputs))
+            logger.info(f"Transcoded {name} into {len(outputs)} renditions")
+        except Exception as e:
+            self._abandon(name, work_dir, e)
+            return
+        shutil.rmtree(work_dir, ignore_errors=True)
+        with self._lock:
+            self._in_flight.discard(name)
+
+    def _record(self, name, entries):
+        with self._app_context():
+            storage = get_storage()
+            for meditation in Meditation.query.filter(Meditation.audio_url == storage.url(name)):
+                meditation.set_renditions(entries)
+            db.session.commit()
+
+    def shutdown(self, wait=True):
+        # In pipeline order, so work handed on by one stage still finds the next one running
+        if self._prepare_executor:
+            self._prepare_executor.shutdown(wait=wait)
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+        if self._finish_executor:
+            self._finish_executor.shutdown(wait=wait)
+
+def delete_renditions(storage, name):
+    """Remove every rendition of an mp3 from storage"""
+    return storage.delete_prefix(rendition_dir(name) + '/')
+
+# Process-wide transcoder, bound to the Flask app in app.py
+transcoder = Transcoder()
@@ -10,6 +10,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const errorMessage = document.getElementById('errorMessage');
     const copyScriptButton = document.getElementById('copyScriptButton');
 
+    // Keep in sync with services/selections.py
     const emotions = ['Happy', 'Sad', 'Anxious', 'Calm', 'Angry', 'Excited'];
     const goals = ['Relaxation', 'Focus', 'Better Sleep', 'Stress Relief'];
     const outcomes = ['Feeling Calm', 'Increased Energy', 'Mental Clarity', 'Emotional Balance'];
@@ -89,11 +90,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({
                     emotions: selectedEmotions,
                     goals: selectedGoals,
-                    outcomes: selectedOutcomes
+                    outcomes: selectedOutcomes,
+                    async: true,
+                    stream: true
                 }),
             });
 
-            const data = await response.json();
+            let data = await response.json();
             
             if (!response.ok) {
                 let errorMessage = 'Failed to generate meditation';
@@ -107,11 +110,23 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (data.validation_errors) {
                     errorMessage = 'Please fix the following issues: ' + data.validation_errors.join(' ');
                 }
+
+                if (response.status === 429 && data.retry_after) {
+                    errorMessage += ` (try again in ${data.retry_after} seconds)`;
+                }
                 
                 console.error('API Error:', data);
                 throw new Error(errorMessage);
             }
 
+            // Job mode: the server accepted the request, poll until it finishes
+            if (response.status === 202) {
+                if (data.estimated_wait_seconds) {
+                    loadingText.textContent = `Waiting for a free slot (about ${data.estimated_wait_seconds} seconds)...`;
+                }
+                data = await waitForJob(data.job_id);
+            }
+
             console.log('Meditation generated successfully:', data);
             displayMeditation(data);
         } catch (error) {
@@ -127,9 +142,41 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    const loadingText = loadingIndicator.querySelector('span');
+    const defaultLoadingText = loadingText.textContent;
+    const stageMessages = {
+        queued: 'Waiting for a free slot...',
+        script: 'Writing your meditation script...',
+        audio: 'Recording your meditation audio...',
+        saving: 'Saving your meditation...'
+    };
+
+    async function waitForJob(jobId) {
+        const pollInterval = 2000;
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, pollInterval));
+
+            const response = await fetch(`/api/jobs/${jobId}`);
+            const job = await response.json();
+            if (!response.ok) {
+                throw new Error(job.error || 'Failed to check meditation progress');
+            }
+
+            if (job.status === 'succeeded') {
+                return job.meditation;
+            }
+            if (job.status === 'failed') {
+                console.error('Job failed:', job);
+                throw new Error(job.error || 'Failed to generate meditation');
+            }
+            loadingText.textContent = stageMessages[job.stage] || defaultLoadingText;
+        }
+    }
+
     function showLoading(isLoading) {
         loadingIndicator.classList.toggle('hidden', !isLoading);
         generateButton.disabled = isLoading;
+        loadingText.textContent = defaultLoadingText;
     }
 
     function showError(message) {
@@ -193,8 +240,11 @@ document.addEventListener('DOMContentLoaded', function() {
             durationElement.classList.remove('hidden');
         }
         
-        // Set audio source
-        audioPlayer.src = data.audio_url;
+        // Set audio source; while synthesis is still running, play from the stream
+        audioPlayer.src = data.stream_url || chooseAudioSource(data);
+        if (data.stream_url) {
+            audioPlayer.play().catch(err => console.log('Autoplay blocked:', err));
+        }
         
         // Show containers
         scriptDisplay.classList.remove('hidden');
@@ -204,6 +254,28 @@ document.addEventListener('DOMContentLoaded', function() {
         scriptDisplay.scrollIntoView({ behavior: 'smooth', block: 'start' });
     }
 
+    function chooseAudioSource(data) {
+        const renditions = (data.renditions || []).filter(r => r.name === 'hls' ? audioPlayer.canPlayType(r.mime_type) : true);
+        if (renditions.length === 0) {
+            return data.audio_url;
+        }
+
+        // Native HLS (Safari, iOS) adapts to the connection by itself
+        const hls = renditions.find(r => r.name === 'hls');
+        if (hls) {
+            return hls.url;
+        }
+
+        // Otherwise pick a bitrate from the connection hints the browser exposes
+        const connection = navigator.connection || {};
+        const slow = connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType);
+        const maxKbps = slow ? 32 : 128;
+        const playable = renditions
+            .filter(r => r.bitrate_kbps && r.bitrate_kbps <= maxKbps && audioPlayer.canPlayType(r.mime_type))
+            .sort((a, b) => b.bitrate_kbps - a.bitrate_kbps);
+        return playable.length > 0 ? playable[0].url : data.audio_url;
+    }
+
     copyScriptButton.addEventListener('click', () => {
         const scriptText = document.getElementById('meditationScript').textContent;
         navigator.clipboard.writeText(scriptText).then(() => {
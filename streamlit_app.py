@@ -1,10 +1,65 @@
 import streamlit as st
 from streamlit_shadcn_ui import ui
-from services.script_generator import generate_script
-from services.audio_generator import generate_audio
+from services.selections import EMOTIONS, GOALS, OUTCOMES
 
 st.set_page_config(page_title="Meditate for Me", page_icon="🧘", layout="wide")
 
+# Recent meditations listed under "History"
+HISTORY_SIZE = 10
+
+@st.cache_resource(show_spinner=False)
+def get_app():
+    """One Flask app per Streamlit server, so every session shares its database
+    engine, meditation cache and pooled upstream clients"""
+    # Imported on first use so page reruns don't pay for the generation stack
+    from app import create_app, prepare_database
+
+    app = create_app()
+    prepare_database(app)
+    return app
+
+def generate(emotions, goals, outcomes, fresh=False):
+    """Generate (or reuse) a meditation through the same service as the API; returns it serialized.
+
+    Not memoized here: the service's meditation cache already reuses results
+    across sessions, and only hands out rows whose audio is still stored.
+    """
+    from services.generation import get_or_create_meditation
+    from services.serialization import serialize_meditation
+
+    with get_app().app_context():
+        meditation, cached = get_or_create_meditation(list(emotions), list(goals), list(outcomes), fresh=fresh)
+        result = serialize_meditation(meditation)
+        result['cached'] = cached
+        return result
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def audio_bytes(audio_url):
+    """Stored mp3 for an audio URL (files are immutable, so they are cached for good)"""
+    from services.storage import get_storage, audio_name
+
+    with get_app().app_context():
+        with get_storage().open(audio_name(audio_url)) as f:
+            return f.read()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def recent_meditations():
+    from services.library import list_meditations
+    from services.serialization import serialize_meditation
+
+    with get_app().app_context():
+        meditations, _ = list_meditations(limit=HISTORY_SIZE, load_script=True)
+        return [serialize_meditation(meditation) for meditation in meditations]
+
+def show_meditation(meditation):
+    st.subheader(meditation['title'])
+    if meditation.get('cached'):
+        st.caption("Served from earlier meditations with the same selections.")
+    st.write(meditation['script'])
+
+    st.subheader("Listen to Your Meditation")
+    st.audio(audio_bytes(meditation['audio_url']), format='audio/mpeg')
+
 def main():
     st.title("Meditate for Me")
 
@@ -18,23 +73,39 @@ def main():
         5. Listen to your custom meditation audio or read the script.
         """)
 
-    emotions = ui.multi_select("Select Your Current Emotions", ["Happy", "Sad", "Anxious", "Calm", "Angry", "Excited"])
-    goals = ui.multi_select("Select Your Meditation Goals", ["Relaxation", "Focus", "Better Sleep", "Stress Relief"])
-    outcomes = ui.multi_select("Select Your Desired Outcomes", ["Feeling Calm", "Increased Energy", "Mental Clarity", "Emotional Balance"])
+    emotions = ui.multi_select("Select Your Current Emotions", EMOTIONS)
+    goals = ui.multi_select("Select Your Meditation Goals", GOALS)
+    outcomes = ui.multi_select("Select Your Desired Outcomes", OUTCOMES)
+    selections = tuple(tuple(sorted(set(values or []))) for values in (emotions, goals, outcomes))
+    ready = all(selections)
 
-    if ui.button("Generate Meditation", disabled=not (emotions and goals and outcomes)):
+    generate_clicked = ui.button("Generate Meditation", disabled=not ready, key='generate')
+    fresh_clicked = ui.button("Generate a New Variation", variant='outline', disabled=not ready, key='generate_fresh')
+    if ready and (generate_clicked or fresh_clicked):
         with st.spinner("Generating meditation..."):
             try:
-                script = generate_script(goals, emotions, outcomes)
-                audio_url = generate_audio(script)
-                
-                st.subheader("Your Personalized Meditation Script")
-                st.write(script)
-                
-                st.subheader("Listen to Your Meditation")
-                st.audio(audio_url)
+                st.session_state['meditation'] = generate(*selections, fresh=fresh_clicked)
+                recent_meditations.clear()
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
 
+    if st.session_state.get('meditation'):
+        show_meditation(st.session_state['meditation'])
+
+    st.header("History")
+    try:
+        history = recent_meditations()
+    except Exception as e:
+        st.error(f"Could not load earlier meditations: {str(e)}")
+        history = []
+    if not history:
+        st.caption("Meditations you generate will appear here.")
+    for meditation in history:
+        with st.expander(f"{meditation['title']} · {meditation['created_at'][:16].replace('T', ' ')}"):
+            st.caption(", ".join(meditation['emotions'] + meditation['goals'] + meditation['outcomes']))
+            if st.button("Open", key=f"open_{meditation['id']}"):
+                st.session_state['meditation'] = meditation
+                st.rerun()
+
 if __name__ == "__main__":
     main()